@@ -1,10 +1,22 @@
 import os
-import json
 import asyncio
+import itertools
 import aiohttp
-import requests
 from aiofiles import open as aio_open
-import jq
+from contextlib import asynccontextmanager
+
+from drucom.client import AdaptiveLimiter, DrupalClient, get_json_blocking
+from drucom.codec import ListStreamParser, PageStream, RawBody, dumpb
+from drucom.keyset import check_cursor, cursor_params, resume_cursor, split_ids
+from drucom.manifest import CrawlManifest
+from drucom.metrics import Metrics
+from drucom.pool import PageJob
+from drucom.reducers import CommentCounter
+from drucom.scheduler import PagePipeline
+from drucom.sinks import JsonPageSink, make_sink
+from drucom.snapshot import Snapshots
+from drucom.sync import SyncState, next_delta_file, remove_deltas
+from drucom.transform import MappingTransformer
 
 
 class DrupalDataFetcher:
@@ -13,8 +25,17 @@ class DrupalDataFetcher:
 
     It can fetch users, organizations, modules, events and themes from d.o.
     It uses asynchronous requests to improve performance.
+    It can serve responses from an on-disk cache (see `drucom.cache.ResponseCache`).
     It transforms raw data using jq filters to extract and format relevant field.
-    It saves the data in JSON files in the `../data/json` directory. 
+    The filters are compiled once per fetcher and applied to batches of items,
+    decoded from the responses as they arrive (see `drucom.codec.PageStream`),
+    or in a pool of threads or processes (see `drucom.pool.TransformPool`).
+    It saves the data in JSON files in the `../data/json` directory, or in
+    NDJSON or Parquet part files (see `drucom.sinks`).
+    Once a full crawl to JSON pages is indexed (see `drucom.snapshot`), the
+    next full crawls of numbered pages only write the records added, changed or deleted since
+    to a delta file, instead of rewriting every page.
+    It records request, transform and write metrics (see `drucom.metrics.Metrics`).
     """
 
     BASE_URL = "https://www.drupal.org/api-d7"
@@ -25,15 +46,63 @@ class DrupalDataFetcher:
         "User-Agent": "Drucom 0.1.0"
     }
 
-    def __init__(self, dataset_name):
+    # The number of raw items decoded before they are transformed.
+    STREAM_BATCH_SIZE = 100
+
+    def __init__(self, dataset_name, backend="jq", output_folder=None, cache=None, metrics=None,
+                 sink="json", pool=None, partitions=None, rewrite=False):
+        """
+        Initialize the fetcher for a dataset.
+        Args:
+            dataset_name (str): The name of the dataset.
+            backend (str): The transform backend, `jq` or `python`.
+            output_folder (str): The output folder. Defaults to `../data/json/<dataset>`.
+            cache (ResponseCache): The optional response cache.
+            metrics (Metrics): The metrics registry, shared with other crawls.
+            sink (str): Where full crawls write their pages: `json`, `ndjson`,
+                `ndjson.zst` or `parquet` (see `drucom.sinks.make_sink`).
+            pool (TransformPool): The optional pool transforming the pages of full
+                crawls off the event loop, shared with other crawls. By default,
+                pages are transformed on the event loop as they arrive.
+            partitions (int): Crawl this many id ranges concurrently with keyset
+                cursors (see `drucom.keyset`), instead of numbered pages.
+            rewrite (bool): Whether full crawls rewrite every page, rather than
+                writing a delta of the changes since the last snapshot.
+        Raises:
+            ValueError: If the dataset name or the sink is unknown.
+        """
         self.dataset_name = dataset_name
         self.mapping = self.get_mapping(dataset_name)
         if self.mapping is None:
             raise ValueError(f"Unknown dataset: {dataset_name}")
-        self.output_folder = os.path.join(
+        self.transformer = MappingTransformer(self.mapping, backend)
+        self.output_folder = output_folder or os.path.join(
             os.path.dirname(__file__), f"../data/json/{dataset_name}"
         )
         os.makedirs(self.output_folder, exist_ok=True)
+        self.sync_state = None
+        if dataset_name in SyncState.FIELDS:
+            self.sync_state = SyncState(self.output_folder, dataset_name)
+        self.failed_pages = 0
+        self.manifest = CrawlManifest(
+            os.path.join(self.output_folder, "manifest.json"))
+        self.cache = cache
+        self.metrics = metrics or Metrics()
+        self.sink = make_sink(sink, self.output_folder, dataset_name, self.serialize)
+        self.pool = pool
+        self.partitions = partitions
+        self.reducer = None
+        if dataset_name == "comment":
+            self.reducer = CommentCounter(
+                os.path.join(self.output_folder, "counts.json"))
+        # Snapshots index the JSON pages. Reducers need every page of the crawl.
+        self.snapshots = None
+        if isinstance(self.sink, JsonPageSink) and self.reducer is None:
+            self.snapshots = Snapshots(self.output_folder)
+        self.rewrite = rewrite
+        self.diff = None
+        # Whether the planned crawl rewrites the output, superseding the snapshot and the deltas.
+        self.rewriting = False
 
     @staticmethod
     def get_mapping(name):
@@ -59,8 +128,6 @@ class DrupalDataFetcher:
             "language": "(.field_user_primary_language // null)",
             "languages": "(.field_languages // [])",
             "timezone": "(.timezone // null)",
-            "region": "(if .timezone | length > 0 then (.timezone | tostring | split(\"/\") | first) else null end)",
-            "city": "(if .timezone | length > 0 then (.timezone | tostring | split(\"/\") | last) else null end)",
             "organizations": "(if (.field_organizations | type == \"array\") then .field_organizations | map(.id | tostring) else [] end)",
             "industries": "(.field_industries // null)",
             "contributions": "(.field_contributed // null)",
@@ -111,7 +178,8 @@ class DrupalDataFetcher:
 
         taxonomy_terms_mapping = {
             "id": ".tid",
-            "name": ".name"
+            "name": ".name",
+            "vocabulary": "(if (.vocabulary | type == \"object\") then .vocabulary.id else null end)"
         }
 
         theme_mapping = {
@@ -121,7 +189,16 @@ class DrupalDataFetcher:
             "changed": ".changed",
             "author": "(.author.id // null)",
             "slug": ".field_project_machine_name",
-            "stars": "(.flag_project_star_user // [] | length // 0)"
+            "stars": "(.flag_project_star_user // [] | length // 0)",
+            "maintenance_status": "(if (.taxonomy_vocabulary_44 | type == \"object\") then .taxonomy_vocabulary_44.id else null end)",
+            "development_status": "(if (.taxonomy_vocabulary_46 | type == \"object\") then .taxonomy_vocabulary_46.id else null end)"
+        }
+
+        comment_mapping = {
+            "id": ".cid",
+            "author": "(.author.id // null)",
+            "node": "(.node.id // null)",
+            "created": ".created"
         }
 
         mappings = {
@@ -130,11 +207,53 @@ class DrupalDataFetcher:
             "module": module_mapping,
             "event": event_mapping,
             "module_terms": taxonomy_terms_mapping,
-            "theme": theme_mapping
+            "theme": theme_mapping,
+            "comment": comment_mapping
         }
 
         return mappings.get(name, None)
 
+    @staticmethod
+    def get_endpoint(name):
+        """
+        Get the API endpoint and the query parameters for a specific dataset.
+        Every dataset is sorted by its id in ascending order.
+        Args:
+            name (str): The name of the dataset.
+        Returns:
+            tuple: The endpoint (e.g. `node.json`) and the parameters.
+        Raises:
+            ValueError: If the dataset name is unknown.
+        """
+        if name == 'event':
+            endpoint = 'node.json'
+            params = {'type': 'event', 'sort': 'nid', 'direction': 'ASC'}
+        elif name == 'user':
+            endpoint = 'user.json'
+            params = {'sort': 'uid', 'direction': "ASC"}
+        elif name == 'organization':
+            endpoint = 'node.json'
+            params = {'type': 'organization',
+                      'sort': 'nid', 'direction': 'ASC'}
+        elif name == 'module':
+            endpoint = 'node.json'
+            params = {'type': 'project_module',
+                      'sort': 'nid', 'direction': 'ASC'}
+        elif name == 'module_terms':
+            endpoint = 'taxonomy_term.json'
+            params = {'vocabulary[]': ['3', '44', '46'],
+                      'sort': 'tid', 'direction': 'ASC'}
+        elif name == 'theme':
+            endpoint = 'node.json'
+            params = {'type': 'project_theme',
+                      'sort': 'nid', 'direction': 'ASC'}
+        elif name == 'comment':
+            endpoint = 'comment.json'
+            params = {'sort': 'cid', 'direction': 'ASC'}
+        else:
+            raise ValueError(f"Unknown dataset: {name}")
+        return endpoint, params
+
     def get_total_pages(self, url, params):
         """
         Get the total number of pages for a given URL and parameters.
@@ -144,117 +263,648 @@ class DrupalDataFetcher:
             url (str): The URL to request.
             params (dict): The parameters to include in the request.
         Returns:
-            int: The total number of pages.
+            int: The total number of pages, or None if the request failed.
         """
         try:
-            data = requests.get(url, headers=self.HEADERS, params={
-                                **params, 'full': 0, 'limit': 1}).json()
-            total_pages = int(data['last'].split('page=')[1])
-            if total_pages == 0:
-                return 0
-
-            data = requests.get(url, headers=self.HEADERS, params={
-                                **params, 'full': 0}).json()
-            return int(data['last'].split('page=')[1])
+            data = get_json_blocking(url, {**params, 'full': 0, 'limit': 1},
+                                     self.HEADERS, self.cache, metrics=self.metrics)
+            last_page = int(data['last'].split('page=')[1])
+            if last_page == 0:
+                # One page of one item at most.
+                return len(data.get('list', []))
+
+            # Only the envelope is needed, skip the items as they arrive.
+            data = get_json_blocking(url, {**params, 'full': 0},
+                                     self.HEADERS, self.cache, metrics=self.metrics,
+                                     decoder=ListStreamParser)
+            # Pages are numbered from 0, the last page is included.
+            return int(data['last'].split('page=')[1]) + 1
         except Exception as e:
             print(f"Error fetching total pages: {e}")
-            return 0
+            self.metrics.inc("discovery_errors_total", dataset=self.dataset_name)
+            return None
+
+    def get_max_id(self, url, params):
+        """
+        Get the highest id of a dataset, with a single request for one reference.
+        Args:
+            url (str): The URL to request.
+            params (dict): The parameters of the dataset, sorted by id.
+        Returns:
+            int: The highest id, 0 if the dataset is empty, or None if the request failed.
+        """
+        try:
+            data = get_json_blocking(url, {**params, 'direction': 'DESC', 'full': 0, 'limit': 1},
+                                     self.HEADERS, self.cache, metrics=self.metrics)
+            items = data.get('list', [])
+            return int(items[0]['id']) if items else 0
+        except Exception as e:
+            print(f"Error fetching the highest id: {e}")
+            self.metrics.inc("discovery_errors_total", dataset=self.dataset_name)
+            return None
 
-    async def fetch_page(self, session, url, params, page):
+    async def fetch_page(self, client, url, params, page, decoder=None):
         """
-        Fetch a single page asynchronously and save the transformed data.
+        Fetch a single page asynchronously.
         Args:
-            session (aiohttp.ClientSession): The session to use for the request.
+            client (DrupalClient): The client to use for the request.
             url (str): The URL to request.
             params (dict): The parameters to include in the request.
             page (int): The page number to fetch.
+            decoder (callable): Makes a streaming decoder for the response
+                (e.g. `page_stream`). By default, the page is decoded at once.
+        Returns:
+            dict: The page data, or None if the request failed.
         """
-        params['page'] = page
         try:
-            async with session.get(url, params=params) as response:
-                data = await response.json()
-                jq_filter_string = '{' + ', '.join(
-                    [f'"{key}": {value}' for key, value in self.mapping.items()]) + '}'
-                jq_filter = jq.compile(jq_filter_string)
-                transformed_data = [jq_filter.transform(
-                    item) for item in data.get('list', [])]
-
-                output_file = os.path.join(
-                    self.output_folder, f"page_{page}.json")
-                async with aio_open(output_file, 'w') as f:
-                    await f.write(json.dumps(transformed_data, separators=(',', ':')))
-                print(f"Saved page {page + 1} to {output_file}")
+            return await client.get_json(url, {**params, 'page': page}, decoder)
         except Exception as e:
             print(f"Error fetching page {page}: {e}")
+            self.failed_pages += 1
+            self.metrics.inc("pages_total", dataset=self.dataset_name, status="fetch_failed")
+            return None
+
+    def page_stream(self):
+        """
+        Make a streaming decoder for a page, transforming its items in batches.
+        Returns:
+            PageStream: The decoder, returning the page with its `records`.
+        """
+        return PageStream(self.transform_items, self.STREAM_BATCH_SIZE)
+
+    @property
+    def process_workers(self):
+        """
+        The number of pages of a full crawl transformed at once.
+        """
+        return self.pool.workers if self.pool is not None else 1
+
+    def page_job(self):
+        """
+        Describe the pages of the dataset for a transform pool.
+        Returns:
+            PageJob: The job, encoding records for the output sink.
+        """
+        return PageJob(self.dataset_name, self.mapping, self.transformer.backend,
+                       self.sink.encode, self.sync_state and self.sync_state.field)
+
+    def transform_items(self, items):
+        """
+        Transform raw items into records, observing them for incremental syncs.
+        Args:
+            items (list): The raw items, as returned by the API.
+        Returns:
+            list: The transformed records.
+        """
+        if self.sync_state is not None:
+            self.sync_state.observe(items)
+        with self.metrics.timer("transform_seconds", dataset=self.dataset_name):
+            return self.transformer.transform(items)
+
+    def serialize(self, records):
+        """
+        Serialize transformed records to compact JSON.
+        Args:
+            records (list): The transformed records.
+        Returns:
+            bytes: The JSON document, in UTF-8.
+        """
+        return dumpb(records)
+
+    async def save_page(self, page, data):
+        """
+        Transform a fetched page and write it to the output sink.
+        Args:
+            page (int): The page number.
+            data (dict|bytes): The page data, as returned by the API, as decoded
+                by `page_stream` with its transformed `records`, or the raw
+                body to transform in the pool.
+        Returns:
+            int: The number of records saved, or None if saving failed.
+        """
+        metrics = self.metrics
+        try:
+            if isinstance(data, bytes):
+                return await self.save_raw_page(page, data)
+            if 'records' in data:
+                transformed_data = data['records']
+            else:
+                transformed_data = self.transform_items(data.get('list', []))
+            if self.diff is not None:
+                return self.compared(page, transformed_data)
+            with metrics.timer("write_seconds", dataset=self.dataset_name):
+                await self.sink.write(page, transformed_data)
+            if self.reducer is not None:
+                self.reducer.add_page(page, transformed_data)
+            return self.saved(page, len(transformed_data))
+        except Exception as e:
+            print(f"Error saving page {page}: {e}")
+            self.failed_pages += 1
+            metrics.inc("pages_total", dataset=self.dataset_name, status="save_failed")
+            return None
+
+    async def save_raw_page(self, page, body):
+        """
+        Transform and encode a raw page in the pool, then write it to the output sink.
+        Args:
+            page (int): The page number.
+            body (bytes): The raw response body.
+        Returns:
+            int: The number of records saved.
+        """
+        result = await self.pool.process(self.page_job(), body)
+        self.metrics.observe("transform_seconds", result.seconds, dataset=self.dataset_name)
+        if self.sync_state is not None:
+            self.sync_state.advance(result.seen)
+        if self.diff is not None:
+            return self.compared(page, self.sink.decode(result.data))
+        with self.metrics.timer("write_seconds", dataset=self.dataset_name):
+            await self.sink.write_encoded(page, result.data, result.count)
+        if self.reducer is not None:
+            self.reducer.add_page(page, self.sink.decode(result.data))
+        return self.saved(page, result.count)
+
+    def saved(self, page, records):
+        """
+        Record a saved page.
+        Args:
+            page (int): The page number.
+            records (int): The number of records saved.
+        Returns:
+            int: The number of records saved.
+        """
+        self.metrics.inc("pages_total", dataset=self.dataset_name, status="saved")
+        self.metrics.inc("records_total", records, dataset=self.dataset_name)
+        print(f"Saved page {page + 1} to {self.sink.folder}")
+        return records
+
+    def compared(self, page, records):
+        """
+        Compare the records of a page to the last snapshot, instead of saving them.
+        Args:
+            page (int): The page number.
+            records (list): The transformed records.
+        Returns:
+            int: The number of records compared.
+        """
+        changed = self.diff.add(records)
+        self.metrics.inc("pages_total", dataset=self.dataset_name, status="compared")
+        self.metrics.inc("records_total", len(records), dataset=self.dataset_name)
+        print(f"Compared page {page + 1} of {self.dataset_name}: {changed} changed records")
+        return len(records)
 
-    async def fetch_all_pages(self, url, params, total_pages, max_concurrent_requests=100):
+    async def fetch_tracked_page(self, client, url, params, page):
         """
-        Fetch all pages asynchronously with a limit on concurrent requests.
+        Fetch a page of a full crawl and record it in the manifest.
+        With a transform pool, the raw body is returned for `save_page`.
+        Pages compared to a snapshot are not recorded: the manifest describes
+        the page files.
         Args:
+            client (DrupalClient): The client to use for the request.
             url (str): The URL to request.
             params (dict): The parameters to include in the request.
-            total_pages (int): The total number of pages to fetch.
+            page (int): The page number to fetch.
+        Returns:
+            dict|bytes: The page data, or None if the request failed.
+        """
+        tracked = self.diff is None
+        if tracked:
+            self.manifest.start(page)
+        decoder = self.page_stream if self.pool is None else RawBody
+        data = await self.fetch_page(client, url, params, page, decoder)
+        if data is None and tracked:
+            self.manifest.fail(page, "fetch failed")
+        return data
+
+    async def save_tracked_page(self, page, data):
+        """
+        Save a page of a full crawl and record it in the manifest.
+        Args:
+            page (int): The page number.
+            data (dict): The page data, as returned by the API.
+        """
+        records = await self.save_page(page, data)
+        if self.diff is not None:
+            return
+        if records is None:
+            self.manifest.fail(page, "save failed")
+        else:
+            self.manifest.done(page, records)
+
+    @asynccontextmanager
+    async def open_client(self, max_concurrent_requests, client=None):
+        """
+        Open a session and an adaptive client for a crawl.
+        Args:
             max_concurrent_requests (int): The maximum number of concurrent requests.
+            client (DrupalClient): A client shared with other crawls. It is used
+                as is and left open.
+        Yields:
+            DrupalClient: The client, closed on exit.
         """
+        if client is not None:
+            yield client
+            return
         connector = aiohttp.TCPConnector(limit=max_concurrent_requests)
         async with aiohttp.ClientSession(headers=self.HEADERS, connector=connector) as session:
-            tasks = [
-                self.fetch_page(session, url, params, page)
-                for page in range(total_pages)
-            ]
-            await asyncio.gather(*tasks)
+            yield DrupalClient(session, AdaptiveLimiter(
+                initial=min(16, max_concurrent_requests), maximum=max_concurrent_requests),
+                cache=self.cache, metrics=self.metrics)
+
+    async def fetch_all_pages(self, url, params, pages, max_concurrent_requests=100, max_pending_pages=None, client=None):
+        """
+        Fetch pages with a fixed pool of workers and bounded memory.
+        Pages are fetched by `max_concurrent_requests` workers and handed over to
+        a separate transform/write stage through a bounded queue, so only a few
+        pages are held in memory at once whatever the total number of pages.
+        Requests go through an adaptive client which lowers the concurrency
+        below `max_concurrent_requests` when the server throttles.
+        The progress of every page is recorded in the crawl manifest.
+        Args:
+            url (str): The URL to request.
+            params (dict): The parameters to include in the request.
+            pages (int|iterable): The total number of pages, or the page numbers to fetch.
+            max_concurrent_requests (int): The maximum number of concurrent requests.
+            max_pending_pages (int): The maximum number of fetched pages waiting
+                to be saved. Defaults to `max_concurrent_requests`.
+            client (DrupalClient): A client shared with other crawls.
+        """
+        if isinstance(pages, int):
+            pages = range(pages)
+
+        try:
+            async with self.open_client(max_concurrent_requests, client) as client:
+                pipeline = PagePipeline(
+                    lambda page: self.fetch_tracked_page(client, url, params, page),
+                    self.save_tracked_page,
+                    fetch_workers=max_concurrent_requests,
+                    process_workers=self.process_workers,
+                    max_pending=max_pending_pages,
+                    metrics=self.metrics,
+                )
+                await pipeline.run(pages)
+        finally:
+            self.flush()
+
+    def flush(self):
+        """
+        Complete the pages written to the output sink and save the manifest.
+        """
+        try:
+            self.sink.close()
+        finally:
+            self.manifest.flush()
+
+    async def fetch_changed_pages(self, url, params, max_concurrent_requests=4, client=None):
+        """
+        Fetch the records changed since the last run and save them to a delta file.
+        Pages are requested by descending sync field (see `SyncState.FIELDS`)
+        and the crawl stops at the first page reaching the high-water mark.
+        Delta files are JSON whatever the sink of full crawls. Records unchanged
+        since the last snapshot, if any, are left out.
+        Args:
+            url (str): The URL to request.
+            params (dict): The parameters to include in the request.
+            max_concurrent_requests (int): The maximum number of concurrent requests.
+                Pages fetched past the mark are wasted, so keep it low.
+            client (DrupalClient): A client shared with other crawls.
+        Returns:
+            int: The number of changed records.
+        """
+        state = self.sync_state
+        params = {**params, 'sort': state.field, 'direction': 'DESC'}
+        records = {}
+        done = False
+
+        async def fetch(client, page):
+            nonlocal done
+            data = await self.fetch_page(client, url, params, page)
+            if data is None:
+                # Give up, the mark is not moved when a page failed.
+                done = True
+            return data
+
+        async def save_changes(page, data):
+            nonlocal done
+            items = data.get('list', [])
+            changed = [item for item in items if state.is_new(item)]
+            if len(changed) < len(items) or 'next' not in data:
+                done = True
+            state.observe(changed)
+            for record in self.transformer.transform(changed):
+                records[record['id']] = record
+
+        async with self.open_client(max_concurrent_requests, client) as client:
+            pipeline = PagePipeline(
+                lambda page: fetch(client, page),
+                save_changes,
+                fetch_workers=max_concurrent_requests,
+                metrics=self.metrics,
+            )
+            await pipeline.run(itertools.takewhile(lambda _: not done, itertools.count()))
+
+        records = list(records.values())
+        diff = None
+        if self.snapshots is not None and self.snapshots.index is not None:
+            diff = self.snapshots.diff()
+            diff.add(records)
+            records = diff.delta()
+        output_file = None
+        if records:
+            output_file = state.next_delta_file()
+            async with aio_open(output_file, 'wb') as f:
+                await f.write(self.serialize(records))
+            print(f"Saved {len(records)} changed records to {output_file}")
+        if diff is not None:
+            self.snapshots.commit(diff, "incremental", output_file)
+        return len(records)
 
-    def process(self, url, params):
+    def process(self, url, params, resume=False):
         """
         Process the data asynchronously.
         Args:
             url (str): The URL to request.
             params (dict): The parameters to include in the request.
+            resume (bool): Whether to only fetch the pages which are not done
+                in the manifest of the previous crawl.
         Returns:
-            int: The total number of pages processed.
+            int: The total number of pages processed. For keyset crawls, the
+            number of pages saved.
         """
-        total_pages = self.get_total_pages(url, params)
+        if self.partitions:
+            with self.metrics.phase("discovery"):
+                ranges = self.plan_ranges(url, params, resume)
+            with self.metrics.phase("fetch"):
+                return asyncio.run(self.fetch_ranges(url, params, ranges))
+        with self.metrics.phase("discovery"):
+            total_pages, pages = self.plan_pages(url, params, resume)
         if total_pages >= 0:
-            asyncio.run(self.fetch_all_pages(url, params, total_pages))
+            with self.metrics.phase("fetch"):
+                asyncio.run(self.fetch_all_pages(url, params, pages))
         return total_pages
 
-    def run(self):
+    def plan_pages(self, url, params, resume=False):
+        """
+        Discover the pages of a full crawl and prepare its manifest and sink.
+        A new crawl removes the pages and the deltas of the previous one. Pages
+        done in the manifest but missing from the sink (e.g. in a part file
+        lost in a crash) are fetched again.
+        When the last snapshot is indexed, every page is fetched and compared
+        to it instead (see `finish`), unless rewriting the pages. Comparisons
+        are not recorded in the manifest: resuming one compares every page again.
+        Args:
+            url (str): The URL to request.
+            params (dict): The parameters to include in the request.
+            resume (bool): Whether to keep the manifest of the previous crawl
+                and only plan the pages which are not done.
+        Returns:
+            tuple: The total number of pages, and the list of pages to fetch.
+            Nothing is fetched when the discovery failed, and the manifest and
+            the sink of the previous crawl are kept.
+        """
+        self.diff = None
+        self.rewriting = False
+        total_pages = self.get_total_pages(url, params)
+        if total_pages is None:
+            self.failed_pages += 1
+            return 0, []
+        if self.snapshots is not None:
+            if self.snapshots.index is not None and not self.rewrite:
+                self.diff = self.snapshots.diff()
+                if total_pages <= 0:
+                    # Nothing compared: every record would look deleted.
+                    self.failed_pages += 1
+                return total_pages, list(range(max(total_pages, 0)))
+            self.snapshots.discard()
+        meta = self.manifest.meta
+        if not resume or meta.get("url") != url or "ranges" in meta:
+            self.manifest.reset(url=url, params=params)
+            self.sink.reset()
+            remove_deltas(self.output_folder)
+        else:
+            self.sink.prune(self.manifest.is_done)
+        self.manifest.meta["total_pages"] = total_pages
+        pages = [page for page in range(max(total_pages, 0))
+                 if not self.manifest.is_done(page) or not self.sink.exists(page)]
+        if resume:
+            print(f"Resuming {self.dataset_name}: {len(pages)} of {total_pages} pages left")
+        # A crawl already complete rewrites nothing: the deltas since are kept.
+        self.rewriting = bool(pages)
+        return total_pages, pages
+
+    def plan_ranges(self, url, params, resume=False):
+        """
+        Split the ids of a keyset crawl into ranges and prepare its manifest and sink.
+        A new crawl removes the pages and the deltas of the previous one.
+        Resumed crawls keep the ranges of the previous crawl and restart each
+        one from its first page missing.
+        Args:
+            url (str): The URL to request.
+            params (dict): The parameters to include in the request.
+            resume (bool): Whether to resume the previous keyset crawl.
+        Returns:
+            list: The `[cursor, end]` ranges left to crawl.
+        """
+        self.rewriting = False
+        if resume and self.manifest.meta.get("url") == url and "ranges" in self.manifest.meta:
+            self.sink.prune(self.manifest.is_done)
+            ranges = [[resume_cursor(self.manifest, self.sink.exists, start), end]
+                      for start, end in self.manifest.meta["ranges"]]
+            ranges = [[cursor, end] for cursor, end in ranges if cursor is not None]
+            print(f"Resuming {self.dataset_name}: {len(ranges)} of"
+                  f" {len(self.manifest.meta['ranges'])} ranges left")
+            self.rewriting = bool(ranges)
+            return ranges
+        max_id = self.get_max_id(url, params)
+        if max_id is None:
+            self.failed_pages += 1
+            return []
+        if self.snapshots is not None:
+            self.snapshots.discard()
+        ranges = split_ids(max_id, self.partitions)
+        self.manifest.reset(url=url, params=params, max_id=max_id, ranges=ranges)
+        self.sink.reset()
+        remove_deltas(self.output_folder)
+        self.rewriting = True
+        return [list(bounds) for bounds in ranges]
+
+    async def fetch_range(self, client, url, params, cursor, end):
+        """
+        Fetch the pages of an id range one after the other, following the cursor.
+        Each page is recorded in the manifest under its cursor, with the cursor
+        of the next page.
+        Args:
+            client (DrupalClient): The client to use for the requests.
+            url (str): The URL to request.
+            params (dict): The parameters of the dataset.
+            cursor (int): The id after which the range starts.
+            end (int): The last id of the range, or None to crawl to the last record.
+        Returns:
+            int: The number of pages saved.
+        """
+        field = params['sort']
+        pages = 0
+        while cursor is not None:
+            self.manifest.start(cursor)
+            data = await self.fetch_page(
+                client, url, cursor_params(params, field, cursor), 0, self.page_stream)
+            if data is None:
+                self.manifest.fail(cursor, "fetch failed")
+                return pages
+            records = data['records']
+            ids = [int(record['id']) for record in records]
+            try:
+                check_cursor(ids, cursor)
+            except ValueError as e:
+                print(f"Error fetching {self.dataset_name} after {cursor}: {e}")
+                self.failed_pages += 1
+                self.manifest.fail(cursor, e)
+                return pages
+            next_cursor = ids[-1] if ids and 'next' in data else None
+            if end is not None:
+                records = [record for record, id in zip(records, ids) if id <= end]
+                if next_cursor is not None and next_cursor >= end:
+                    next_cursor = None
+            saved = await self.save_page(cursor, {'records': records})
+            if saved is None:
+                self.manifest.fail(cursor, "save failed")
+                return pages
+            self.manifest.done(cursor, saved, next=next_cursor)
+            pages += 1
+            cursor = next_cursor
+        return pages
+
+    async def fetch_ranges(self, url, params, ranges, max_concurrent_requests=100, client=None):
+        """
+        Crawl id ranges concurrently, each one page after the other.
+        Args:
+            url (str): The URL to request.
+            params (dict): The parameters to include in the request.
+            ranges (list): The `[cursor, end]` ranges to crawl (see `plan_ranges`).
+            max_concurrent_requests (int): The maximum number of concurrent requests.
+            client (DrupalClient): A client shared with other crawls.
+        Returns:
+            int: The number of pages saved.
+        """
+        try:
+            async with self.open_client(max_concurrent_requests, client) as client:
+                pages = await asyncio.gather(*[
+                    self.fetch_range(client, url, params, cursor, end) for cursor, end in ranges
+                ])
+        finally:
+            self.flush()
+        return sum(pages)
+
+    def finish(self):
+        """
+        Finish a full crawl, once every page is saved.
+        Crawls compared to the last snapshot write their delta file (see
+        `finish_diff`). Crawls rewriting the pages index them as the new
+        snapshot once none is missing, superseding the previous deltas.
+        Datasets with a reducer (e.g. `comment`) fold the pages saved by previous
+        runs of a resumed crawl and write their result.
+        """
+        if self.diff is not None:
+            self.finish_diff()
+            return
+        done = sorted(int(page) for page, entry in self.manifest.units.items()
+                      if entry["status"] == CrawlManifest.DONE)
+        if self.snapshots is not None and self.rewriting and done and not self.verify():
+            remove_deltas(self.output_folder)
+            self.snapshots.rebuild(self.sink.read(done))
+            print(f"Indexed {len(self.snapshots.index)} records of {self.dataset_name}")
+        if self.reducer is None:
+            return
+        self.reducer.add_pages(self.sink.read(
+            page for page in done if page not in self.reducer.pages))
+        total = self.reducer.write()
+        print(f"Reduced {self.dataset_name} to {total} rows in {self.reducer.output_file}")
+
+    def finish_diff(self):
+        """
+        Write the records added or changed since the last snapshot to a delta file.
+        The ids of the snapshot which were not seen are deleted, only when
+        every page was compared: they may be in a failed page otherwise.
+        Returns:
+            int: The number of records of the delta file.
+        """
+        deleted = None if self.failed_pages else self.diff.deleted()
+        records = self.diff.delta(deleted)
+        output_file = None
+        if records:
+            if self.sync_state is not None:
+                output_file = self.sync_state.next_delta_file()
+            else:
+                output_file = next_delta_file(self.output_folder)
+            with open(output_file, 'wb') as f:
+                f.write(self.serialize(records))
+        self.snapshots.commit(self.diff, "diff", output_file, deleted)
+        entry = self.snapshots.entries[-1]
+        print(f"Compared {self.dataset_name} to its last snapshot: {entry['added']} added,"
+              f" {entry['changed']} changed, {entry['deleted']} deleted records"
+              + (f" saved to {output_file}" if output_file else ""))
+        return len(records)
+
+    def verify(self):
+        """
+        Find the gaps of the last crawl.
+        Returns:
+            list: The page numbers which are not done in the manifest,
+            or missing from the output sink. For keyset crawls, the cursor
+            of the first page missing of every incomplete range.
+        """
+        if "ranges" in self.manifest.meta:
+            # The first missing page of every range of a keyset crawl.
+            cursors = [resume_cursor(self.manifest, self.sink.exists, start)
+                       for start, _ in self.manifest.meta["ranges"]]
+            return [cursor for cursor in cursors if cursor is not None]
+        total_pages = self.manifest.meta.get("total_pages", 0)
+        return self.manifest.verify(range(total_pages), self.sink.exists)
+
+    def run(self, incremental=False, resume=False):
         """
         Run the data fetching process.
         This function determines the endpoint and parameters based on the dataset name,
         and then calls the process method to fetch the data.
+        In incremental mode, only the records changed since the last run are fetched
+        and saved to a delta file (see `drucom.sync`). It falls back to a full crawl
+        when there is no previous run.
+        The metrics of the run are written to `metrics.json` and `metrics.prom`
+        in the output folder.
+        Args:
+            incremental (bool): Whether to only fetch the changed records.
+            resume (bool): Whether to resume the previous full crawl, fetching
+                only its missing and failed pages.
         Raises:
-            ValueError: If the dataset name is unknown.
+            ValueError: If the dataset name is unknown, or cannot be synced incrementally.
         """
-        if self.dataset_name == 'event':
-            endpoint = 'node.json'
-            params = {'type': 'event', 'sort': 'nid', 'direction': 'ASC'}
-        elif self.dataset_name == 'user':
-            endpoint = 'user.json'
-            params = {'sort': 'uid', 'direction': "ASC"}
-        elif self.dataset_name == 'organization':
-            endpoint = 'node.json'
-            params = {'type': 'organization',
-                      'sort': 'nid', 'direction': 'ASC'}
-        elif self.dataset_name == 'module':
-            endpoint = 'node.json'
-            params = {'type': 'project_module',
-                      'sort': 'nid', 'direction': 'ASC'}
-        elif self.dataset_name == 'module_terms':
-            endpoint = 'taxonomy_term.json'
-            params = {'vocabulary[]': ['3', '44', '46'],
-                      'sort': 'tid', 'direction': 'ASC'}
-        elif self.dataset_name == 'theme':
-            endpoint = 'node.json'
-            params = {'type': 'project_theme',
-                      'sort': 'nid', 'direction': 'ASC'}
-        else:
-            raise ValueError(f"Unknown dataset: {self.dataset_name}")
-
+        endpoint, params = self.get_endpoint(self.dataset_name)
         url = f"{self.BASE_URL}/{endpoint}"
-        total_pages = self.process(url, params)
-        print(
-            f"Processed {total_pages + 1} pages of data for {self.dataset_name}")
+        self.failed_pages = 0
+
+        if incremental and self.sync_state is None:
+            raise ValueError(
+                f"Dataset {self.dataset_name} cannot be synced incrementally")
+        if incremental and self.sync_state.mark is not None:
+            with self.metrics.phase("sync"):
+                changed = asyncio.run(self.fetch_changed_pages(url, params))
+            if not self.failed_pages:
+                self.sync_state.commit()
+            print(
+                f"Synced {changed} changed records of {self.dataset_name}")
+        else:
+            if incremental:
+                print(f"No previous run of {self.dataset_name}, running a full crawl")
+            total_pages = self.process(url, params, resume=resume)
+            with self.metrics.phase("finish"):
+                self.finish()
+            if self.sync_state is not None and not self.failed_pages:
+                # Only a rewrite of the pages supersedes the deltas.
+                self.sync_state.commit(full=self.rewriting)
+            print(
+                f"Processed {total_pages} pages of data for {self.dataset_name}")
+        self.metrics.write(self.output_folder)
+        print(self.metrics.report())
 
     def main(dataset_name: str):
         """
@@ -0,0 +1,194 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from drucom.codec import loads
+from drucom.schema import get_schema, normalize
+from drucom.sync import is_deleted, list_files
+from drucom.terms import TERM_COLUMNS, resolved_schema
+
+
+def read_ids(path):
+    """
+    Read the ids of the records of a page file.
+    Args:
+        path (str): The path of the page file.
+    Returns:
+        tuple: The ids, in file order (invalid ids are -1), and a mask of the
+        tombstones (see `drucom.sync.tombstone`).
+    """
+    with open(path, "rb") as f:
+        records = loads(f.read())
+    ids = np.empty(len(records), np.int64)
+    deleted = np.zeros(len(records), bool)
+    for index, record in enumerate(records):
+        try:
+            ids[index] = int(record.get("id"))
+        except (TypeError, ValueError):
+            ids[index] = -1
+        deleted[index] = is_deleted(record)
+    return ids, deleted
+
+
+def read_batch(path, dataset_name):
+    """
+    Read a page file as a record batch of the dataset schema.
+    Args:
+        path (str): The path of the page file.
+        dataset_name (str): The name of the dataset.
+    Returns:
+        pyarrow.RecordBatch: The records.
+    """
+    with open(path, "rb") as f:
+        return normalize(loads(f.read()), get_schema(dataset_name))
+
+
+def last_occurrences(ids):
+    """
+    Find the last occurrence of every id.
+    Args:
+        ids (numpy.ndarray): The ids of all records, in file order.
+    Returns:
+        numpy.ndarray: A mask of the records to keep: the last record of each
+        id. Records without a valid id are dropped.
+    """
+    reverse = ids[::-1]
+    _, first = np.unique(reverse, return_index=True)
+    keep = np.zeros(len(ids), bool)
+    keep[len(ids) - 1 - first] = True
+    keep &= ids >= 0
+    return keep
+
+
+class DrupalDataMerger:
+    """
+    A class to merge the page files of a dataset into one Parquet file.
+
+    Page and delta files (see `drucom.sync.list_files`) are read in a process
+    pool and normalized to the explicit Arrow schema of the dataset (see
+    `drucom.schema`). Records are deduplicated by id, the record of the most
+    recent file winning unless it is a tombstone, and written in row groups:
+    only the ids of the whole dataset and one row group are held in memory at once.
+
+    With a `TermResolver`, the taxonomy term ids of modules and themes are
+    resolved to names, in the columns of `drucom.terms.TERM_COLUMNS`.
+    """
+
+    def __init__(self, dataset_name, input_dir=None, output_file=None, workers=None,
+                 row_group_size=100_000, terms=None):
+        """
+        Initialize the merger for a dataset.
+        Args:
+            dataset_name (str): The name of the dataset.
+            input_dir (str): The folder of the page files. Defaults to `../data/json/<dataset>`.
+            output_file (str): The Parquet file to write. Defaults to `../data/<dataset>.parquet`.
+            workers (int): The number of processes reading files. Defaults to the
+                number of CPUs. 1 reads files in the current process.
+            row_group_size (int): The number of rows per row group.
+            terms (TermResolver): Resolves the term ids of the dataset, if any.
+        Raises:
+            ValueError: If the dataset name is unknown.
+        """
+        data_dir = os.path.join(os.path.dirname(__file__), "../data")
+        self.dataset_name = dataset_name
+        self.schema = get_schema(dataset_name)
+        self.input_dir = input_dir or os.path.join(data_dir, "json", dataset_name)
+        self.output_file = output_file or os.path.join(data_dir, f"{dataset_name}.parquet")
+        self.workers = workers or os.cpu_count() or 1
+        self.row_group_size = row_group_size
+        self.terms = terms if dataset_name in TERM_COLUMNS else None
+        if self.terms is not None:
+            self.schema = resolved_schema(self.schema, dataset_name)
+
+    def map(self, function, *iterables):
+        """
+        Apply a function to files in the process pool, in order.
+        At most a few results per worker wait to be consumed, whatever the number of files.
+        Args:
+            function (callable): A picklable function.
+            *iterables: The arguments of the function.
+        Yields:
+            The results, in the order of the arguments.
+        """
+        if self.workers == 1:
+            yield from map(function, *iterables)
+            return
+        with ProcessPoolExecutor(self.workers) as executor:
+            pending = deque()
+            for args in zip(*iterables):
+                pending.append(executor.submit(function, *args))
+                if len(pending) >= self.workers * 4:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def merge_data(self):
+        """
+        Merge the page files of the dataset into the Parquet file.
+        The file is replaced atomically once written.
+        Returns:
+            int: The number of rows written.
+        Raises:
+            FileNotFoundError: If the dataset folder has no page files.
+        """
+        files = list_files(self.input_dir)
+        if not files:
+            raise FileNotFoundError(f"No page files in {self.input_dir}")
+
+        # First pass: find the last record of every id, dropping the deleted ones.
+        ids, deleted = zip(*self.map(read_ids, files))
+        keep = last_occurrences(np.concatenate(ids)) & ~np.concatenate(deleted)
+        offsets = np.cumsum([0] + [len(file_ids) for file_ids in ids])
+        del ids, deleted
+
+        # Second pass: write the records kept, one row group at a time.
+        tmp_file = self.output_file + ".tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(self.output_file)), exist_ok=True)
+        rows = 0
+        batches, buffered = [], 0
+        with pq.ParquetWriter(tmp_file, self.schema) as writer:
+            for index, batch in enumerate(self.map(read_batch, files, [self.dataset_name] * len(files))):
+                mask = keep[offsets[index]:offsets[index + 1]]
+                if len(mask) != batch.num_rows:
+                    raise ValueError(f"{files[index]} changed while merging")
+                if not mask.all():
+                    batch = batch.filter(pa.array(mask))
+                if self.terms is not None:
+                    batch = self.terms.resolve(batch, self.dataset_name)
+                batches.append(batch)
+                buffered += batch.num_rows
+                if buffered >= self.row_group_size:
+                    rows += self.write_row_group(writer, batches)
+                    batches, buffered = [], 0
+            if batches:
+                rows += self.write_row_group(writer, batches)
+        os.replace(tmp_file, self.output_file)
+        return rows
+
+    def write_row_group(self, writer, batches):
+        """
+        Write batches as one row group.
+        Args:
+            writer (pyarrow.parquet.ParquetWriter): The writer.
+            batches (list): The record batches.
+        Returns:
+            int: The number of rows written.
+        """
+        table = pa.Table.from_batches(batches, self.schema)
+        writer.write_table(table, row_group_size=table.num_rows)
+        return table.num_rows
+
+    def run(self):
+        """
+        Merge the dataset and print a summary.
+        """
+        start = time.time()
+        print(f"Building {self.dataset_name} from folder: {self.input_dir}")
+        rows = self.merge_data()
+        print(f"Merged {rows} rows of {self.dataset_name} into {self.output_file}"
+              f" in {time.time() - start:.2f} seconds")
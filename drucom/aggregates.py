@@ -0,0 +1,429 @@
+"""
+Aggregate views
+===============
+Named aggregates of the community datasets, materialized to `views.json` and
+maintained incrementally, so that notebooks and dashboards read them in a few
+milliseconds instead of grouping the full dataframes every session:
+
+- `registrations_per_year`: the number of user accounts created every year.
+- `anonymous`: the users without first and last name, and their share.
+- `missing_values`: the number and share of users missing each field.
+- `commenters_per_region`: the number of users with comments, by region.
+- `top_commenters`: the users with the most comments.
+
+The state behind the views is one compact row per user id (sorted ids,
+registration time, region code, anonymous flag, a bitmask of the fields
+missing and the comment total), saved as `state.npz`, and the counts of the
+views, saved in `state.json`. New records replace the rows of their ids: the
+contribution of the old rows to the counts is subtracted and the one of the
+new rows added, so an update only touches the records of the new page and
+delta files (see `add_files`), never the whole dataset. The users deleted by
+the tombstones of delta files (see `drucom.snapshot`) are removed likewise.
+When a file added before changes or disappears (e.g. pages rewritten by a
+full crawl with `--rewrite`, or a totals file written again), the rows it
+contributed cannot be told apart: the values of its kind are cleared and
+every file of the kind is added again.
+
+Example:
+    aggregates = Aggregates()
+    aggregates.add_files("user", list_files("data/json/user"))
+    aggregates.add_files("comment_totals", ["data/json/comment/counts.json"])
+    aggregates.save()
+    read_view("top_commenters")
+"""
+import os
+import json
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from drucom.DrupalDataMerger import last_occurrences
+from drucom.codec import loads
+from drucom.schema import SCHEMAS, normalize
+from drucom.sync import is_deleted
+
+VIEWS = ["registrations_per_year", "anonymous", "missing_values", "commenters_per_region", "top_commenters"]
+
+# The user fields whose missing values are counted: lists are never missing.
+MISSING_FIELDS = [field.name for field in SCHEMAS["user"]
+                  if field.name != "id" and not pa.types.is_list(field.type)]
+
+# Bots left out of the commenters views, e.g. the system message user.
+EXCLUDED_COMMENTERS = {180064}
+
+# The columns of the state, and their type.
+STATE_COLUMNS = {
+    "id": np.int64,
+    # Whether the row holds a user record, rather than only a comment total.
+    "user": bool,
+    # Unix timestamp of the registration, 0 if missing.
+    "created": np.int64,
+    # Index of the region in the regions of the state, -1 if missing.
+    "region": np.int32,
+    "anonymous": bool,
+    # Bit i is set when `MISSING_FIELDS[i]` is missing.
+    "missing": np.uint32,
+    "comments": np.int64,
+}
+
+
+def years(created):
+    """
+    Get the years of Unix timestamps.
+    """
+    return created.astype("datetime64[s]").astype("datetime64[Y]").astype(np.int64) + 1970
+
+
+def read_totals(path):
+    """
+    Read the comment totals of users, as written by `CommentCounter` or the
+    comment enrichment (`{uid: {"total": n, ...}}`).
+    Args:
+        path (str): The JSON file.
+    Returns:
+        tuple: The user ids and their totals.
+    """
+    with open(path, "rb") as f:
+        totals = loads(f.read())
+    ids = np.fromiter((int(uid) for uid in totals), np.int64, len(totals))
+    values = np.fromiter((entry.get("total") or 0 for entry in totals.values()), np.int64, len(totals))
+    return ids, values
+
+
+def read_view(name, folder=None):
+    """
+    Read a materialized view.
+    Args:
+        name (str): The name of the view, one of `VIEWS`.
+        folder (str): The aggregates folder. Defaults to `../data/aggregates`.
+    Returns:
+        The view: a dict, or a list for `top_commenters`.
+    Raises:
+        ValueError: If the view is unknown.
+        FileNotFoundError: If the views were never saved.
+    """
+    if name not in VIEWS:
+        raise ValueError(f"Unknown view: {name}")
+    folder = folder or os.path.join(os.path.dirname(__file__), "../data/aggregates")
+    with open(os.path.join(folder, "views.json"), "rb") as f:
+        return loads(f.read())[name]
+
+
+class Aggregates:
+    """
+    Maintain the aggregate views of `VIEWS` incrementally.
+    """
+
+    def __init__(self, folder=None, top=100):
+        """
+        Initialize the aggregates, loading their state if it was saved.
+        Args:
+            folder (str): The aggregates folder. Defaults to `../data/aggregates`.
+            top (int): The number of users in `top_commenters`.
+        """
+        self.folder = folder or os.path.join(os.path.dirname(__file__), "../data/aggregates")
+        self.top = top
+        self.rows = {name: np.empty(0, dtype) for name, dtype in STATE_COLUMNS.items()}
+        self.regions = []
+        self.region_codes = {}
+        # Path -> [size, mtime, kind] of the files added, to skip them when unchanged.
+        self.files = {}
+        self.users = 0
+        self.anonymous = 0
+        self.years = {}
+        self.commenters = {}
+        self.missing = np.zeros(len(MISSING_FIELDS), np.int64)
+        self.top_ids = np.empty(0, np.int64)
+        if os.path.exists(os.path.join(self.folder, "state.json")):
+            self.load()
+
+    def load(self):
+        """
+        Load the state saved by `save`.
+        """
+        with open(os.path.join(self.folder, "state.json")) as f:
+            state = json.load(f)
+        with np.load(os.path.join(self.folder, "state.npz")) as arrays:
+            self.rows = {name: arrays[name] for name in STATE_COLUMNS}
+        self.regions = state["regions"]
+        self.region_codes = {region: code for code, region in enumerate(self.regions)}
+        self.files = state["files"]
+        self.users = state["users"]
+        self.anonymous = state["anonymous"]
+        self.years = {int(year): count for year, count in state["years"].items()}
+        self.commenters = {int(region): count for region, count in state["commenters"].items()}
+        self.missing = np.array(state["missing"], np.int64)
+        self.top_ids = np.array(state["top"], np.int64)
+
+    def save(self):
+        """
+        Save the state and write the views, each file replaced atomically.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = os.path.join(self.folder, "state.tmp.npz")
+        np.savez(tmp_path, **self.rows)
+        os.replace(tmp_path, os.path.join(self.folder, "state.npz"))
+        state = {
+            "regions": self.regions, "files": self.files, "users": self.users,
+            "anonymous": self.anonymous, "years": self.years, "commenters": self.commenters,
+            "missing": self.missing.tolist(), "top": self.top_ids.tolist(),
+        }
+        for name, data in (("state.json", state), ("views.json", self.views())):
+            tmp_path = os.path.join(self.folder, name + ".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(tmp_path, os.path.join(self.folder, name))
+
+    def views(self):
+        """
+        Compute the views from the counts.
+        Returns:
+            dict: The views, by name.
+        """
+        users = self.users or 1
+        rows = self.positions(self.top_ids)
+        return {
+            "registrations_per_year": {str(year): count for year, count in sorted(self.years.items()) if count},
+            "anonymous": {"users": self.users, "anonymous": self.anonymous,
+                          "share": self.anonymous / users},
+            "missing_values": {
+                "users": self.users,
+                "counts": dict(zip(MISSING_FIELDS, self.missing.tolist())),
+                "shares": {field: count / users for field, count in zip(MISSING_FIELDS, self.missing.tolist())},
+            },
+            "commenters_per_region": {self.regions[region]: count
+                                      for region, count in sorted(self.commenters.items()) if count},
+            "top_commenters": [{"uid": uid, "comments": comments} for uid, comments in zip(
+                self.top_ids.tolist(), self.rows["comments"][rows].tolist())],
+        }
+
+    def positions(self, ids):
+        """
+        Find the rows of ids in the state.
+        Args:
+            ids (numpy.ndarray): Ids of the state.
+        Returns:
+            numpy.ndarray: The rows.
+        """
+        return np.searchsorted(self.rows["id"], ids)
+
+    def insert(self, ids):
+        """
+        Add rows for the ids missing from the state.
+        Args:
+            ids (numpy.ndarray): Unique ids.
+        Returns:
+            numpy.ndarray: The rows of the ids.
+        """
+        known = self.rows["id"]
+        rows = np.searchsorted(known, ids)
+        found = rows < len(known)
+        found[found] = known[rows[found]] == ids[found]
+        new = np.sort(ids[~found])
+        if len(new):
+            at = np.searchsorted(known, new)
+            defaults = {"region": -1}
+            for name, dtype in STATE_COLUMNS.items():
+                values = new if name == "id" else np.full(len(new), defaults.get(name, 0), dtype)
+                self.rows[name] = np.insert(self.rows[name], at, values)
+            rows = self.positions(ids)
+        return rows
+
+    def count(self, rows, sign):
+        """
+        Add (or subtract) the contribution of rows to the counts of the views.
+        Args:
+            rows (numpy.ndarray): The rows.
+            sign (int): 1 to add the rows, -1 to remove them.
+        """
+        state = {name: values[rows] for name, values in self.rows.items()}
+        users = state["user"]
+        self.users += sign * int(users.sum())
+        self.anonymous += sign * int((users & state["anonymous"]).sum())
+        bits = (state["missing"][users, None] >> np.arange(len(MISSING_FIELDS), dtype=np.uint32)) & 1
+        self.missing += sign * bits.sum(axis=0).astype(np.int64)
+        created = state["created"][users & (state["created"] > 0)]
+        for year, count in zip(*np.unique(years(created), return_counts=True)):
+            self.years[int(year)] = self.years.get(int(year), 0) + sign * int(count)
+        commenters = (users & (state["comments"] > 0) & (state["region"] >= 0)
+                      & ~np.isin(state["id"], list(EXCLUDED_COMMENTERS)))
+        for region, count in zip(*np.unique(state["region"][commenters], return_counts=True)):
+            self.commenters[int(region)] = self.commenters.get(int(region), 0) + sign * int(count)
+
+    def replace(self, ids, values):
+        """
+        Replace the values of the rows of ids, updating the counts.
+        Args:
+            ids (numpy.ndarray): The ids, unique.
+            values (dict): The new values of state columns, aligned with ids.
+        Returns:
+            numpy.ndarray: The rows replaced.
+        """
+        rows = self.insert(ids)
+        self.count(rows, -1)
+        for name, column in values.items():
+            self.rows[name][rows] = column
+        self.count(rows, 1)
+        return rows
+
+    def add_users(self, batch):
+        """
+        Add user records, replacing the previous records of their ids.
+        Args:
+            batch (pyarrow.RecordBatch): Users with the columns of the `user`
+                schema (see `drucom.schema.normalize`).
+        """
+        ids = batch.column("id").fill_null(-1).to_numpy(zero_copy_only=False).astype(np.int64)
+        # The last record of every id wins.
+        keep = np.flatnonzero(last_occurrences(ids))
+        ids = ids[keep]
+        take = pa.array(keep)
+        column = lambda name: batch.column(name).take(take)
+
+        created = column("created")
+        if pa.types.is_timestamp(created.type):
+            created = created.cast(pa.timestamp("s")).cast(pa.int64())
+        region = column("region")
+        if not pa.types.is_dictionary(region.type):
+            region = pc.dictionary_encode(region)
+        codes = np.array([self.region_code(value) for value in region.dictionary.to_pylist()] + [-1], np.int32)
+        indices = region.indices.fill_null(-1).to_numpy(zero_copy_only=False)
+        missing = np.zeros(len(ids), np.uint32)
+        for bit, name in enumerate(MISSING_FIELDS):
+            missing |= pc.is_null(column(name)).to_numpy(zero_copy_only=False).astype(np.uint32) << bit
+        self.replace(ids, {
+            "user": True,
+            "created": created.fill_null(0).to_numpy(zero_copy_only=False),
+            "region": codes[indices],
+            "anonymous": pc.and_(pc.is_null(column("fname")), pc.is_null(column("lname")))
+                           .to_numpy(zero_copy_only=False),
+            "missing": missing,
+        })
+
+    def remove_users(self, ids):
+        """
+        Remove the user records of ids, keeping their comment totals.
+        Args:
+            ids (numpy.ndarray): The user ids.
+        """
+        rows = self.positions(ids)
+        found = rows < len(self.rows["id"])
+        found[found] = self.rows["id"][rows[found]] == ids[found]
+        ids = np.unique(ids[found])
+        self.replace(ids, {"user": False, "created": 0, "region": -1, "anonymous": False, "missing": 0})
+
+    def region_code(self, region):
+        """
+        Get the code of a region, adding it to the regions of the state.
+        """
+        if region is None:
+            return -1
+        code = self.region_codes.get(region)
+        if code is None:
+            code = self.region_codes[region] = len(self.regions)
+            self.regions.append(region)
+        return code
+
+    def add_comment_totals(self, ids, totals):
+        """
+        Set the comment totals of users, replacing their previous totals.
+        Args:
+            ids (numpy.ndarray): The user ids.
+            totals (numpy.ndarray): Their comment totals.
+        """
+        keep = np.flatnonzero(last_occurrences(ids))
+        ids, totals = ids[keep], totals[keep]
+        rows = self.insert(ids)
+        before = self.rows["comments"][rows]
+        rows = self.replace(ids, {"comments": totals})
+        self.update_top(rows, decreased=bool((totals < before).any()))
+
+    def update_top(self, rows, decreased=False):
+        """
+        Update the top commenters with the rows whose totals changed.
+        Only the current top and the rows changed are ranked, unless a total
+        decreased: the top is then ranked again from all rows.
+        """
+        ids, comments = self.rows["id"], self.rows["comments"]
+        if decreased:
+            candidates = np.arange(len(ids))
+        else:
+            candidates = np.union1d(self.positions(self.top_ids), rows)
+        candidates = candidates[(comments[candidates] > 0)
+                                & ~np.isin(ids[candidates], list(EXCLUDED_COMMENTERS))]
+        # Most comments first, then lowest ids.
+        order = np.lexsort((ids[candidates], -comments[candidates]))[:self.top]
+        self.top_ids = ids[candidates[order]]
+
+    def clear(self, kind):
+        """
+        Clear the values added from the files of a kind, before adding them again.
+        Args:
+            kind (str): `user` to remove every user record, `comment_totals`
+                to reset every comment total.
+        """
+        if kind == "user":
+            self.remove_users(self.rows["id"][self.rows["user"]])
+        else:
+            rows = np.flatnonzero(self.rows["comments"])
+            self.replace(self.rows["id"][rows], {"comments": 0})
+            self.update_top(rows, decreased=True)
+
+    def add_files(self, kind, paths):
+        """
+        Add the records of files which are new or changed since they were added.
+        Files are expected to change only when they are rewritten as a whole:
+        if a file added before changed or is missing from `paths`, every file
+        is added again (see `clear`).
+        Args:
+            kind (str): `user` for page and delta files of users (see
+                `drucom.sync.list_files`), `comment_totals` for comment totals
+                (see `read_totals`).
+            paths (list): Every file of the kind, oldest data first.
+        Returns:
+            int: The number of files added.
+        Raises:
+            ValueError: If the kind is unknown.
+        """
+        if kind not in ("user", "comment_totals"):
+            raise ValueError(f"Unknown kind of file: {kind}")
+        signatures = {}
+        for path in paths:
+            stat = os.stat(path)
+            signatures[path] = [stat.st_size, stat.st_mtime_ns, kind]
+        known = [path for path, signature in self.files.items() if signature[2] == kind]
+        if any(self.files[path] != signatures.get(path) for path in known):
+            self.clear(kind)
+            for path in known:
+                del self.files[path]
+        added = 0
+        for path, signature in signatures.items():
+            if self.files.get(path) == signature:
+                continue
+            if kind == "user":
+                with open(path, "rb") as f:
+                    records = loads(f.read())
+                deleted = [int(record["id"]) for record in records if is_deleted(record)]
+                if deleted:
+                    records = [record for record in records if not is_deleted(record)]
+                self.add_users(normalize(records, SCHEMAS["user"]))
+                if deleted:
+                    self.remove_users(np.array(deleted, np.int64))
+            else:
+                self.add_comment_totals(*read_totals(path))
+            self.files[path] = signature
+            added += 1
+        return added
+
+    def add_parquet(self, path, batch_size=100_000):
+        """
+        Add the users of a merged Parquet file (see `DrupalDataMerger`), batch by batch.
+        Args:
+            path (str): The Parquet file of the `user` dataset.
+            batch_size (int): The number of rows read at once.
+        """
+        columns = ["id", "created", "region", "fname", "lname"] + MISSING_FIELDS
+        for batch in pq.ParquetFile(path).iter_batches(batch_size, columns=list(dict.fromkeys(columns))):
+            self.add_users(batch)
@@ -0,0 +1,256 @@
+"""
+Fetch pipeline benchmark
+========================
+Crawl synthetic datasets from the local mock api-d7 and report throughput,
+page latency, peak memory and how the CPU time splits between network,
+transform and write.
+
+The mock server and every scenario run in their own process, so the peak
+RSS and CPU time of a scenario are not mixed with the server or other runs.
+
+CPU split:
+- transform: CPU time spent in `MappingTransformer.transform`.
+- write: CPU time spent serializing records, plus the file writer threads.
+- network: the rest of the event loop thread (HTTP, JSON decoding, scheduling).
+
+With `--pool thread|process`, pages are decoded, transformed and encoded in a
+transform pool: `transform` is then the time spent in the pool workers, and
+the speedup over the default mode grows with the number of cores.
+
+Usage:
+    python -m drucom.benchmarks.bench_fetch [scenario ...] [--latency 0.02] [--concurrency 100]
+        [--pool process --workers 4] [--partitions 32]
+
+Scenarios are dataset names (e.g. `user`, `module`, `comment`) and `comment_script`
+for `script/fetch_comments.py`.
+"""
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import resource
+import tempfile
+import statistics
+import importlib.util
+import multiprocessing
+
+import numpy as np
+
+from drucom.benchmarks.mock_server import MockApi, MockServer
+
+SCRIPT_PATH = os.path.join(os.path.dirname(__file__), "../../script/fetch_comments.py")
+
+
+def _serve(api_options, ports):
+    async def serve():
+        async with MockServer(MockApi(**api_options)) as server:
+            ports.put(server.port)
+            await asyncio.Event().wait()
+    asyncio.run(serve())
+
+
+def _percentile(values, share):
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(share * 100) - 1]
+
+
+def _report(name, units, items, elapsed, latencies, cpu):
+    total_cpu = cpu["total"]
+    return {
+        "scenario": name,
+        "pages": units,
+        "items": items,
+        "seconds": elapsed,
+        "pages_per_sec": units / elapsed if elapsed else 0.0,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "cpu_network": max(0.0, total_cpu - cpu["transform"] - cpu["write"]),
+        "cpu_transform": cpu["transform"],
+        "cpu_write": cpu["write"],
+    }
+
+
+def run_fetcher(base_url, dataset, concurrency, backend, pool=None, workers=None, partitions=None):
+    """
+    Crawl a dataset with `DrupalDataFetcher` and measure it.
+    Args:
+        base_url (str): The base URL of the mock api-d7.
+        dataset (str): The dataset name.
+        concurrency (int): The maximum number of concurrent requests.
+        backend (str): The transform backend.
+        pool (str): The transform pool, `thread` or `process`, or None to
+            transform on the event loop.
+        workers (int): The number of workers of the pool.
+        partitions (int): Crawl this many id ranges with keyset cursors
+            instead of numbered pages.
+    Returns:
+        dict: The measures.
+    """
+    from drucom.DrupalDataFetcher import DrupalDataFetcher
+    from drucom.pool import TransformPool
+
+    latencies = []
+    cpu = {"transform": 0.0, "write": 0.0}
+
+    class InstrumentedFetcher(DrupalDataFetcher):
+        BASE_URL = base_url
+
+        async def fetch_page(self, client, url, params, page, decoder=None):
+            start = time.perf_counter()
+            data = await super().fetch_page(client, url, params, page, decoder)
+            latencies.append(time.perf_counter() - start)
+            return data
+
+        def serialize(self, records):
+            start = time.thread_time()
+            payload = super().serialize(records)
+            cpu["write"] += time.thread_time() - start
+            return payload
+
+    with tempfile.TemporaryDirectory() as folder:
+        transform_pool = TransformPool(pool, workers) if pool else None
+        fetcher = InstrumentedFetcher(dataset, backend=backend, output_folder=folder, pool=transform_pool,
+                                      partitions=partitions)
+        transform = fetcher.transformer.transform
+
+        def timed_transform(items):
+            start = time.thread_time()
+            records = transform(items)
+            cpu["transform"] += time.thread_time() - start
+            return records
+
+        fetcher.transformer.transform = timed_transform
+        endpoint, params = fetcher.get_endpoint(dataset)
+        url = f"{base_url}/{endpoint}"
+
+        start, thread_start, process_start = time.perf_counter(), time.thread_time(), time.process_time()
+        if partitions:
+            ranges = fetcher.plan_ranges(url, params)
+            total_pages = asyncio.run(fetcher.fetch_ranges(
+                url, params, ranges, max_concurrent_requests=concurrency))
+        else:
+            total_pages, pages = fetcher.plan_pages(url, params)
+            asyncio.run(fetcher.fetch_all_pages(url, params, pages, max_concurrent_requests=concurrency))
+        fetcher.finish()
+        elapsed = time.perf_counter() - start
+        # File writes run in aiofiles threads, off the event loop thread.
+        cpu["write"] += (time.process_time() - process_start) - (time.thread_time() - thread_start)
+        cpu["total"] = time.process_time() - process_start
+        if transform_pool is not None:
+            transform_pool.close()
+            # Pool workers decode, transform and encode pages off the event loop thread.
+            cpu["transform"] = fetcher.metrics.histogram("transform_seconds", dataset=dataset).sum
+            cpu["total"] += cpu["transform"]
+            if pool == "thread":
+                cpu["write"] = max(0.0, cpu["write"] - cpu["transform"])
+        items = fetcher.manifest.summary()["records"]
+    return _report(dataset, total_pages, items, elapsed, latencies, cpu)
+
+
+def run_comment_script(base_url, users, concurrency):
+    """
+    Count comments per user with `script/fetch_comments.py` and measure it.
+    Args:
+        base_url (str): The base URL of the mock api-d7.
+        users (int): The number of user ids to look up.
+        concurrency (int): The window of lookups in flight.
+    Returns:
+        dict: The measures.
+    """
+    spec = importlib.util.spec_from_file_location("fetch_comments", SCRIPT_PATH)
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+    script.BASE_URL = base_url
+
+    latencies = []
+    check = script.check_comment_total_async
+
+    async def timed_check(client, uid):
+        start = time.perf_counter()
+        result = await check(client, uid)
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    script.check_comment_total_async = timed_check
+    with tempfile.TemporaryDirectory() as folder:
+        start, process_start = time.perf_counter(), time.process_time()
+        asyncio.run(script.enrich_comment_totals(np.arange(1, users + 1), folder, window=concurrency))
+        elapsed = time.perf_counter() - start
+        cpu = {"transform": 0.0, "write": 0.0, "total": time.process_time() - process_start}
+    return _report("comment_script", users, users, elapsed, latencies, cpu)
+
+
+def _run_scenario(scenario, base_url, options, results):
+    sys.stdout = open(os.devnull, "w")
+    if scenario == "comment_script":
+        results.put(run_comment_script(base_url, options.users, options.concurrency))
+    else:
+        results.put(run_fetcher(base_url, scenario, options.concurrency, options.backend,
+                                options.pool, options.workers, options.partitions))
+
+
+def bench(scenarios, options):
+    """
+    Run the scenarios against a mock server and print a report.
+    Args:
+        scenarios (list): The scenarios to run.
+        options (argparse.Namespace): The benchmark options.
+    Returns:
+        list: The measures of every scenario.
+    """
+    context = multiprocessing.get_context("spawn")
+    ports = context.Queue()
+    server = context.Process(target=_serve, args=({
+        "latency": options.latency, "error_rate": options.error_rate, "limit": options.limit,
+    }, ports), daemon=True)
+    server.start()
+    base_url = f"http://127.0.0.1:{ports.get(timeout=30)}/api-d7"
+
+    reports = []
+    try:
+        for scenario in scenarios:
+            results = context.Queue()
+            process = context.Process(target=_run_scenario, args=(scenario, base_url, options, results))
+            process.start()
+            reports.append(results.get())
+            process.join()
+    finally:
+        server.terminate()
+
+    print(f"{'scenario':<16}{'pages':>7}{'pages/s':>9}{'p50 ms':>8}{'p99 ms':>8}"
+          f"{'RSS MB':>8}{'cpu net':>9}{'cpu tr':>8}{'cpu wr':>8}")
+    for r in reports:
+        print(f"{r['scenario']:<16}{r['pages']:>7}{r['pages_per_sec']:>9.1f}{r['p50_ms']:>8.1f}"
+              f"{r['p99_ms']:>8.1f}{r['peak_rss_mb']:>8.1f}{r['cpu_network']:>9.2f}"
+              f"{r['cpu_transform']:>8.2f}{r['cpu_write']:>8.2f}")
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(reports, f, indent=2)
+    return reports
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the fetch pipelines on a mock api-d7.")
+    parser.add_argument("scenarios", nargs="*", default=["user", "module", "comment", "comment_script"])
+    parser.add_argument("--latency", type=float, default=0.02, help="Mock response time, in seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of 500 responses.")
+    parser.add_argument("--limit", type=int, default=100, help="Mock page size.")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--backend", choices=["jq", "python"], default="jq")
+    parser.add_argument("--pool", choices=["thread", "process"], help="Transform pages in a pool.")
+    parser.add_argument("--workers", type=int, help="Workers of the transform pool.")
+    parser.add_argument("--partitions", type=int, help="Crawl id ranges with keyset cursors.")
+    parser.add_argument("--users", type=int, default=5000, help="User ids for comment_script.")
+    parser.add_argument("--json", metavar="FILE", help="Also write the report to a JSON file.")
+    return parser
+
+
+if __name__ == "__main__":
+    options = get_parser().parse_args()
+    bench(options.scenarios, options)
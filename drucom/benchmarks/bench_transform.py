@@ -0,0 +1,59 @@
+"""
+Transform micro-benchmark
+=========================
+Compare the legacy per-item jq transform with the compiled, batched transformer
+on synthetic pages for every dataset.
+
+Usage:
+    python -m drucom.benchmarks.bench_transform [pages] [limit]
+"""
+import sys
+import time
+
+from drucom.DrupalDataFetcher import DrupalDataFetcher
+from drucom.benchmarks.synthetic import DATASETS, make_page
+from drucom.transform import MappingTransformer, build_filter
+
+
+def legacy_transform(mapping, items):
+    """
+    The transform as `fetch_page` used to do it: compile per page, run per item.
+    """
+    import jq
+    jq_filter = jq.compile(build_filter(mapping))
+    return [jq_filter.transform(item) for item in items]
+
+
+def bench(pages=20, limit=100):
+    """
+    Run the benchmark and print one line per dataset and strategy.
+    Args:
+        pages (int): The number of synthetic pages per dataset.
+        limit (int): The number of items per page.
+    Returns:
+        dict: Items per second, keyed by (dataset, strategy).
+    """
+    results = {}
+    print(f"{'dataset':<14}{'strategy':<10}{'items/s':>12}{'speedup':>10}")
+    for dataset in DATASETS:
+        mapping = DrupalDataFetcher.get_mapping(dataset)
+        data = [make_page(dataset, page, limit)["list"] for page in range(pages)]
+        total = sum(len(items) for items in data)
+        strategies = {
+            "legacy": lambda items: legacy_transform(mapping, items),
+            "jq": MappingTransformer(mapping, "jq").transform,
+            "python": MappingTransformer(mapping, "python").transform,
+        }
+        for name, transform in strategies.items():
+            start = time.perf_counter()
+            for items in data:
+                transform(items)
+            rate = total / (time.perf_counter() - start)
+            results[(dataset, name)] = rate
+            speedup = rate / results[(dataset, "legacy")]
+            print(f"{dataset:<14}{name:<10}{rate:>12,.0f}{speedup:>9.1f}x")
+    return results
+
+
+if __name__ == "__main__":
+    bench(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,241 @@
+"""
+Mock api-d7 server
+==================
+A local stand-in for `https://www.drupal.org/api-d7` serving synthetic pages.
+
+It serves `user.json`, `node.json` (by `type`), `taxonomy_term.json` and
+`comment.json` with the same `list`/`self`/`first`/`last`/`next` envelope as
+drupal.org, and supports `page`, `limit`, `full=0`, `sort`/`direction`, the
+`author` filter of comments and id cursors (`nid[value]=N&nid[operator]=>`,
+see `drucom.keyset`). Latency, error rate, throttling and page size
+are configurable.
+
+Usage:
+    python -m drucom.benchmarks.mock_server [port] [latency]
+"""
+import sys
+import random
+import asyncio
+import threading
+import zlib
+
+from aiohttp import web
+
+from drucom.benchmarks.synthetic import DATASETS, make_item
+
+# Node type -> dataset name.
+NODE_TYPES = {
+    "event": "event",
+    "organization": "organization",
+    "project_module": "module",
+    "project_theme": "theme",
+}
+
+
+class MockApi:
+    """
+    A configurable mock of the api-d7 endpoints.
+    """
+
+    def __init__(self, totals=None, limit=100, latency=0.02, jitter=0.5,
+                 error_rate=0.0, capacity=None, seed=0):
+        """
+        Initialize the mock.
+        Args:
+            totals (dict): The number of entities per dataset.
+            limit (int): The default (and maximum) page size.
+            latency (float): The mean response time, in seconds.
+            jitter (float): The relative spread of the response time.
+            error_rate (float): The share of requests answered with a 500.
+            capacity (int): The number of concurrent requests served before
+                answering 429 with a `Retry-After` header. None for no limit.
+            seed (int): The random seed of the synthetic data.
+        """
+        self.totals = {
+            "user": 10_000, "organization": 1_000, "module": 2_000, "event": 500,
+            "module_terms": 300, "theme": 300, "comment": 20_000, **(totals or {}),
+        }
+        self.limit = limit
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.capacity = capacity
+        self.seed = seed
+        self.in_flight = 0
+        self.requests = 0
+        self.rng = random.Random(seed)
+        # Generating items costs more than serving them, keep recent pages.
+        self._items = {}
+
+    def app(self):
+        """
+        Build the aiohttp application.
+        Returns:
+            aiohttp.web.Application: The application, serving under `/api-d7`.
+        """
+        app = web.Application()
+        app.router.add_get("/api-d7/{endpoint}", self.handle)
+        return app
+
+    def dataset(self, request):
+        endpoint = request.match_info["endpoint"]
+        if endpoint == "user.json":
+            return "user"
+        if endpoint == "node.json":
+            return NODE_TYPES.get(request.query.get("type"))
+        if endpoint == "taxonomy_term.json":
+            return "module_terms"
+        if endpoint == "comment.json":
+            return "comment"
+        return None
+
+    def comments_of(self, uid):
+        """
+        Get the number of comments of an author, for the `author` filter.
+        """
+        return zlib.crc32(str(uid).encode()) % 40
+
+    def item(self, dataset, entity_id, request, full=True):
+        """
+        Build one item, or its reference when `full=0` is requested.
+        """
+        if not full:
+            resource = request.match_info["endpoint"][:-5]
+            return {"uri": f"{request.url.origin()}/api-d7/{resource}/{entity_id}",
+                    "id": str(entity_id), "resource": resource}
+        return make_item(dataset, entity_id, random.Random(f"{dataset}:{entity_id}:{self.seed}"))
+
+    async def handle(self, request):
+        self.requests += 1
+        if self.capacity is not None and self.in_flight >= self.capacity:
+            return web.json_response({}, status=429, headers={"Retry-After": "1"})
+        self.in_flight += 1
+        try:
+            spread = self.latency * self.jitter
+            await asyncio.sleep(max(0.0, self.rng.uniform(self.latency - spread, self.latency + spread)))
+            if self.rng.random() < self.error_rate:
+                return web.json_response({"error": "Internal Server Error"}, status=500)
+            dataset = self.dataset(request)
+            if dataset is None:
+                return web.json_response({"error": "Not Found"}, status=404)
+            return web.json_response(self.page(dataset, request))
+        finally:
+            self.in_flight -= 1
+
+    def page(self, dataset, request):
+        """
+        Build the page requested.
+        Args:
+            dataset (str): The dataset name.
+            request (aiohttp.web.Request): The request.
+        Returns:
+            dict: The page, with its envelope.
+        """
+        query = request.query
+        page = int(query.get("page", 0))
+        limit = min(int(query.get("limit", self.limit)), self.limit)
+        total = self.totals[dataset]
+        if dataset == "comment" and "author" in query:
+            total = self.comments_of(query["author"])
+        # Ids after the cursor, if any.
+        field = DATASETS[dataset][1]
+        after = 0
+        if query.get(f"{field}[operator]") == ">":
+            after = max(0, min(int(query.get(f"{field}[value]", 0)), total))
+        last_page = max(0, (total - after - 1) // limit)
+        if f"{field}[]" in query:
+            # Only the ids listed, e.g. `tid[]=1&tid[]=2`, on one page.
+            wanted = sorted({int(value) for value in query.getall(f"{field}[]")})
+            ids = [entity_id for entity_id in wanted if 0 < entity_id <= total][:limit]
+            last_page = 0
+        elif query.get("direction", "ASC").upper() == "DESC":
+            ids = range(total - page * limit, max(after, total - (page + 1) * limit), -1)
+        else:
+            ids = range(after + page * limit + 1, min(after + (page + 1) * limit, total) + 1)
+        full = query.get("full") != "0"
+        key = (dataset, repr(ids), full)
+        items = self._items.get(key)
+        if items is None:
+            items = [self.item(dataset, entity_id, request, full) for entity_id in ids]
+            if len(self._items) > 1000:
+                self._items.clear()
+            self._items[key] = items
+
+        base = request.url.with_query({k: v for k, v in query.items() if k != "page"})
+        envelope = {
+            "self": str(base.update_query(page=page)),
+            "first": str(base.update_query(page=0)),
+            "last": str(base.update_query(page=last_page)),
+        }
+        if page > 0:
+            envelope["prev"] = str(base.update_query(page=page - 1))
+        if page < last_page:
+            envelope["next"] = str(base.update_query(page=page + 1))
+        envelope["list"] = items
+        return envelope
+
+
+class MockServer:
+    """
+    Run a `MockApi` on a local port, as an async context manager.
+    """
+
+    def __init__(self, api=None, port=0):
+        self.api = api or MockApi()
+        self.port = port
+
+    async def __aenter__(self):
+        self.runner = web.AppRunner(self.api.app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{self.port}/api-d7"
+        return self
+
+    async def __aexit__(self, *args):
+        await self.runner.cleanup()
+
+
+class ThreadedMockServer:
+    """
+    Run a `MockApi` in a background thread, as a context manager.
+    Blocking clients (e.g. `requests`) can use it from the main thread.
+    """
+
+    def __init__(self, api=None):
+        self.api = api or MockApi()
+
+    def __enter__(self):
+        started = threading.Event()
+        self.loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.server = MockServer(self.api)
+            self.loop.run_until_complete(self.server.__aenter__())
+            started.set()
+            self.loop.run_forever()
+            self.loop.run_until_complete(self.server.__aexit__())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+        self.base_url = self.server.base_url
+        return self
+
+    def __exit__(self, *args):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+async def serve(port=8080, latency=0.02):
+    async with MockServer(MockApi(latency=latency), port) as server:
+        print(f"Serving the mock api-d7 on {server.base_url}")
+        await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.run(serve(int(args[0]) if args else 8080, float(args[1]) if len(args) > 1 else 0.02))
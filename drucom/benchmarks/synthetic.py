@@ -0,0 +1,178 @@
+"""
+Synthetic Drupal API pages
+==========================
+Generate fake `api-d7` items and pages shaped like the real drupal.org responses.
+Generation is deterministic: the same dataset, page and seed give the same page.
+"""
+import random
+
+BASE_URL = "https://www.drupal.org/api-d7"
+
+# Dataset name -> (endpoint, id property).
+DATASETS = {
+    "user": ("user.json", "uid"),
+    "organization": ("node.json", "nid"),
+    "module": ("node.json", "nid"),
+    "event": ("node.json", "nid"),
+    "module_terms": ("taxonomy_term.json", "tid"),
+    "theme": ("node.json", "nid"),
+    "comment": ("comment.json", "cid"),
+}
+
+TIMEZONES = ["Europe/Paris", "America/New_York", "Asia/Kolkata",
+             "America/Argentina/Buenos_Aires", "UTC", "", None]
+COUNTRIES = ["France", "United States", "India", "Belgium", "Argentina", None]
+LANGUAGES = ["English", "French", "Spanish", "Hindi", "Dutch"]
+START = 1_000_000_000
+
+
+def _ref(rng, resource="user", low=1, high=3_500_000):
+    entity_id = str(rng.randint(low, high))
+    return {"uri": f"{BASE_URL}/{resource}/{entity_id}", "id": entity_id, "resource": resource}
+
+
+def _refs(rng, resource="user", most=4):
+    # Empty multi-value fields come back as an empty list.
+    return [_ref(rng, resource) for _ in range(rng.randint(0, most))]
+
+
+def _maybe(rng, value, share=0.5):
+    return value if rng.random() < share else None
+
+
+def _node(rng, entity_id, node_type):
+    created = START + entity_id * 97
+    return {
+        "nid": str(entity_id),
+        "type": node_type,
+        "title": f"{node_type.title()} {entity_id}",
+        "created": str(created),
+        "changed": str(created + rng.randint(0, 10_000_000)),
+        "status": "1",
+        "author": _ref(rng),
+        "body": {"value": "Lorem ipsum " * rng.randint(5, 40), "format": "1"},
+        "url": f"https://www.drupal.org/node/{entity_id}",
+    }
+
+
+def make_item(dataset, entity_id, rng):
+    """
+    Make one raw item for a dataset.
+    Args:
+        dataset (str): The dataset name.
+        entity_id (int): The id of the entity.
+        rng (random.Random): The random generator to use.
+    Returns:
+        dict: A raw item as returned in the `list` of an API page.
+    """
+    if dataset == "user":
+        return {
+            "uid": str(entity_id),
+            "name": f"user{entity_id}",
+            "created": str(START + entity_id * 97),
+            "field_first_name": _maybe(rng, "Jane", 0.2),
+            "field_last_name": _maybe(rng, "Doe", 0.2),
+            "field_da_ind_membership": _maybe(rng, "expired", 0.1),
+            "field_slack": _maybe(rng, f"slack{entity_id}", 0.1),
+            "field_mentors": _refs(rng, most=2) if rng.random() < 0.3 else None,
+            "field_country": rng.choice(COUNTRIES),
+            "field_user_primary_language": _maybe(rng, rng.choice(LANGUAGES), 0.3),
+            "field_languages": rng.sample(LANGUAGES, rng.randint(0, 3)),
+            "timezone": rng.choice(TIMEZONES),
+            "field_organizations": _refs(rng, "field_collection_item", 2) if rng.random() < 0.3 else [],
+            "field_industries": [],
+            "field_contributed": _maybe(rng, ["Code", "Documentation"], 0.2),
+            "field_events_attended": _maybe(rng, [_ref(rng, "node")], 0.1),
+            "url": f"https://www.drupal.org/user/{entity_id}",
+        }
+    if dataset == "organization":
+        item = _node(rng, entity_id, "organization")
+        item.update({
+            "field_link": {"url": f"https://example{entity_id}.com", "attributes": []} if rng.random() < 0.8 else [],
+            "field_budget": _maybe(rng, "$100,000 - $500,000"),
+            "field_organization_headquarters": rng.choice(COUNTRIES),
+        })
+        return item
+    if dataset in ("module", "theme"):
+        item = _node(rng, entity_id, "project_" + dataset)
+        item.update({
+            "field_project_machine_name": f"{dataset}_{entity_id}",
+            "flag_project_star_user": _refs(rng, most=6) if rng.random() < 0.5 else None,
+            "field_security_advisory_coverage": rng.choice(["covered", "not-covered", "revoked"]),
+            "taxonomy_vocabulary_44": {"id": str(rng.choice([13028, 19370, 9990, 13030]))} if rng.random() < 0.9 else [],
+            "taxonomy_vocabulary_46": {"id": str(rng.choice([9988, 9986, 9994, 17568]))} if rng.random() < 0.9 else [],
+        })
+        if dataset == "module":
+            item["taxonomy_vocabulary_3"] = [{"id": str(rng.randint(53, 120))} for _ in range(rng.randint(0, 3))]
+        return item
+    if dataset == "event":
+        item = _node(rng, entity_id, "event")
+        start = START + entity_id * 97
+        item.update({
+            "field_date_of_event": {"value": str(start), "value2": str(start + 86400), "duration": 86400} if rng.random() < 0.95 else None,
+            "field_event_type": rng.sample(["Camp", "Meetup", "Training"], rng.randint(0, 1)),
+            "field_event_format": rng.sample(["In-person", "Online"], rng.randint(0, 1)),
+            "field_event_speakers": _refs(rng),
+            "field_event_sponsors": _refs(rng, "node"),
+            "field_event_volunteers": _refs(rng),
+            "field_organizers": _refs(rng, most=2),
+            "field_event_address": {"locality": "Paris", "country": "FR"} if rng.random() < 0.7 else [],
+        })
+        return item
+    if dataset == "module_terms":
+        return {
+            "tid": str(entity_id),
+            "name": f"Term {entity_id}",
+            "description": "",
+            "weight": "0",
+            "vocabulary": {"id": rng.choice(["3", "44", "46"]), "resource": "taxonomy_vocabulary"},
+        }
+    if dataset == "comment":
+        return {
+            "cid": str(entity_id),
+            "name": f"user{entity_id % 997}",
+            "subject": "Re: issue",
+            "created": str(START + entity_id * 13),
+            "changed": str(START + entity_id * 13 + rng.randint(0, 3600)),
+            "status": "1",
+            # A few prolific authors and a long tail, like on drupal.org.
+            "author": _ref(rng, high=50) if rng.random() < 0.3 else _ref(rng, high=5000),
+            "node": _ref(rng, "node", high=3_000_000),
+            "comment_body": {"value": "Thanks! " * rng.randint(1, 30), "format": "1"},
+        }
+    raise ValueError(f"Unknown dataset: {dataset}")
+
+
+def make_page(dataset, page, limit=100, total=None, seed=0):
+    """
+    Make one API page for a dataset, with its `list` and navigation links.
+    Args:
+        dataset (str): The dataset name.
+        page (int): The page number (0-based).
+        limit (int): The number of items per page.
+        total (int): The total number of items in the dataset.
+        seed (int): The random seed.
+    Returns:
+        dict: The API page.
+    """
+    endpoint, _ = DATASETS[dataset]
+    total = limit * (page + 1) if total is None else total
+    last_page = max(0, (total - 1) // limit)
+    rng = random.Random(f"{dataset}:{page}:{seed}")
+    first_id = page * limit + 1
+    items = [
+        make_item(dataset, entity_id, rng)
+        for entity_id in range(first_id, min(first_id + limit, total + 1))
+    ]
+    url = f"{BASE_URL}/{endpoint}?limit={limit}"
+    envelope = {
+        "self": f"{url}&page={page}",
+        "first": f"{url}&page=0",
+        "last": f"{url}&page={last_page}",
+    }
+    if page > 0:
+        envelope["prev"] = f"{url}&page={page - 1}"
+    if page < last_page:
+        envelope["next"] = f"{url}&page={page + 1}"
+    envelope["list"] = items
+    return envelope
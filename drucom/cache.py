@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import hashlib
+from urllib.parse import urlencode
+
+
+class ResponseCache:
+    """
+    A size-bounded on-disk cache of API responses.
+
+    Entries are keyed by URL and query parameters. Each entry is a raw body file
+    and a small metadata file with the `ETag` and `Last-Modified` headers, used to
+    revalidate stale entries with a conditional request.
+
+    Entries younger than `ttl` are served without any request. When the cache
+    grows over `max_size` bytes, the least recently used entries are evicted.
+    In offline mode every request is served from the cache, and misses fail
+    with a `drucom.client.FetchError` instead of reaching the network.
+    """
+
+    def __init__(self, folder, max_size=1024 ** 3, ttl=24 * 3600, offline=False):
+        """
+        Initialize the cache.
+        Args:
+            folder (str): The cache folder.
+            max_size (int): The maximum total size of the cached bodies, in bytes.
+            ttl (float): The number of seconds an entry is fresh.
+            offline (bool): Whether to serve every request from the cache.
+        """
+        self.folder = folder
+        self.max_size = max_size
+        self.ttl = ttl
+        self.offline = offline
+        os.makedirs(folder, exist_ok=True)
+        self.size = sum(entry["size"] for entry in self._entries())
+
+    @staticmethod
+    def key(url, params=None):
+        """
+        Get the cache key of a request.
+        Args:
+            url (str): The URL of the request.
+            params (dict): The query parameters of the request.
+        Returns:
+            str: The key, a hash of the URL and the sorted parameters.
+        """
+        query = urlencode(sorted((params or {}).items()), doseq=True)
+        return hashlib.sha256(f"{url}?{query}".encode()).hexdigest()
+
+    def _path(self, key, suffix):
+        return os.path.join(self.folder, key[:2], f"{key}.{suffix}")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                if name.endswith(".meta"):
+                    path = os.path.join(root, name)
+                    try:
+                        with open(path) as f:
+                            yield {**json.load(f), "key": name[:-5], "used": os.path.getmtime(path)}
+                    except (OSError, ValueError):
+                        continue
+
+    def get(self, url, params=None):
+        """
+        Get a cached response.
+        Args:
+            url (str): The URL of the request.
+            params (dict): The query parameters of the request.
+        Returns:
+            dict: The entry metadata with its `body` (bytes), or None.
+        """
+        key = self.key(url, params)
+        try:
+            with open(self._path(key, "meta")) as f:
+                entry = json.load(f)
+            with open(self._path(key, "body"), "rb") as f:
+                entry["body"] = f.read()
+        except (OSError, ValueError):
+            return None
+        entry["key"] = key
+        return entry
+
+    def is_fresh(self, entry):
+        """
+        Check whether an entry can be served without revalidation.
+        Args:
+            entry (dict): An entry returned by `get`.
+        Returns:
+            bool: True if the entry is younger than the TTL, or the cache is offline.
+        """
+        return self.offline or time.time() - entry["stored"] < self.ttl
+
+    @staticmethod
+    def conditional_headers(entry):
+        """
+        Get the headers to revalidate an entry.
+        Args:
+            entry (dict): An entry returned by `get`, or None.
+        Returns:
+            dict: The `If-None-Match` and `If-Modified-Since` headers available.
+        """
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def put(self, url, params, body, headers):
+        """
+        Store a response.
+        Args:
+            url (str): The URL of the request.
+            params (dict): The query parameters of the request.
+            body (bytes): The raw response body.
+            headers (Mapping): The response headers.
+        """
+        key = self.key(url, params)
+        previous = self.get(url, params)
+        os.makedirs(os.path.dirname(self._path(key, "body")), exist_ok=True)
+        for suffix, data in (("body", body), ("meta", json.dumps({
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "stored": time.time(),
+            "size": len(body),
+        }).encode())):
+            tmp_path = self._path(key, suffix) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key, suffix))
+        self.size += len(body) - (len(previous["body"]) if previous else 0)
+        if self.size > self.max_size:
+            self.evict()
+
+    def refresh(self, entry):
+        """
+        Mark a revalidated entry as fresh again (after a 304 response).
+        Args:
+            entry (dict): An entry returned by `get`.
+        """
+        meta = {k: v for k, v in entry.items() if k not in ("body", "key")}
+        meta["stored"] = time.time()
+        with open(self._path(entry["key"], "meta"), "w") as f:
+            json.dump(meta, f)
+
+    def touch(self, entry):
+        """
+        Mark an entry as recently used, for the LRU eviction.
+        Args:
+            entry (dict): An entry returned by `get`.
+        """
+        try:
+            os.utime(self._path(entry["key"], "meta"))
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in `max_size`.
+        Evicts down to 90% of the maximum to avoid evicting on every write.
+        """
+        target = self.max_size * 0.9
+        for entry in sorted(self._entries(), key=lambda entry: entry["used"]):
+            if self.size <= target:
+                break
+            for suffix in ("meta", "body"):
+                try:
+                    os.remove(self._path(entry["key"], suffix))
+                except OSError:
+                    pass
+            self.size -= entry["size"]
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+        for entry in list(self._entries()):
+            for suffix in ("meta", "body"):
+                try:
+                    os.remove(self._path(entry["key"], suffix))
+                except OSError:
+                    pass
+        self.size = 0
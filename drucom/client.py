@@ -0,0 +1,346 @@
+import time
+import random
+import asyncio
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+import requests
+
+from drucom.cache import ResponseCache
+from drucom.codec import loads
+from drucom.metrics import Metrics
+
+
+class FetchError(Exception):
+    """
+    Raised when a request still fails after all retries.
+    """
+
+
+class AdaptiveLimiter:
+    """
+    An AIMD concurrency limiter for API clients.
+
+    The number of requests allowed in flight grows additively (about +1 per
+    window of successful requests) and shrinks multiplicatively when the server
+    throttles (429/503) or when latency climbs well above the best latency seen.
+    A `Retry-After` pause blocks every new request until it expires.
+    """
+
+    def __init__(self, initial=16, minimum=1, maximum=100, backoff=0.5, latency_tolerance=3.0):
+        """
+        Initialize the limiter.
+        Args:
+            initial (int): The initial concurrency limit.
+            minimum (int): The lowest concurrency limit.
+            maximum (int): The highest concurrency limit.
+            backoff (float): The factor applied to the limit when throttled.
+            latency_tolerance (float): Latency above this multiple of the best
+                latency seen is treated as congestion.
+        """
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.best_latency = None
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._condition = None
+
+    async def acquire(self):
+        """
+        Wait for a free slot, and for any `Retry-After` pause to expire.
+        Returns:
+            float: The time the slot was acquired, to pass back on completion.
+        """
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                elif self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return time.monotonic()
+                else:
+                    await self._condition.wait()
+
+    async def release(self):
+        """
+        Free a slot taken with `acquire`.
+        """
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, started):
+        """
+        Record a successful request and grow the limit.
+        Args:
+            started (float): The value returned by `acquire`.
+        """
+        latency = time.monotonic() - started
+        if self.best_latency is None or latency < self.best_latency:
+            self.best_latency = latency
+        if latency > self.best_latency * self.latency_tolerance and latency > 0.05:
+            self._decrease(started, 0.9)
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_throttle(self, started, retry_after=None):
+        """
+        Record a throttled request (429/503) and shrink the limit.
+        Args:
+            started (float): The value returned by `acquire`.
+            retry_after (float): Seconds to pause every request, if the server said so.
+        """
+        self._decrease(started, self.backoff)
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def on_error(self, started):
+        """
+        Record a failed request (5xx, network error) and shrink the limit.
+        Args:
+            started (float): The value returned by `acquire`.
+        """
+        self._decrease(started, self.backoff)
+
+    def _decrease(self, started, factor):
+        # Requests started before the last decrease already saw the old limit,
+        # only shrink once per window to avoid collapsing to the minimum.
+        if started < self._last_decrease:
+            return
+        self.limit = max(self.minimum, self.limit * factor)
+        self._last_decrease = time.monotonic()
+
+
+def parse_retry_after(value):
+    """
+    Parse a `Retry-After` header.
+    Args:
+        value (str): The header value, in seconds or as an HTTP date.
+    Returns:
+        float: The number of seconds to wait, or None.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class DrupalClient:
+    """
+    A shared client for the Drupal.org API with adaptive concurrency and retries.
+
+    Requests go through an `AdaptiveLimiter`. Throttled (429/503), server error
+    (5xx) and network failures are retried with jittered exponential backoff,
+    honoring `Retry-After`, until the time budget of the request is spent.
+
+    With a `ResponseCache`, fresh responses are served from disk and stale ones
+    are revalidated with a conditional request.
+
+    Bodies are decoded whole, or incrementally as they arrive with a streaming
+    decoder (see `drucom.codec.PageStream`). Streaming needs the whole body
+    when it is cached, so cached responses are decoded once read.
+
+    Every attempt is recorded in `metrics`: requests by status, latency,
+    bytes downloaded, retries by reason and the concurrency limit.
+    """
+
+    THROTTLE_STATUSES = {429, 503}
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    CHUNK_SIZE = 65536
+
+    def __init__(self, session, limiter=None, time_budget=300, base_delay=0.5, max_delay=60, cache=None,
+                 metrics=None):
+        """
+        Initialize the client.
+        Args:
+            session (aiohttp.ClientSession): The session to send requests with.
+            limiter (AdaptiveLimiter): The concurrency limiter, shared by all requests.
+            time_budget (float): The maximum number of seconds spent on one request,
+                retries included.
+            base_delay (float): The first retry delay, in seconds.
+            max_delay (float): The longest retry delay, in seconds.
+            cache (ResponseCache): The optional response cache.
+            metrics (Metrics): The metrics registry, shared with the crawl.
+        """
+        self.session = session
+        self.cache = cache
+        self.metrics = metrics or Metrics()
+        self.limiter = limiter or AdaptiveLimiter()
+        self.time_budget = time_budget
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt):
+        """
+        Get the delay before a retry, with full jitter.
+        Args:
+            attempt (int): The number of attempts made so far.
+        Returns:
+            float: The number of seconds to wait.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def get_json(self, url, params=None, decoder=None):
+        """
+        Get a JSON document, retrying transient failures.
+        Args:
+            url (str): The URL to request.
+            params (dict): The parameters to include in the request.
+            decoder (callable): Makes a streaming decoder, with `feed(chunk)` and
+                `close()` returning the document. A new decoder is made for every
+                attempt. By default, the body is read whole and decoded at once.
+        Returns:
+            dict: The decoded JSON document.
+        Raises:
+            FetchError: If the request failed for good or ran out of time budget.
+        """
+        cache = self.cache
+        metrics = self.metrics
+        entry = cache.get(url, params) if cache is not None else None
+        if entry is not None and cache.is_fresh(entry):
+            cache.touch(entry)
+            metrics.inc("cache_hits_total")
+            return decode(entry["body"], decoder)
+        if cache is not None and cache.offline:
+            raise FetchError(f"Not in the offline cache: {url} {params}")
+        headers = ResponseCache.conditional_headers(entry)
+
+        deadline = time.monotonic() + self.time_budget
+        attempt = 0
+        while True:
+            retry_after = None
+            started = await self.limiter.acquire()
+            try:
+                async with self.session.get(url, params=params, headers=headers) as response:
+                    metrics.inc("requests_total", status=response.status)
+                    if response.status == 304 and entry is not None:
+                        cache.refresh(entry)
+                        self.limiter.on_success(started)
+                        metrics.inc("cache_revalidated_total")
+                        return decode(entry["body"], decoder)
+                    if response.status in self.RETRY_STATUSES:
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                        if response.status in self.THROTTLE_STATUSES:
+                            self.limiter.on_throttle(started, retry_after)
+                        else:
+                            self.limiter.on_error(started)
+                        error = f"HTTP {response.status}"
+                    elif response.status >= 400:
+                        raise FetchError(f"HTTP {response.status} for {response.url}")
+                    elif decoder is not None and cache is None:
+                        stream = decoder()
+                        async for chunk in response.content.iter_chunked(self.CHUNK_SIZE):
+                            metrics.inc("response_bytes_total", len(chunk))
+                            stream.feed(chunk)
+                        data = stream.close()
+                        self.limiter.on_success(started)
+                        return data
+                    else:
+                        body = await response.read()
+                        metrics.inc("response_bytes_total", len(body))
+                        data = decode(body, decoder)
+                        if cache is not None:
+                            cache.put(url, params, body, response.headers)
+                        self.limiter.on_success(started)
+                        return data
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.limiter.on_error(started)
+                metrics.inc("requests_total", status=type(e).__name__)
+                error = repr(e)
+            finally:
+                await self.limiter.release()
+                metrics.observe("request_seconds", time.monotonic() - started)
+                metrics.set("concurrency_limit", int(self.limiter.limit))
+
+            attempt += 1
+            delay = max(retry_after or 0, self.backoff(attempt))
+            if time.monotonic() + delay > deadline:
+                metrics.inc("request_failures_total")
+                raise FetchError(f"Giving up on {url} after {attempt} attempts: {error}")
+            metrics.inc("retries_total", reason=error.split("(")[0])
+            await asyncio.sleep(delay)
+
+
+def decode(body, decoder=None):
+    """
+    Decode a whole JSON body.
+    Args:
+        body (bytes): The body.
+        decoder (callable): Makes a streaming decoder, fed the whole body at once.
+    Returns:
+        dict: The decoded JSON document.
+    """
+    if decoder is None:
+        return loads(body)
+    stream = decoder()
+    stream.feed(body)
+    return stream.close()
+
+
+def get_json_blocking(url, params=None, headers=None, cache=None, timeout=60, metrics=None, decoder=None):
+    """
+    Get a JSON document with a blocking request, through the response cache.
+    Args:
+        url (str): The URL to request.
+        params (dict): The parameters to include in the request.
+        headers (dict): The request headers.
+        cache (ResponseCache): The optional response cache.
+        timeout (float): The request timeout, in seconds.
+        metrics (Metrics): The optional metrics registry.
+        decoder (callable): Makes a streaming decoder (see `DrupalClient.get_json`).
+    Returns:
+        dict: The decoded JSON document.
+    Raises:
+        FetchError: If the request failed, or missed the offline cache.
+    """
+    entry = cache.get(url, params) if cache is not None else None
+    if entry is not None and cache.is_fresh(entry):
+        cache.touch(entry)
+        return decode(entry["body"], decoder)
+    if cache is not None and cache.offline:
+        raise FetchError(f"Not in the offline cache: {url} {params}")
+
+    metrics = metrics or Metrics()
+    start = time.monotonic()
+    stream = decoder is not None and cache is None
+    try:
+        response = requests.get(url, params=params, timeout=timeout, stream=stream, headers={
+            **(headers or {}), **ResponseCache.conditional_headers(entry)})
+        metrics.inc("requests_total", status=response.status_code)
+        if response.status_code == 304 and entry is not None:
+            cache.refresh(entry)
+            return decode(entry["body"], decoder)
+        if response.status_code >= 400:
+            raise FetchError(f"HTTP {response.status_code} for {response.url}")
+        if stream:
+            with response:
+                parser = decoder()
+                for chunk in response.iter_content(DrupalClient.CHUNK_SIZE):
+                    metrics.inc("response_bytes_total", len(chunk))
+                    parser.feed(chunk)
+                return parser.close()
+        metrics.inc("response_bytes_total", len(response.content))
+        if cache is not None:
+            cache.put(url, params, response.content, response.headers)
+        return decode(response.content, decoder)
+    except requests.RequestException as e:
+        metrics.inc("requests_total", status=type(e).__name__)
+        raise FetchError(f"Request to {url} failed: {e}") from e
+    finally:
+        metrics.observe("request_seconds", time.monotonic() - start)
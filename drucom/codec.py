@@ -0,0 +1,344 @@
+"""
+JSON codec
+==========
+Fast JSON decoding and encoding, with `orjson` when it is installed and the
+standard `json` module otherwise, and an incremental parser for API pages.
+
+A page of the Drupal API is an object holding a few navigation links and one
+large `list` of items. `ListStreamParser` decodes the items as the bytes of the
+response arrive, so a page never has to be held whole in memory.
+"""
+import re
+import json
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumpb(obj):
+        """
+        Encode an object to compact JSON bytes.
+        """
+        return orjson.dumps(obj)
+else:
+    loads = json.loads
+
+    def dumpb(obj):
+        """
+        Encode an object to compact JSON bytes.
+        """
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def dumps(obj):
+    """
+    Encode an object to a compact JSON string.
+    """
+    return dumpb(obj).decode()
+
+
+# Whitespace and commas between values.
+_SEPARATORS = re.compile(rb'[\s,]*')
+# Whitespace before a value.
+_WHITESPACE = re.compile(rb'\s*')
+# An object key and its colon.
+_KEY = re.compile(rb'("(?:[^"\\]|\\.)*")\s*:', re.S)
+# A complete string.
+_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"', re.S)
+# A number, true, false or null, followed by its delimiter.
+_SCALAR = re.compile(rb'[^,}\]\s]+(?=[\s,}\]])')
+# Everything up to the next bracket, skipping complete strings.
+_SKIP = re.compile(rb'(?:[^"\[\]{}]+|"(?:[^"\\]|\\.)*")*', re.S)
+
+_OPEN, _KEYS, _VALUE, _LIST, _NESTED, _END = range(6)
+
+
+def scan_items(buffer, pos):
+    """
+    Find the complete items of a JSON array, with vectorized bracket matching.
+    Args:
+        buffer (bytearray): The bytes received so far.
+        pos (int): The position of an item start (`{` or `[`) in the array.
+    Returns:
+        tuple: The position after the last complete item (`pos` if there is
+        none), and the position after the closing bracket of the array, or
+        None if the array is not closed yet or if scalar items follow the
+        last complete item.
+    """
+    chars = np.frombuffer(buffer, np.uint8, offset=pos)
+    quotes = np.flatnonzero(chars == 0x22)
+    # A quote is escaped when it follows an odd number of backslashes.
+    quotes = quotes[quotes > 0]
+    escapable = quotes[chars[quotes - 1] == 0x5C]
+    if len(escapable):
+        escaped = []
+        for quote in escapable:
+            run = 1
+            while run < quote and chars[quote - run - 1] == 0x5C:
+                run += 1
+            if run % 2:
+                escaped.append(quote)
+        quotes = np.setdiff1d(quotes, escaped)
+    brackets = np.flatnonzero(
+        (chars == 0x7B) | (chars == 0x7D) | (chars == 0x5B) | (chars == 0x5D))
+    # Brackets preceded by an odd number of quotes are in a string.
+    brackets = brackets[np.searchsorted(quotes, brackets) % 2 == 0]
+    # Opening brackets (0x5B, 0x7B) have the bit 0x02 set, closing ones (0x5D, 0x7D) do not.
+    depth = np.cumsum((chars[brackets] & 0x02).astype(np.int32) - 1)
+    del chars
+    closed = np.flatnonzero(depth < 0)
+    limit = closed[0] if len(closed) else len(depth)
+    ends = brackets[:limit][depth[:limit] == 0]
+    end = pos + int(ends[-1]) + 1 if len(ends) else pos
+    if len(closed):
+        bracket = pos + int(brackets[closed[0]])
+        # Scalar items between the last container and the bracket are left to the caller.
+        if not bytes(buffer[end:bracket]).strip():
+            return end, bracket + 1
+    return end, None
+
+
+class ListStreamParser:
+    """
+    An incremental parser for a JSON object holding one large array.
+
+    Bytes are fed as they arrive. The complete items of the array are decoded
+    and returned by `feed`, the other members of the object (e.g. `last`, `next`)
+    are collected in `envelope`. Only the last chunk and the item being parsed
+    are buffered, so the memory used does not depend on the length of the array.
+
+    Item boundaries are found with numpy over the whole chunk, and the items of
+    a chunk are decoded in a single call, so streaming costs about as much CPU
+    as decoding the whole page with the standard `json` module.
+    """
+
+    def __init__(self, key="list"):
+        """
+        Initialize the parser.
+        Args:
+            key (str): The member holding the array to stream.
+        """
+        self.key = key
+        self.envelope = {}
+        self._buffer = bytearray()
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._name = None
+        self._state = _OPEN
+
+    def feed(self, chunk):
+        """
+        Parse a chunk of bytes.
+        Args:
+            chunk (bytes): The next bytes of the document.
+        Returns:
+            list: The items of the array completed by this chunk.
+        Raises:
+            ValueError: If the document is not a JSON object.
+        """
+        self._buffer += chunk
+        items = []
+        self._parse(items)
+        # Drop the parsed bytes, keeping the value being scanned.
+        keep = self._pos if self._start is None else self._start
+        if keep > 65536 or keep * 2 > len(self._buffer):
+            del self._buffer[:keep]
+            self._pos -= keep
+            if self._start is not None:
+                self._start -= keep
+        return items
+
+    def close(self):
+        """
+        Finish parsing.
+        Returns:
+            dict: The members of the object other than the array.
+        Raises:
+            ValueError: If the document is incomplete.
+        """
+        if self._state != _END:
+            raise ValueError("Incomplete JSON document")
+        return self.envelope
+
+    def _parse(self, items):
+        buffer = self._buffer
+        size = len(buffer)
+        pos = self._pos
+        state = self._state
+        while pos < size:
+            if state == _OPEN:
+                pos = _WHITESPACE.match(buffer, pos).end()
+                if pos == size:
+                    break
+                if buffer[pos] != 0x7B:  # {
+                    raise ValueError("Expected a JSON object")
+                pos += 1
+                state = _KEYS
+            elif state == _KEYS:
+                pos = _SEPARATORS.match(buffer, pos).end()
+                if pos == size:
+                    break
+                if buffer[pos] == 0x7D:  # }
+                    pos += 1
+                    state = _END
+                    continue
+                match = _KEY.match(buffer, pos)
+                if match is None:
+                    break
+                self._name = loads(match.group(1))
+                pos = match.end()
+                state = _VALUE
+            elif state == _VALUE:
+                pos = _WHITESPACE.match(buffer, pos).end()
+                if pos == size:
+                    break
+                char = buffer[pos]
+                if char == 0x5B and self._name == self.key:  # [
+                    pos += 1
+                    state = _LIST
+                elif char == 0x5B or char == 0x7B:
+                    self._start, self._depth = pos, 0
+                    state = _NESTED
+                else:
+                    match = (_STRING if char == 0x22 else _SCALAR).match(buffer, pos)
+                    if match is None:
+                        break
+                    self.envelope[self._name] = loads(match.group())
+                    pos = match.end()
+                    state = _KEYS
+            elif state == _LIST:
+                pos = _SEPARATORS.match(buffer, pos).end()
+                if pos == size:
+                    break
+                char = buffer[pos]
+                if char == 0x5D:  # ]
+                    pos += 1
+                    state = _KEYS
+                elif char == 0x5B or char == 0x7B:
+                    end, closed = scan_items(buffer, pos)
+                    if end > pos:
+                        items.extend(loads(b"[" + buffer[pos:end] + b"]"))
+                    if closed is not None:
+                        pos = closed
+                        state = _KEYS
+                    elif end > pos:
+                        pos = end
+                    else:
+                        break
+                else:
+                    match = (_STRING if char == 0x22 else _SCALAR).match(buffer, pos)
+                    if match is None:
+                        break
+                    items.append(loads(match.group()))
+                    pos = match.end()
+            elif state == _NESTED:
+                # Jump from bracket to bracket until the value is closed.
+                depth = self._depth
+                while True:
+                    pos = _SKIP.match(buffer, pos).end()
+                    if pos == size or buffer[pos] == 0x22:  # Incomplete string.
+                        break
+                    depth += 1 if buffer[pos] in b"[{" else -1
+                    pos += 1
+                    if depth == 0:
+                        break
+                self._depth = depth
+                if depth:
+                    break
+                self.envelope[self._name] = loads(buffer[self._start:pos])
+                self._start = None
+                state = _KEYS
+            else:
+                pos = _WHITESPACE.match(buffer, pos).end()
+                if pos < size:
+                    raise ValueError("Extra data after the JSON document")
+        self._pos = pos
+        self._state = state
+
+
+class PageStream:
+    """
+    A streaming decoder for API pages, transforming items in batches.
+
+    The items of the page `list` are decoded as bytes arrive and transformed
+    every `batch_size` items, so only the transformed records and one batch of
+    raw items are kept in memory. Use a new stream for every response.
+    """
+
+    def __init__(self, transform, batch_size=100):
+        """
+        Initialize the stream.
+        Args:
+            transform (callable): Transforms a list of raw items into records.
+            batch_size (int): The number of raw items transformed at once.
+        """
+        self.transform = transform
+        self.batch_size = batch_size
+        self.parser = ListStreamParser()
+        self.records = []
+        self.batch = []
+
+    def feed(self, chunk):
+        """
+        Parse a chunk of the response body.
+        Args:
+            chunk (bytes): The next bytes of the body.
+        """
+        self.batch.extend(self.parser.feed(chunk))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Transform the pending raw items.
+        """
+        if self.batch:
+            self.records.extend(self.transform(self.batch))
+            self.batch = []
+
+    def close(self):
+        """
+        Finish the page.
+        Returns:
+            dict: The envelope of the page (`self`, `last`, `next`...), with the
+            transformed items in `records` instead of the raw `list`.
+        Raises:
+            ValueError: If the body is incomplete.
+        """
+        self.flush()
+        return {**self.parser.close(), "records": self.records}
+
+
+class RawBody:
+    """
+    A streaming "decoder" keeping the response body as bytes.
+
+    Used to hand whole pages over to a transform pool (see `drucom.pool`),
+    which decodes them off the event loop.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def feed(self, chunk):
+        """
+        Keep a chunk of the response body.
+        Args:
+            chunk (bytes): The next bytes of the body.
+        """
+        self.chunks.append(bytes(chunk))
+
+    def close(self):
+        """
+        Finish the body.
+        Returns:
+            bytes: The whole body.
+        """
+        return b"".join(self.chunks)
@@ -0,0 +1,226 @@
+"""
+Entity enrichment
+=================
+Run one API lookup per entity (e.g. the number of comments of every user)
+over millions of ids, with a sliding window of requests.
+
+Ids are read from a packed array on disk (see `pack_ids`), memory-mapped, so
+only the ids in flight are held in memory. A fixed number of workers each take
+the next id as soon as their lookup returns: a slow request only holds its own
+worker while the others keep the window full, instead of a whole chunk of ids
+waiting for its slowest request before the next chunk starts.
+
+Results are grouped in blocks of consecutive ids. A block is written to
+`page_<block>.json` as `{id: result}` once all its lookups returned, in the
+order blocks complete, and recorded in the manifest: a new run skips the
+blocks done and looks up the failed ones again.
+"""
+import os
+import time
+import asyncio
+
+import aiofiles
+import aiohttp
+import numpy as np
+
+from drucom.client import AdaptiveLimiter, DrupalClient
+from drucom.codec import dumpb, loads
+from drucom.manifest import CrawlManifest
+from drucom.metrics import Metrics
+
+
+def pack_ids(ids, path):
+    """
+    Save ids to a packed array file, replaced atomically.
+    Args:
+        ids (iterable): The ids, as integers or numeric strings.
+        path (str): The `.npy` file.
+    Returns:
+        int: The number of ids saved.
+    """
+    ids = np.asarray(ids, np.int64)
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, ids)
+    os.replace(tmp_path, path)
+    return len(ids)
+
+
+def pack_json_ids(json_path, path):
+    """
+    Convert a JSON list of ids (e.g. `uids.json`) to a packed array file.
+    Args:
+        json_path (str): The JSON file.
+        path (str): The `.npy` file.
+    Returns:
+        int: The number of ids saved.
+    """
+    with open(json_path, "rb") as f:
+        return pack_ids(loads(f.read()), path)
+
+
+def load_ids(path, mmap=True):
+    """
+    Load a packed array of ids.
+    Args:
+        path (str): The `.npy` file.
+        mmap (bool): Whether to memory-map the array rather than read it.
+    Returns:
+        numpy.ndarray: The ids.
+    """
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+
+class Block:
+    """
+    The results of a block of ids, complete once every lookup returned.
+    """
+
+    def __init__(self, size):
+        self.results = {}
+        self.remaining = size
+        self.failed = 0
+
+    def add(self, entity_id, result):
+        """
+        Record the result of a lookup.
+        Args:
+            entity_id (int): The id looked up.
+            result: The result, or None if the lookup failed.
+        Returns:
+            bool: True if the block is complete.
+        """
+        if result is None:
+            self.failed += 1
+        else:
+            self.results[str(entity_id)] = result
+        self.remaining -= 1
+        return self.remaining == 0
+
+
+class EntityEnricher:
+    """
+    Look up every id of a packed array with a sliding window of requests.
+
+    Example:
+        async def comment_total(client, uid):
+            data = await client.get_json(url, {'author': uid, 'limit': 1, 'full': 0})
+            return {"total": ...}
+
+        enricher = EntityEnricher("comment_totals", comment_total, "data/json/comment")
+        asyncio.run(enricher.run(load_ids("data/json/uids.npy")))
+    """
+
+    HEADERS = {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+        'User-Agent': 'Drucom 0.1.0'
+    }
+
+    def __init__(self, name, lookup, output_folder, block_size=1000, window=1000, metrics=None):
+        """
+        Initialize the enricher.
+        Args:
+            name (str): The name of the enrichment, in the metrics.
+            lookup (callable): `async lookup(client, entity_id)`, returning a
+                JSON-serializable result, or None if the lookup failed.
+            output_folder (str): The folder of the block files and the manifest.
+            block_size (int): The number of ids per block file.
+            window (int): The maximum number of lookups in flight.
+            metrics (Metrics): The metrics registry. Defaults to a new one.
+        """
+        self.name = name
+        self.lookup = lookup
+        self.output_folder = output_folder
+        self.block_size = block_size
+        self.window = window
+        self.metrics = metrics or Metrics()
+        os.makedirs(output_folder, exist_ok=True)
+        self.manifest = CrawlManifest(os.path.join(output_folder, 'manifest.json'))
+
+    def path(self, block):
+        """
+        Get the path of the file of a block.
+        """
+        return os.path.join(self.output_folder, f"page_{block}.json")
+
+    def blocks(self, ids):
+        """
+        Get the block numbers of ids, starting at 1.
+        """
+        return range(1, -(-len(ids) // self.block_size) + 1)
+
+    def pending(self, ids):
+        """
+        Iterate over the ids of the blocks not done, block by block.
+        Args:
+            ids (numpy.ndarray): The ids.
+        Yields:
+            tuple: The block number, its results and an id.
+        """
+        for block in self.manifest.todo(self.blocks(ids)):
+            start = (block - 1) * self.block_size
+            chunk = ids[start:start + self.block_size]
+            self.manifest.start(block)
+            results = Block(len(chunk))
+            for entity_id in chunk.tolist():
+                yield block, results, entity_id
+
+    async def work(self, client, pending):
+        """
+        Look up ids until none is left. Workers share the `pending` iterator.
+        """
+        for block, results, entity_id in pending:
+            started = time.perf_counter()
+            try:
+                result = await self.lookup(client, entity_id)
+            except Exception as e:
+                print(f"Error looking up {entity_id}: {e}")
+                result = None
+            self.metrics.observe("lookup_seconds", time.perf_counter() - started, dataset=self.name)
+            self.metrics.inc("lookups_total", dataset=self.name, status="failed" if result is None else "ok")
+            if results.add(entity_id, result):
+                await self.save(block, results)
+
+    async def save(self, block, results):
+        """
+        Write the results of a complete block and record it in the manifest.
+        """
+        with self.metrics.timer("write_seconds", dataset=self.name):
+            async with aiofiles.open(self.path(block), 'wb') as f:
+                await f.write(dumpb(results.results))
+        self.metrics.inc("pages_total", dataset=self.name, status="failed" if results.failed else "saved")
+        if results.failed:
+            print(f"Block {block}: {results.failed} lookups failed and were left out")
+            self.manifest.fail(block, f"{results.failed} lookups failed")
+        else:
+            self.manifest.done(block, len(results.results))
+
+    async def run(self, ids, client=None):
+        """
+        Look up every id, resuming the blocks not done by a previous run.
+        Metrics are written to metrics.json and metrics.prom in the output folder.
+        Args:
+            ids (numpy.ndarray): The ids, e.g. from `load_ids`.
+            client (DrupalClient): The client to use. By default, a client with
+                its own session and an adaptive limit up to `window` requests.
+        Returns:
+            list: The blocks which are not done or whose file is missing.
+        """
+        if client is None:
+            connector = aiohttp.TCPConnector(limit=self.window)
+            async with aiohttp.ClientSession(headers=self.HEADERS, connector=connector) as session:
+                limiter = AdaptiveLimiter(initial=min(50, self.window), maximum=self.window)
+                return await self.run(ids, DrupalClient(session, limiter, metrics=self.metrics))
+
+        start = time.time()
+        pending = self.pending(ids)
+        try:
+            await asyncio.gather(*[self.work(client, pending) for _ in range(min(self.window, len(ids)))])
+        finally:
+            self.manifest.flush()
+        gaps = self.manifest.verify(self.blocks(ids), lambda block: os.path.exists(self.path(block)))
+        print(f"Looked up {len(ids)} ids in {time.time() - start:.2f} seconds")
+        if gaps:
+            print(f"{len(gaps)} blocks are incomplete, run again to resume: {gaps[:10]}")
+        self.metrics.write(self.output_folder)
+        return gaps
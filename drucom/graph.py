@@ -0,0 +1,363 @@
+"""
+Entity graph
+============
+An index of the relationships between users, organizations, events, modules
+and terms, built from the merged Parquet files (see `DrupalDataMerger`).
+
+Every relationship is a multi-value id column of a dataset (e.g. the
+`sponsors` of events) stored as a CSR adjacency: the sorted ids of the
+source entities (`ids`), the offsets of their neighbors (`indptr`) and the
+neighbor ids (`indices`), sorted within each row. The reverse relationship
+(e.g. the events sponsored by an organization) is stored the same way and
+named with a `~` prefix, e.g. `~event.sponsors`.
+
+Arrays are saved as `.npy` files and memory-mapped when loaded, so opening
+the graph is instant and lookups only touch the pages they need: a lookup
+is a binary search in `ids` and a slice of `indices`.
+
+Neighbor ids missing from the target dataset are dangling. They are kept in
+the adjacency and reported by `build_graph`: e.g. the `organizations` of
+users reference field collection items, not organization nodes (issue #1).
+"""
+import os
+import json
+
+import numpy as np
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Relation name -> (source dataset, column, target dataset).
+RELATIONS = {
+    "user.organizations": ("user", "organizations", "organization"),
+    "user.mentors": ("user", "mentors", "user"),
+    "user.events": ("user", "events", "event"),
+    "event.speakers": ("event", "speakers", "user"),
+    "event.sponsors": ("event", "sponsors", "organization"),
+    "event.volunteers": ("event", "volunteers", "user"),
+    "event.organizers": ("event", "organizers", "user"),
+    "module.categories": ("module", "categories", "module_terms"),
+}
+
+_EMPTY = np.empty(0, np.int64)
+
+
+class Adjacency:
+    """
+    The CSR adjacency of one direction of a relationship.
+    """
+
+    def __init__(self, ids, indptr, indices):
+        """
+        Initialize the adjacency.
+        Args:
+            ids (numpy.ndarray): The sorted ids of the source entities.
+            indptr (numpy.ndarray): The offsets of the rows in `indices`, one more than `ids`.
+            indices (numpy.ndarray): The neighbor ids, sorted within each row.
+        """
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+
+    @classmethod
+    def from_edges(cls, sources, targets, ids=None):
+        """
+        Build an adjacency from edges.
+        Args:
+            sources (numpy.ndarray): The source id of every edge.
+            targets (numpy.ndarray): The target id of every edge.
+            ids (numpy.ndarray): All the source ids, including those without
+                edges. Defaults to the sources of the edges.
+        Returns:
+            Adjacency: The adjacency, without duplicate edges.
+        """
+        ids = np.asarray(ids if ids is not None else _EMPTY, np.int64)
+        if len(ids) > 1 and not (ids[1:] > ids[:-1]).all():
+            ids = np.unique(ids)
+        order = np.lexsort((targets, sources))
+        sources, targets = sources[order], targets[order]
+        if len(sources):
+            keep = np.ones(len(sources), bool)
+            keep[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+            sources, targets = sources[keep], targets[keep]
+        # The distinct sources and their number of edges, sources being sorted.
+        starts = np.flatnonzero(np.diff(sources, prepend=sources[:1] - 1))
+        distinct = sources[starts]
+        counts = np.diff(np.append(starts, len(sources)))
+        rows = np.searchsorted(ids, distinct)
+        unknown = rows == len(ids)
+        unknown[~unknown] = ids[rows[~unknown]] != distinct[~unknown]
+        if unknown.any():
+            ids = np.unique(np.concatenate([ids, distinct[unknown]]))
+            rows = np.searchsorted(ids, distinct)
+        degrees = np.zeros(len(ids), np.int64)
+        degrees[rows] = counts
+        indptr = np.zeros(len(ids) + 1, np.int64)
+        np.cumsum(degrees, out=indptr[1:])
+        return cls(ids, indptr, targets)
+
+    def reverse(self, ids=None):
+        """
+        Build the reverse adjacency.
+        Args:
+            ids (numpy.ndarray): All the target ids, including those without edges.
+        Returns:
+            Adjacency: The adjacency from targets to sources.
+        """
+        sources = np.repeat(self.ids, np.diff(self.indptr))
+        return Adjacency.from_edges(np.asarray(self.indices), sources, ids)
+
+    def row(self, entity_id):
+        """
+        Find the row of an entity.
+        Args:
+            entity_id (int): The id of the entity.
+        Returns:
+            int: The row, or -1 if the entity is unknown.
+        """
+        row = int(np.searchsorted(self.ids, entity_id))
+        if row < len(self.ids) and self.ids[row] == entity_id:
+            return row
+        return -1
+
+    def neighbors(self, entity_id):
+        """
+        Get the neighbors of an entity.
+        Args:
+            entity_id (int): The id of the entity.
+        Returns:
+            numpy.ndarray: The sorted neighbor ids, empty for unknown entities.
+        """
+        row = self.row(entity_id)
+        if row < 0:
+            return _EMPTY
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def degree(self, entity_id):
+        """
+        Get the number of neighbors of an entity.
+        Args:
+            entity_id (int): The id of the entity.
+        Returns:
+            int: The degree, 0 for unknown entities.
+        """
+        row = self.row(entity_id)
+        if row < 0:
+            return 0
+        return int(self.indptr[row + 1] - self.indptr[row])
+
+    def degrees(self):
+        """
+        Get the degree of every entity.
+        Returns:
+            numpy.ndarray: The degrees, in the order of `ids`.
+        """
+        return np.diff(self.indptr)
+
+    def save(self, folder, name):
+        """
+        Save the arrays to `<name>.ids.npy`, `<name>.indptr.npy` and `<name>.indices.npy`.
+        Args:
+            folder (str): The graph folder.
+            name (str): The name of the relation.
+        """
+        for array in ("ids", "indptr", "indices"):
+            tmp_path = os.path.join(folder, f"{name}.{array}.tmp.npy")
+            np.save(tmp_path, np.ascontiguousarray(getattr(self, array), np.int64))
+            os.replace(tmp_path, os.path.join(folder, f"{name}.{array}.npy"))
+
+    @classmethod
+    def load(cls, folder, name, mmap=True):
+        """
+        Load the arrays saved by `save`.
+        Args:
+            folder (str): The graph folder.
+            name (str): The name of the relation.
+            mmap (bool): Whether to memory-map the arrays rather than read them.
+        Returns:
+            Adjacency: The adjacency.
+        """
+        mode = "r" if mmap else None
+        return cls(*[np.load(os.path.join(folder, f"{name}.{array}.npy"), mmap_mode=mode)
+                     for array in ("ids", "indptr", "indices")])
+
+
+def read_relation(path, column):
+    """
+    Read the edges of a multi-value id column from a Parquet file.
+    Args:
+        path (str): The Parquet file of the source dataset.
+        column (str): The column holding lists of ids.
+    Returns:
+        tuple: The ids of all entities, and the source and target ids of every edge.
+    """
+    table = pq.read_table(path, columns=["id", column])
+    table = table.filter(pc.is_valid(table.column("id")))
+    ids = table.column("id").to_numpy()
+    lists = table.column(column).combine_chunks()
+    parents = pc.list_parent_indices(lists).to_numpy()
+    targets = pc.list_flatten(lists)
+    valid = pc.is_valid(targets).to_numpy(zero_copy_only=False)
+    targets = targets.fill_null(0).to_numpy().astype(np.int64)
+    return ids, ids[parents[valid]], targets[valid]
+
+
+def read_ids(path):
+    """
+    Read the ids of a dataset from a Parquet file.
+    Args:
+        path (str): The Parquet file of the dataset.
+    Returns:
+        numpy.ndarray: The sorted unique ids.
+    """
+    ids = pq.read_table(path, columns=["id"]).column("id").drop_null()
+    return np.unique(ids.to_numpy())
+
+
+def build_graph(data_dir=None, output_folder=None, relations=None):
+    """
+    Build the graph index from the merged Parquet files of the datasets.
+    Relations whose source dataset is missing are skipped. Relations whose
+    target dataset is missing are built, with unchecked neighbor ids.
+    Args:
+        data_dir (str): The folder of the `<dataset>.parquet` files. Defaults to `../data`.
+        output_folder (str): The graph folder. Defaults to `<data_dir>/graph`.
+        relations (list): The names of the relations to build. Defaults to all `RELATIONS`.
+    Returns:
+        dict: The report of every relation built: number of sources, edges,
+        and dangling edges and ids (neighbors missing from the target dataset).
+    """
+    data_dir = data_dir or os.path.join(os.path.dirname(__file__), "../data")
+    output_folder = output_folder or os.path.join(data_dir, "graph")
+    os.makedirs(output_folder, exist_ok=True)
+
+    def path(dataset):
+        return os.path.join(data_dir, f"{dataset}.parquet")
+
+    nodes = {}
+
+    def node_ids(dataset):
+        if dataset not in nodes:
+            nodes[dataset] = read_ids(path(dataset)) if os.path.exists(path(dataset)) else None
+        return nodes[dataset]
+
+    report = {}
+    for name in relations or RELATIONS:
+        source, column, target = RELATIONS[name]
+        if not os.path.exists(path(source)):
+            continue
+        ids, sources, targets = read_relation(path(source), column)
+        forward = Adjacency.from_edges(sources, targets, ids)
+        target_ids = node_ids(target)
+        forward.save(output_folder, name)
+        forward.reverse(target_ids).save(output_folder, f"~{name}")
+
+        entry = {"source": source, "target": target, "sources": len(forward.ids),
+                 "edges": len(forward.indices)}
+        if target_ids is not None:
+            neighbors = np.asarray(forward.indices)
+            found = np.searchsorted(target_ids, neighbors)
+            found[found == len(target_ids)] = 0
+            dangling = neighbors[target_ids[found] != neighbors] if len(target_ids) else neighbors
+            entry["dangling_edges"] = len(dangling)
+            entry["dangling_ids"] = len(np.unique(dangling))
+            entry["dangling_sample"] = np.unique(dangling)[:10].tolist()
+        report[name] = entry
+
+    tmp_path = os.path.join(output_folder, "graph.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"relations": report}, f, indent=2)
+    os.replace(tmp_path, os.path.join(output_folder, "graph.json"))
+    return report
+
+
+class EntityGraph:
+    """
+    Query the graph index built by `build_graph`.
+
+    Example:
+        graph = EntityGraph()
+        graph.neighbors("event.sponsors", 123)  # organizations sponsoring event 123
+        graph.neighbors("~event.speakers", 42)  # events where user 42 speaks
+        # Events sponsored by the organizations of user 42,
+        # and those where the user also speaks.
+        sponsored = graph.two_hop(42, "user.organizations", "~event.sponsors")
+        numpy.intersect1d(sponsored, graph.neighbors("~event.speakers", 42))
+    """
+
+    def __init__(self, folder=None, mmap=True):
+        """
+        Open the graph index.
+        Args:
+            folder (str): The graph folder. Defaults to `../data/graph`.
+            mmap (bool): Whether to memory-map the arrays rather than read them.
+        Raises:
+            FileNotFoundError: If the graph was not built.
+        """
+        self.folder = folder or os.path.join(os.path.dirname(__file__), "../data/graph")
+        with open(os.path.join(self.folder, "graph.json")) as f:
+            self.report = json.load(f)["relations"]
+        self.mmap = mmap
+        self._adjacencies = {}
+
+    def relation(self, name):
+        """
+        Get the adjacency of a relation, loaded on first use.
+        Args:
+            name (str): The relation, e.g. `event.sponsors`, or `~event.sponsors`
+                for the reverse relation.
+        Returns:
+            Adjacency: The adjacency.
+        Raises:
+            ValueError: If the relation was not built.
+        """
+        adjacency = self._adjacencies.get(name)
+        if adjacency is None:
+            if name.lstrip("~") not in self.report:
+                raise ValueError(f"Unknown relation: {name}")
+            adjacency = self._adjacencies[name] = Adjacency.load(self.folder, name, self.mmap)
+        return adjacency
+
+    def neighbors(self, name, entity_id):
+        """
+        Get the neighbors of an entity through a relation.
+        Args:
+            name (str): The relation.
+            entity_id (int): The id of the entity.
+        Returns:
+            numpy.ndarray: The sorted neighbor ids.
+        """
+        return self.relation(name).neighbors(entity_id)
+
+    def degree(self, name, entity_id):
+        """
+        Get the number of neighbors of an entity through a relation.
+        Args:
+            name (str): The relation.
+            entity_id (int): The id of the entity.
+        Returns:
+            int: The degree.
+        """
+        return self.relation(name).degree(entity_id)
+
+    def two_hop(self, entity_id, first, second):
+        """
+        Get the entities two relations away from an entity.
+        Args:
+            entity_id (int): The id of the entity.
+            first (str): The first relation, from the entity.
+            second (str): The second relation, from the neighbors of the entity.
+        Returns:
+            numpy.ndarray: The sorted unique ids reached.
+        """
+        adjacency = self.relation(second)
+        rows = [adjacency.neighbors(neighbor) for neighbor in self.neighbors(first, entity_id)]
+        return np.unique(np.concatenate(rows)) if rows else _EMPTY
+
+    def dangling(self):
+        """
+        Get the dangling ids of every relation.
+        Returns:
+            dict: The share of edges pointing to a missing entity, by relation.
+        """
+        return {name: entry["dangling_edges"] / entry["edges"] if entry["edges"] else 0.0
+                for name, entry in self.report.items() if "dangling_edges" in entry}
@@ -0,0 +1,85 @@
+"""
+Keyset pagination
+=================
+Crawl a dataset by id ranges with keyset cursors instead of `page=` offsets.
+
+Every dataset is sorted by its id in ascending order (see
+`DrupalDataFetcher.get_endpoint`), so a page can be requested as "the first
+items after id N" rather than "page K". The id space is split into ranges
+crawled concurrently, each one page after the other, from the last id of a
+page to the next. Deep offsets are never requested, and records created
+during the crawl do not shift the pages: Drupal ids only grow, so new records
+land after the last id and are picked up by the last range, which is open.
+
+A page is identified by its cursor, the id after which it starts. The
+manifest records the cursor of the next page of every page done, so an
+interrupted crawl resumes every range from its first missing page.
+
+The cursor is sent as `<id>[value]=N&<id>[operator]=>`, the property filter
+syntax of the restws module. Servers ignoring the operator would answer the
+first pages again and again: `check_cursor` stops a range when a page does not
+start after its cursor.
+"""
+
+
+def split_ids(max_id, partitions):
+    """
+    Split the id space into ranges of equal width.
+    Args:
+        max_id (int): The highest id of the dataset.
+        partitions (int): The number of ranges.
+    Returns:
+        list: The `[start, end]` ranges: ids above `start`, up to `end`
+        included. The end of the last range is None, so it follows new records.
+    """
+    if max_id <= 0:
+        return [[0, None]]
+    partitions = max(1, min(partitions, max_id))
+    width = -(-max_id // partitions)
+    bounds = list(range(0, max_id, width)) + [None]
+    return [[start, end] for start, end in zip(bounds, bounds[1:])]
+
+
+def cursor_params(params, field, cursor):
+    """
+    Build the parameters of the page after a cursor.
+    Args:
+        params (dict): The parameters of the dataset.
+        field (str): The id property, e.g. `nid`.
+        cursor (int): The id after which the page starts.
+    Returns:
+        dict: The parameters.
+    """
+    return {**params, 'sort': field, 'direction': 'ASC',
+            f'{field}[value]': cursor, f'{field}[operator]': '>'}
+
+
+def check_cursor(ids, cursor):
+    """
+    Check that the ids of a page all come after its cursor.
+    Args:
+        ids (list): The ids of the page, in order.
+        cursor (int): The id after which the page starts.
+    Raises:
+        ValueError: If the server ignored the cursor.
+    """
+    if ids and ids[0] <= cursor:
+        raise ValueError(f"The API ignored the cursor: id {ids[0]} after {cursor}")
+
+
+def resume_cursor(manifest, exists, start):
+    """
+    Find where to resume a range, following the cursors of its pages done.
+    Args:
+        manifest (CrawlManifest): The manifest of the crawl.
+        exists (callable): Checks whether a page is saved in the output sink.
+        start (int): The cursor of the first page of the range.
+    Returns:
+        int: The cursor of the first page missing, or None if the range is complete.
+    """
+    cursor = start
+    while manifest.is_done(cursor) and exists(cursor):
+        cursor = manifest.units[str(cursor)].get("next")
+        if cursor is None:
+            return None
+    return cursor
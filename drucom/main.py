@@ -4,7 +4,21 @@ Drucom Package
 ====================
 This package is designed to work with Drupal data.
 It provides functionality to merge and process data from Drupal JSON files.
+
+Command line usage:
+    drucom fetch user module event [--concurrency 100] [--incremental] [--resume] [--rewrite] [--metrics DIR]
+                [--sink parquet] [--pool process --workers 4] [--partitions 32]
+    drucom merge user module event [--workers 8]
+    drucom graph [--data DIR]
+    drucom aggregate [--data DIR] [--comments FILE ...]
+    drucom store user event [--data DIR] [--output DIR] [--row-group-size 50000]
 """
+import os
+import argparse
+
+# Heavy modules (pandas, jq, aiohttp) are imported by the commands themselves,
+# so that `drucom --help` starts instantly.
+
 
 def main():
     print(
@@ -17,22 +31,224 @@ def main():
 def help():
     print(
         "# Example usage of DrupalDataFetcher\n"
-        "from drucom import DrupalDataFetcher\n"
-        "url = 'https://example.com/drupal-data.json'\n"
-        "output_file = './data/drupal_data.json'\n"
-        "fetcher = DrupalDataFetcher(url, output_file)\n"
-        "fetcher.fetch_data()\n"
+        "from drucom.DrupalDataFetcher import DrupalDataFetcher\n"
+        "fetcher = DrupalDataFetcher('user')\n"
+        "fetcher.run()\n"
     )
     
     print(
         "# Example usage of DrupalDataMerger\n"
-        "from drucom import DrupalDataMerger\n"
-        "input_dir = './data/json'\n"
-        "output_file = './data/merged_data.json'\n"
-        "merger = DrupalDataMerger(input_dir, output_file)\n"
-        "merger.merge_data()\n"
-        "merger.process_data()\n"
+        "from drucom.DrupalDataMerger import DrupalDataMerger\n"
+        "merger = DrupalDataMerger('user')\n"
+        "merger.merge_data()  # ../data/user.parquet\n"
     )
 
+def fetch(args):
+    """
+    Crawl one or more datasets at once through a shared session.
+    """
+    from drucom.cache import ResponseCache
+    from drucom.orchestrator import CrawlOrchestrator
+    from drucom.pool import TransformPool
+
+    cache = None
+    if args.cache or args.offline:
+        cache = ResponseCache(args.cache or ".drucom_cache", offline=args.offline)
+    pool = None
+    if args.pool:
+        pool = TransformPool(args.pool, workers=args.workers)
+    try:
+        orchestrator = CrawlOrchestrator(
+            args.datasets,
+            max_concurrent_requests=args.concurrency,
+            metrics_folder=args.metrics,
+            profile=args.profile,
+            backend=args.backend,
+            cache=cache,
+            sink=args.sink,
+            pool=pool,
+            partitions=args.partitions,
+            rewrite=args.rewrite,
+        )
+        orchestrator.run(incremental=args.incremental, resume=args.resume)
+    finally:
+        if pool is not None:
+            pool.close()
+
+def merge(args):
+    """
+    Merge the page files of one or more datasets into Parquet files.
+    """
+    from drucom.DrupalDataMerger import DrupalDataMerger
+    from drucom.terms import TermResolver, fetch_terms
+
+    terms = TermResolver(fetch=None if args.no_fetch_terms else fetch_terms)
+    # Merge the terms first, so that modules and themes resolve the latest ones.
+    datasets = sorted(args.datasets, key=lambda name: name != "module_terms")
+    for dataset_name in datasets:
+        DrupalDataMerger(dataset_name, workers=args.workers, terms=terms).run()
+
+def graph(args):
+    """
+    Build the entity graph index from the merged datasets and report dangling ids.
+    """
+    from drucom.graph import build_graph
+
+    report = build_graph(args.data, args.output)
+    if not report:
+        raise FileNotFoundError("No merged datasets to build the graph from, run `drucom merge` first")
+    for name, entry in report.items():
+        line = f"{name}: {entry['sources']} {entry['source']}, {entry['edges']} edges"
+        if "dangling_edges" in entry:
+            line += (f", {entry['dangling_edges']} dangling edges to"
+                     f" {entry['dangling_ids']} unknown {entry['target']} ids")
+        print(line)
+
+def aggregate(args):
+    """
+    Update the aggregate views with the user pages and comment totals added since the last run.
+    """
+    from drucom.aggregates import Aggregates
+    from drucom.sync import list_files
+
+    data_dir = args.data or os.path.join(os.path.dirname(__file__), "../data")
+    aggregates = Aggregates(args.output or os.path.join(data_dir, "aggregates"))
+    counts = os.path.join(data_dir, "json", "comment", "counts.json")
+    comments = ([counts] if os.path.exists(counts) else []) + (args.comments or [])
+    users = list_files(os.path.join(data_dir, "json", "user"))
+    if not users and not comments and not aggregates.files:
+        raise FileNotFoundError(f"No user pages nor comment totals in {data_dir}, run `drucom fetch` first")
+    added = aggregates.add_files("user", users) + aggregates.add_files("comment_totals", comments)
+    aggregates.save()
+    print(f"Aggregated {added} new or changed files into {aggregates.folder}:"
+          f" {aggregates.users} users, {len(aggregates.years)} years, {len(aggregates.commenters)} regions")
+
+def store(args):
+    """
+    Write merged datasets to the store, partitioned by year.
+    """
+    from drucom.store import build_store
+
+    data_dir = args.data or os.path.join(os.path.dirname(__file__), "../data")
+    output = args.output or os.path.join(data_dir, "store")
+    for dataset_name in args.datasets:
+        rows = build_store(dataset_name, os.path.join(data_dir, f"{dataset_name}.parquet"), output,
+                           row_group_size=args.row_group_size)
+        years = [year for year in rows if year is not None]
+        span = f" in {len(years)} years ({min(years)}-{max(years)})" if years else ""
+        print(f"Stored {sum(rows.values())} rows of {dataset_name}{span} into {output}")
+
+def get_parser():
+    """
+    Build the command line parser.
+    """
+    parser = argparse.ArgumentParser(
+        prog="drucom", description="Data Analysis of the Drupal Community.")
+    commands = parser.add_subparsers(dest="command")
+
+    fetch_parser = commands.add_parser(
+        "fetch", help="Fetch datasets from the Drupal.org API.")
+    fetch_parser.add_argument(
+        "datasets", nargs="+",
+        help="Datasets to fetch: user, organization, module, event, module_terms, theme, comment.")
+    fetch_parser.add_argument(
+        "--concurrency", type=int, default=100,
+        help="Maximum number of concurrent requests, shared by all datasets.")
+    fetch_parser.add_argument(
+        "--incremental", action="store_true",
+        help="Only fetch the records changed since the last run.")
+    fetch_parser.add_argument(
+        "--resume", action="store_true",
+        help="Resume the previous crawl, fetching only missing and failed pages.")
+    fetch_parser.add_argument(
+        "--rewrite", action="store_true",
+        help="Rewrite every page, instead of saving the changes since the last crawl to a delta file.")
+    fetch_parser.add_argument(
+        "--backend", choices=["jq", "python"], default="jq",
+        help="Transform backend.")
+    fetch_parser.add_argument(
+        "--sink", choices=["json", "ndjson", "ndjson.zst", "parquet"], default="json",
+        help="Output of full crawls: page files, NDJSON parts (zstd compressed) or Parquet parts.")
+    fetch_parser.add_argument(
+        "--partitions", type=int, metavar="N",
+        help="Crawl N id ranges concurrently with keyset cursors instead of numbered pages.")
+    fetch_parser.add_argument(
+        "--pool", choices=["thread", "process"],
+        help="Transform pages in a pool of threads or processes, off the event loop.")
+    fetch_parser.add_argument(
+        "--workers", type=int,
+        help="Number of transform workers of the pool. Defaults to the number of CPUs.")
+    fetch_parser.add_argument(
+        "--cache", metavar="DIR", help="Cache API responses in this folder.")
+    fetch_parser.add_argument(
+        "--offline", action="store_true",
+        help="Only serve responses from the cache.")
+    fetch_parser.add_argument(
+        "--metrics", metavar="DIR",
+        help="Write the metrics of the run (metrics.json, metrics.prom) to this folder.")
+    fetch_parser.add_argument(
+        "--profile", action="store_true",
+        help="Profile each phase with cProfile and tracemalloc, into <metrics>/profiles.")
+    fetch_parser.set_defaults(func=fetch)
+
+    merge_parser = commands.add_parser(
+        "merge", help="Merge fetched pages into data/<dataset>.parquet.")
+    merge_parser.add_argument(
+        "datasets", nargs="+", help="Datasets to merge.")
+    merge_parser.add_argument(
+        "--workers", type=int, help="Number of processes reading pages. Defaults to the number of CPUs.")
+    merge_parser.add_argument(
+        "--no-fetch-terms", action="store_true",
+        help="Do not fetch the taxonomy terms missing from data/module_terms.parquet.")
+    merge_parser.set_defaults(func=merge)
+
+    graph_parser = commands.add_parser(
+        "graph", help="Build the entity graph index from data/<dataset>.parquet.")
+    graph_parser.add_argument(
+        "--data", metavar="DIR", help="Folder of the merged datasets. Defaults to data/.")
+    graph_parser.add_argument(
+        "--output", metavar="DIR", help="Folder of the graph index. Defaults to <data>/graph.")
+    graph_parser.set_defaults(func=graph)
+
+    aggregate_parser = commands.add_parser(
+        "aggregate", help="Update the aggregate views with the pages fetched since the last run.")
+    aggregate_parser.add_argument(
+        "--data", metavar="DIR", help="Data folder, with json/user and json/comment/counts.json. Defaults to data/.")
+    aggregate_parser.add_argument(
+        "--comments", nargs="+", metavar="FILE",
+        help="Other comment totals files, e.g. the block files of script/fetch_comments.py.")
+    aggregate_parser.add_argument(
+        "--output", metavar="DIR", help="Folder of the views. Defaults to <data>/aggregates.")
+    aggregate_parser.set_defaults(func=aggregate)
+
+    store_parser = commands.add_parser(
+        "store", help="Write data/<dataset>.parquet to data/store, partitioned by year.")
+    store_parser.add_argument(
+        "datasets", nargs="+", help="Datasets to store.")
+    store_parser.add_argument(
+        "--data", metavar="DIR", help="Folder of the merged datasets. Defaults to data/.")
+    store_parser.add_argument(
+        "--output", metavar="DIR", help="Folder of the store. Defaults to <data>/store.")
+    store_parser.add_argument(
+        "--row-group-size", type=int, default=50_000,
+        help="Number of rows per row group: smaller groups are skipped more precisely by filters.")
+    store_parser.set_defaults(func=store)
+    return parser
+
+def cli(argv=None):
+    """
+    Entry point of the `drucom` command.
+    """
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        main()
+        parser.print_help()
+        return
+    try:
+        args.func(args)
+    except (ValueError, FileNotFoundError) as e:
+        parser.exit(1, f"drucom: {e}\n")
+
 if __name__ == "__main__":
-    main()
+    cli()
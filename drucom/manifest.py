@@ -0,0 +1,150 @@
+import os
+import json
+import time
+
+
+class CrawlManifest:
+    """
+    A class to persist the progress of a crawl, unit by unit.
+
+    A unit is a page (or a chunk of ids) identified by a number. Each unit is
+    `in_flight`, `done` (with its record count) or `failed` (with the error).
+    Units missing from the manifest were never started.
+
+    The manifest is saved atomically to a JSON file every `flush_every` updates,
+    so a crashed crawl can be resumed by fetching only the units which are not done.
+    """
+
+    IN_FLIGHT = "in_flight"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, path, flush_every=50):
+        """
+        Initialize the manifest, loading it from disk if it exists.
+        Args:
+            path (str): The path of the manifest file.
+            flush_every (int): The number of updates between two saves.
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self.meta = {}
+        self.units = {}
+        self._updates = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            self.meta = manifest.get("meta", {})
+            self.units = manifest.get("units", {})
+
+    def reset(self, **meta):
+        """
+        Start a new crawl, forgetting all units.
+        Args:
+            **meta: Metadata about the crawl (e.g. url, total units).
+        """
+        self.meta = {**meta, "started": time.time()}
+        self.units = {}
+        self.flush()
+
+    def start(self, unit):
+        """
+        Mark a unit as in flight.
+        Args:
+            unit (int): The unit number.
+        """
+        entry = self.units.setdefault(str(unit), {"attempts": 0})
+        entry["status"] = self.IN_FLIGHT
+        entry["attempts"] += 1
+        entry.pop("error", None)
+        self._updated()
+
+    def done(self, unit, records, **details):
+        """
+        Mark a unit as successfully saved.
+        Args:
+            unit (int): The unit number.
+            records (int): The number of records saved.
+            **details: Other details to keep (e.g. the cursor of the next page).
+        """
+        entry = self.units.setdefault(str(unit), {"attempts": 1})
+        entry["status"] = self.DONE
+        entry["records"] = records
+        entry.update(details)
+        self._updated()
+
+    def fail(self, unit, error):
+        """
+        Mark a unit as failed.
+        Args:
+            unit (int): The unit number.
+            error (Exception|str): The reason of the failure.
+        """
+        entry = self.units.setdefault(str(unit), {"attempts": 1})
+        entry["status"] = self.FAILED
+        entry["error"] = str(error)
+        self._updated()
+
+    def is_done(self, unit):
+        """
+        Check whether a unit was successfully saved.
+        Args:
+            unit (int): The unit number.
+        Returns:
+            bool: True if the unit is done.
+        """
+        return self.units.get(str(unit), {}).get("status") == self.DONE
+
+    def todo(self, units):
+        """
+        Filter the units left to fetch: never started, in flight or failed.
+        Args:
+            units (iterable): All the units of the crawl.
+        Yields:
+            int: The units which are not done.
+        """
+        for unit in units:
+            if not self.is_done(unit):
+                yield unit
+
+    def verify(self, units, exists=None):
+        """
+        Find the gaps of a crawl.
+        Args:
+            units (iterable): All the units of the crawl.
+            exists (callable): Optional `exists(unit)` check of the saved output,
+                to catch files removed after they were saved.
+        Returns:
+            list: The units which are not done or whose output is missing.
+        """
+        return [
+            unit for unit in units
+            if not self.is_done(unit) or (exists is not None and not exists(unit))
+        ]
+
+    def summary(self):
+        """
+        Count the units and records by status.
+        Returns:
+            dict: The number of units per status, and the total of records saved.
+        """
+        summary = {self.IN_FLIGHT: 0, self.DONE: 0, self.FAILED: 0, "records": 0}
+        for entry in self.units.values():
+            summary[entry["status"]] += 1
+            summary["records"] += entry.get("records", 0)
+        return summary
+
+    def flush(self):
+        """
+        Save the manifest atomically.
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"meta": self.meta, "units": self.units}, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+        self._updates = 0
+
+    def _updated(self):
+        self._updates += 1
+        if self._updates >= self.flush_every:
+            self.flush()
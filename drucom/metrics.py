@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import bisect
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+# Upper bounds of the histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Upper bounds of the histogram buckets for queue depths.
+DEPTH_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Histogram:
+    """
+    A histogram with fixed buckets, as in Prometheus.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = None
+
+    def observe(self, value):
+        """
+        Record a value.
+        Args:
+            value (float): The value.
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+        Estimate a quantile by linear interpolation within its bucket.
+        Args:
+            q (float): The quantile, between 0 and 1.
+        Returns:
+            float: The estimated value, or None if nothing was recorded.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.buckets[index - 1] if index > 0 else 0.0
+                high = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(low + (high - low) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def summary(self):
+        """
+        Summarize the histogram.
+        Returns:
+            dict: The count, sum, mean, p50, p99 and max of the values.
+        """
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+
+class Metrics:
+    """
+    A registry of counters, gauges and histograms for a crawl.
+
+    Metrics are identified by a name and optional labels, like Prometheus
+    metrics (e.g. `requests_total{status="200"}`). Recording a value is a dict
+    lookup and an addition, cheap enough to stay on for every crawl.
+
+    The registry is exported as a JSON run summary and as a Prometheus textfile
+    (for the node exporter textfile collector). With a `profile_folder`, each
+    phase (see `phase`) is also profiled with cProfile and tracemalloc.
+    """
+
+    PREFIX = "drucom_"
+
+    def __init__(self, profile_folder=None, **labels):
+        """
+        Initialize the registry.
+        Args:
+            profile_folder (str): The folder to save the phase profiles to.
+                None to disable profiling.
+            **labels: Labels added to every metric (e.g. dataset).
+        """
+        self.profile_folder = profile_folder
+        self.labels = labels
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    @staticmethod
+    def _key(name, labels):
+        # Label values are strings, so that keys stay sortable whatever their
+        # type (e.g. an HTTP status or the name of an exception).
+        return (name, tuple(sorted((label, str(value)) for label, value in labels.items()))) if labels else (name, ())
+
+    def inc(self, name, amount=1, **labels):
+        """
+        Increment a counter.
+        Args:
+            name (str): The counter name.
+            amount (float): The increment.
+            **labels: The labels of the counter.
+        """
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """
+        Set a gauge.
+        Args:
+            name (str): The gauge name.
+            value (float): The value.
+            **labels: The labels of the gauge.
+        """
+        self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """
+        Record a value in a histogram.
+        Args:
+            name (str): The histogram name.
+            value (float): The value.
+            buckets (tuple): The buckets of the histogram, used on creation.
+            **labels: The labels of the histogram.
+        """
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Time a block into a histogram, in seconds.
+        Args:
+            name (str): The histogram name.
+            **labels: The labels of the histogram.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time a phase of the crawl (e.g. discovery, fetch, finish).
+        When profiling, the phase is also run under cProfile and tracemalloc: the
+        profile is saved to `<profile_folder>/<name>.prof` and the peak of
+        allocated memory is recorded in the `phase_peak_bytes` gauge.
+        Phases must not overlap when profiling.
+        Args:
+            name (str): The phase name.
+        """
+        profiler = None
+        tracing = False
+        if self.profile_folder is not None:
+            os.makedirs(self.profile_folder, exist_ok=True)
+            tracing = not tracemalloc.is_tracing()
+            if tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.set("phase_seconds", time.perf_counter() - start, phase=name)
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(os.path.join(self.profile_folder, f"{name}.prof"))
+                self.set("phase_peak_bytes", tracemalloc.get_traced_memory()[1], phase=name)
+                if tracing:
+                    tracemalloc.stop()
+
+    def value(self, name, **labels):
+        """
+        Get the value of a counter or a gauge.
+        Args:
+            name (str): The metric name.
+            **labels: The labels of the metric.
+        Returns:
+            float: The value, 0 if it was never recorded.
+        """
+        key = self._key(name, labels)
+        return self.counters.get(key, self.gauges.get(key, 0))
+
+    def histogram(self, name, **labels):
+        """
+        Get a histogram.
+        Args:
+            name (str): The histogram name.
+            **labels: The labels of the histogram.
+        Returns:
+            Histogram: The histogram, or None if it was never recorded.
+        """
+        return self.histograms.get(self._key(name, labels))
+
+    def _name(self, name, labels):
+        labels = {**self.labels, **dict(labels)}
+        if not labels:
+            return name
+        return name + "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+    def summary(self):
+        """
+        Summarize every metric.
+        Returns:
+            dict: The run summary, with the counters, gauges and histograms
+            keyed by `name{labels}`.
+        """
+        return {
+            "labels": self.labels,
+            "started": self.started,
+            "seconds": time.time() - self.started,
+            "counters": {self._name(n, l): v for (n, l), v in sorted(self.counters.items())},
+            "gauges": {self._name(n, l): v for (n, l), v in sorted(self.gauges.items())},
+            "histograms": {self._name(n, l): h.summary()
+                           for (n, l), h in sorted(self.histograms.items(), key=lambda i: i[0])},
+        }
+
+    def prometheus(self):
+        """
+        Render every metric in the Prometheus text exposition format.
+        Returns:
+            str: The metrics.
+        """
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(self.counters.items()):
+            declare(self.PREFIX + name, "counter")
+            lines.append(f"{self.PREFIX}{self._name(name, labels)} {value}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            declare(self.PREFIX + name, "gauge")
+            lines.append(f"{self.PREFIX}{self._name(name, labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda i: i[0]):
+            metric = self.PREFIX + name
+            declare(metric, "histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f"{metric}_bucket{self._name('', labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.PREFIX}{self._name(name + '_sum', labels)} {histogram.sum}")
+            lines.append(f"{self.PREFIX}{self._name(name + '_count', labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, folder, name="metrics"):
+        """
+        Write the JSON run summary and the Prometheus textfile.
+        Args:
+            folder (str): The folder to write to.
+            name (str): The base name of the files.
+        Returns:
+            tuple: The paths of the `.json` and `.prom` files.
+        """
+        os.makedirs(folder, exist_ok=True)
+        paths = []
+        for extension, content in (
+                ("json", json.dumps(self.summary(), indent=1)), ("prom", self.prometheus())):
+            path = os.path.join(folder, f"{name}.{extension}")
+            # The textfile collector may read at any time, replace atomically.
+            with open(path + ".tmp", "w") as f:
+                f.write(content)
+            os.replace(path + ".tmp", path)
+            paths.append(path)
+        return tuple(paths)
+
+    def report(self):
+        """
+        Format a one line report of the crawl, to print at the end of a run.
+        Returns:
+            str: The report.
+        """
+        requests = sum(v for (n, _), v in self.counters.items() if n == "requests_total")
+        downloaded = self.value("response_bytes_total") / 2 ** 20
+        retries = sum(v for (n, _), v in self.counters.items() if n == "retries_total")
+        parts = [f"{requests} requests", f"{downloaded:.1f} MiB", f"{retries} retries"]
+        for name, label in (("request_seconds", "request"), ("transform_seconds", "transform"),
+                            ("write_seconds", "write")):
+            total = sum(h.sum for (n, _), h in self.histograms.items() if n == name)
+            parts.append(f"{label} {total:.2f}s")
+        return ", ".join(parts)
@@ -0,0 +1,156 @@
+import os
+import asyncio
+import time
+
+from drucom.DrupalDataFetcher import DrupalDataFetcher
+from drucom.metrics import Metrics
+from drucom.scheduler import PagePipeline
+
+
+def round_robin(*iterables):
+    """
+    Interleave iterables, one item of each in turn, until all are exhausted.
+    Args:
+        *iterables: The iterables to interleave.
+    Yields:
+        The items of the iterables.
+    """
+    iterators = [iter(iterable) for iterable in iterables]
+    while iterators:
+        for iterator in list(iterators):
+            try:
+                yield next(iterator)
+            except StopIteration:
+                iterators.remove(iterator)
+
+
+class CrawlOrchestrator:
+    """
+    A class to crawl several datasets at once.
+
+    All datasets share one event loop, one HTTP session and one adaptive
+    concurrency budget. Page discovery runs in parallel threads, then the pages
+    of all datasets go through a single bounded pipeline in round-robin order,
+    so a large dataset does not starve the small ones. Datasets crawled by id
+    ranges (`partitions`, see `drucom.keyset`) follow their cursors alongside.
+
+    All datasets record to one metrics registry, labelled by dataset where it
+    applies, which is written to `metrics_folder` at the end of the run.
+    """
+
+    def __init__(self, dataset_names, max_concurrent_requests=100, metrics=None, metrics_folder=None,
+                 profile=False, **options):
+        """
+        Initialize a fetcher for each dataset.
+        Args:
+            dataset_names (list): The names of the datasets to crawl.
+            max_concurrent_requests (int): The global maximum number of concurrent requests.
+            metrics (Metrics): The metrics registry.
+            metrics_folder (str): The folder to write the metrics of the run to.
+                Defaults to `../data/metrics`.
+            profile (bool): Whether to profile each phase into `<metrics_folder>/profiles`,
+                when no metrics registry is given.
+            **options: Options passed to every `DrupalDataFetcher` (e.g. backend,
+                cache, sink, or a transform pool shared by all datasets).
+        Raises:
+            ValueError: If a dataset name is unknown.
+        """
+        self.metrics_folder = metrics_folder or os.path.join(
+            os.path.dirname(__file__), "../data/metrics")
+        self.metrics = metrics or Metrics(
+            profile_folder=os.path.join(self.metrics_folder, "profiles") if profile else None)
+        self.fetchers = [DrupalDataFetcher(name, metrics=self.metrics, **options)
+                         for name in dataset_names]
+        self.max_concurrent_requests = max_concurrent_requests
+
+    async def crawl(self, incremental=False, resume=False):
+        """
+        Crawl all datasets.
+        Args:
+            incremental (bool): Whether to only fetch the records changed since the last run.
+            resume (bool): Whether to resume the previous full crawls.
+        Raises:
+            ValueError: If a dataset cannot be synced incrementally.
+        """
+        full, keyset, changed = [], [], []
+        for fetcher in self.fetchers:
+            if incremental and fetcher.sync_state is None:
+                raise ValueError(
+                    f"Dataset {fetcher.dataset_name} cannot be synced incrementally")
+            endpoint, params = fetcher.get_endpoint(fetcher.dataset_name)
+            job = (fetcher, f"{fetcher.BASE_URL}/{endpoint}", params)
+            fetcher.failed_pages = 0
+            if incremental and fetcher.sync_state.mark is not None:
+                changed.append(job)
+            elif fetcher.partitions:
+                keyset.append(job)
+            else:
+                full.append(job)
+
+        # Page discovery is blocking, run it for all datasets at once.
+        with self.metrics.phase("discovery"):
+            plans = await asyncio.gather(*[
+                asyncio.to_thread(fetcher.plan_pages, url, params, resume)
+                for fetcher, url, params in full
+            ])
+            ranges = await asyncio.gather(*[
+                asyncio.to_thread(fetcher.plan_ranges, url, params, resume)
+                for fetcher, url, params in keyset
+            ])
+
+        async def fetch(unit):
+            fetcher, url, params = full[unit[0]]
+            return await fetcher.fetch_tracked_page(client, url, params, unit[1])
+
+        async def save(unit, data):
+            await full[unit[0]][0].save_tracked_page(unit[1], data)
+
+        units = round_robin(*[
+            [(index, page) for page in pages] for index, (_, pages) in enumerate(plans)
+        ])
+        try:
+            with self.metrics.phase("fetch"):
+                async with self.fetchers[0].open_client(self.max_concurrent_requests) as client:
+                    pipeline = PagePipeline(
+                        fetch, save, fetch_workers=self.max_concurrent_requests,
+                        process_workers=max((fetcher.process_workers for fetcher in self.fetchers), default=1),
+                        metrics=self.metrics)
+                    totals = await asyncio.gather(
+                        pipeline.run(units),
+                        *[fetcher.fetch_ranges(url, params, fetcher_ranges, client=client)
+                          for (fetcher, url, params), fetcher_ranges in zip(keyset, ranges)],
+                        *[fetcher.fetch_changed_pages(url, params, client=client)
+                          for fetcher, url, params in changed],
+                    )
+        finally:
+            for fetcher, _, _ in full:
+                fetcher.flush()
+        ranged_totals, changed_totals = totals[1:1 + len(keyset)], totals[1 + len(keyset):]
+
+        # Only move the high-water marks of the datasets crawled without failure.
+        with self.metrics.phase("finish"):
+            crawled = [(fetcher, total_pages) for (fetcher, _, _), (total_pages, _) in zip(full, plans)]
+            crawled += [(fetcher, total_pages) for (fetcher, _, _), total_pages in zip(keyset, ranged_totals)]
+            for fetcher, total_pages in crawled:
+                fetcher.finish()
+                if fetcher.sync_state is not None and not fetcher.failed_pages:
+                    fetcher.sync_state.commit(full=fetcher.rewriting)
+                print(f"Processed {total_pages} pages of data for {fetcher.dataset_name}"
+                      f" ({fetcher.failed_pages} failed)")
+        for (fetcher, _, _), total in zip(changed, changed_totals):
+            if not fetcher.failed_pages:
+                fetcher.sync_state.commit()
+            print(f"Synced {total} changed records of {fetcher.dataset_name}")
+
+    def run(self, incremental=False, resume=False):
+        """
+        Run the crawl in a new event loop.
+        Args:
+            incremental (bool): Whether to only fetch the records changed since the last run.
+            resume (bool): Whether to resume the previous full crawls.
+        """
+        start = time.time()
+        asyncio.run(self.crawl(incremental=incremental, resume=resume))
+        print(f"Crawled {len(self.fetchers)} datasets in {time.time() - start:.2f} seconds")
+        self.metrics.write(self.metrics_folder)
+        print(self.metrics.report())
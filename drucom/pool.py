@@ -0,0 +1,116 @@
+"""
+Transform pools
+===============
+Run the CPU-bound part of a crawl (JSON decoding, transform and encoding of
+pages) in a pool of threads or processes, off the event loop.
+
+Fetch workers only read the raw response bodies (see `drucom.codec.RawBody`)
+and the event loop keeps servicing sockets while pages are transformed. Pages
+are submitted one per task: the raw body crosses to the pool as bytes with a
+small `PageJob` (the mapping and the encoder of the dataset, pickled with every
+task by process pools), and comes back as the bytes its sink writes (see
+`drucom.sinks`), so the decoded items and records never leave the worker.
+"""
+import os
+import time
+import asyncio
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from drucom.codec import loads
+from drucom.sync import sync_value
+from drucom.transform import MappingTransformer
+
+# What a pool worker needs to process the pages of a dataset. The encoder must
+# be picklable for process pools (a module function or a partial of one).
+PageJob = namedtuple("PageJob", "dataset_name mapping backend encode sync_field")
+
+# The result of a page: the encoded records, their number, the highest value of
+# the sync field in the raw items (or None), and the transform time in seconds.
+PageResult = namedtuple("PageResult", "data count seen seconds")
+
+# Transformers compiled by the current worker, by dataset and backend.
+_local = threading.local()
+
+
+def process_page(job, body):
+    """
+    Decode, transform and encode a page. Runs in a pool worker.
+    Args:
+        job (PageJob): The dataset of the page.
+        body (bytes): The raw response body.
+    Returns:
+        PageResult: The encoded records.
+    """
+    transformers = getattr(_local, "transformers", None)
+    if transformers is None:
+        transformers = _local.transformers = {}
+    transformer = transformers.get((job.dataset_name, job.backend))
+    if transformer is None:
+        transformer = MappingTransformer(job.mapping, job.backend)
+        transformers[(job.dataset_name, job.backend)] = transformer
+
+    items = loads(body).get('list', [])
+    seen = None
+    if job.sync_field is not None and items:
+        seen = max(sync_value(item, job.sync_field) for item in items)
+    start = time.perf_counter()
+    records = transformer.transform(items)
+    seconds = time.perf_counter() - start
+    return PageResult(job.encode(records), len(records), seen, seconds)
+
+
+class TransformPool:
+    """
+    A pool of threads or processes transforming pages.
+
+    Threads keep the event loop responsive, processes also scale the
+    transforms with the number of cores. Pipelines run one process worker per
+    pool worker (see `drucom.scheduler.PagePipeline`), so every worker is kept
+    busy and at most `workers` pages wait in the pool.
+    """
+
+    MODES = ("thread", "process")
+
+    def __init__(self, mode="process", workers=None):
+        """
+        Initialize the pool.
+        Args:
+            mode (str): `thread` or `process`.
+            workers (int): The number of workers. Defaults to the number of CPUs.
+        Raises:
+            ValueError: If the mode is unknown.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown transform pool: {mode}")
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        if mode == "thread":
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="drucom-transform")
+        else:
+            self.executor = ProcessPoolExecutor(self.workers)
+
+    async def process(self, job, body):
+        """
+        Process a page in the pool.
+        Args:
+            job (PageJob): The dataset of the page.
+            body (bytes): The raw response body.
+        Returns:
+            PageResult: The encoded records.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, process_page, job, body)
+
+    def close(self):
+        """
+        Stop the workers.
+        """
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
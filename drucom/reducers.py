@@ -0,0 +1,81 @@
+import os
+import json
+
+
+class CommentCounter:
+    """
+    A streaming reducer counting comments per author.
+
+    Each saved page of the `comment` dataset is folded into a running total,
+    first and last comment date per author, so the whole `comment.json` crawl
+    is reduced in a single pass without keeping the comments in memory.
+    Pages are folded at most once, which keeps the counts exact when pages
+    are retried or when a crawl is resumed.
+
+    The result is written as `{uid: {"total": n, "first": ts, "last": ts}}`,
+    the shape read by `notebook/comments.ipynb`.
+    """
+
+    def __init__(self, output_file):
+        """
+        Initialize the reducer.
+        Args:
+            output_file (str): The path of the JSON file to write the counts to.
+        """
+        self.output_file = output_file
+        self.counts = {}
+        self.pages = set()
+
+    def add_page(self, page, records):
+        """
+        Fold the records of a page into the counts.
+        Args:
+            page (int): The page number.
+            records (list): The transformed comments of the page.
+        """
+        if page in self.pages:
+            return
+        self.pages.add(page)
+        counts = self.counts
+        for record in records:
+            author = record["author"]
+            if author is None:
+                continue
+            # Authors are strings in JSON pages and integers in Parquet parts.
+            author = str(author)
+            created = int(record["created"])
+            entry = counts.get(author)
+            if entry is None:
+                counts[author] = [1, created, created]
+            else:
+                entry[0] += 1
+                if created < entry[1]:
+                    entry[1] = created
+                if created > entry[2]:
+                    entry[2] = created
+
+    def add_pages(self, pages):
+        """
+        Fold pages saved by a previous run, read back from the output sink.
+        Args:
+            pages (iterable): The page numbers and their records (see `drucom.sinks`),
+                already folded pages are skipped.
+        """
+        for page, records in pages:
+            self.add_page(page, records)
+
+    def write(self):
+        """
+        Write the counts to the output file.
+        Returns:
+            int: The number of authors.
+        """
+        counts = {
+            author: {"total": total, "first": first, "last": last}
+            for author, (total, first, last) in self.counts.items()
+        }
+        tmp_path = self.output_file + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(counts, f, separators=(',', ':'))
+        os.replace(tmp_path, self.output_file)
+        return len(counts)
@@ -0,0 +1,104 @@
+import time
+import asyncio
+
+from drucom.metrics import DEPTH_BUCKETS
+
+# Marks the end of a queue.
+_DONE = object()
+
+
+class PagePipeline:
+    """
+    A bounded two-stage worker pool for crawling paginated APIs.
+
+    The first stage runs a fixed number of fetch workers which pull work units
+    (e.g. page numbers) from a bounded queue. Fetched results go through a second
+    bounded queue to a fixed number of process workers (transform and write).
+
+    Units are pulled lazily from the iterable and both queues are bounded, so the
+    number of units alive at any time is at most
+    `fetch_workers + max_pending + process_workers`, whatever the crawl size.
+    When processing falls behind, fetch workers block on the full queue (backpressure).
+
+    With `metrics`, the depth of the pending queue is sampled for every processed
+    unit (`queue_depth`) and the time fetch workers spend blocked on the full
+    queue is recorded (`backpressure_seconds`): a full queue means the crawl is
+    bound by processing, an empty one that it is bound by the network.
+    """
+
+    def __init__(self, fetch, process, fetch_workers=100, process_workers=1, max_pending=None,
+                 metrics=None):
+        """
+        Initialize the pipeline.
+        Args:
+            fetch (callable): Coroutine function `fetch(unit)` returning a result.
+                A result of None is considered failed and is not processed.
+            process (callable): Coroutine function `process(unit, result)`.
+            fetch_workers (int): The number of concurrent fetch workers.
+            process_workers (int): The number of concurrent process workers.
+            max_pending (int): The maximum number of fetched results waiting to
+                be processed. Defaults to the number of fetch workers.
+            metrics (Metrics): The optional metrics registry.
+        """
+        self.fetch = fetch
+        self.process = process
+        self.fetch_workers = max(1, fetch_workers)
+        self.process_workers = max(1, process_workers)
+        self.max_pending = max_pending or self.fetch_workers
+        self.metrics = metrics
+
+    async def run(self, units):
+        """
+        Run the pipeline over all units.
+        Args:
+            units (iterable): The work units, consumed lazily.
+        Returns:
+            int: The number of units successfully processed.
+        """
+        todo = asyncio.Queue(maxsize=self.fetch_workers)
+        pending = asyncio.Queue(maxsize=self.max_pending)
+        processed = 0
+        metrics = self.metrics
+
+        async def produce():
+            for unit in units:
+                await todo.put(unit)
+            for _ in range(self.fetch_workers):
+                await todo.put(_DONE)
+
+        async def fetch_worker():
+            while (unit := await todo.get()) is not _DONE:
+                result = await self.fetch(unit)
+                if result is None:
+                    continue
+                if metrics is not None and pending.full():
+                    start = time.perf_counter()
+                    await pending.put((unit, result))
+                    metrics.observe("backpressure_seconds", time.perf_counter() - start)
+                else:
+                    await pending.put((unit, result))
+
+        async def process_worker():
+            nonlocal processed
+            while (item := await pending.get()) is not _DONE:
+                if metrics is not None:
+                    metrics.observe("queue_depth", pending.qsize(), DEPTH_BUCKETS, queue="pending")
+                await self.process(*item)
+                processed += 1
+
+        async def fetch_stage():
+            await asyncio.gather(*fetchers)
+            for _ in range(self.process_workers):
+                await pending.put(_DONE)
+
+        fetchers = [asyncio.create_task(produce())] + [
+            asyncio.create_task(fetch_worker()) for _ in range(self.fetch_workers)]
+        processors = [asyncio.create_task(process_worker())
+                      for _ in range(self.process_workers)]
+        try:
+            await asyncio.gather(fetch_stage(), *processors)
+        finally:
+            # Stop every worker if a stage failed.
+            for task in fetchers + processors:
+                task.cancel()
+        return processed
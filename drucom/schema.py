@@ -0,0 +1,295 @@
+"""
+Dataset schemas
+===============
+The Arrow schema of every dataset, matching the mappings of
+`DrupalDataFetcher.get_mapping`, and the normalization of transformed records.
+
+The API returns ids, timestamps and counts as strings, and multi-value fields
+either as lists of strings or as lists of references (`{"id": ..., "uri": ...}`).
+Records are normalized to the explicit types below, so every page and every
+run of a dataset produces the same columns with the same types.
+
+Low-cardinality strings (countries, languages, timezones...) are dictionary
+encoded: every distinct value is stored once per batch, and pandas loads them
+as categoricals. Derived columns are not mapped: they are computed from another
+column once the batch is built, on its distinct values only (see `derive`).
+"""
+import re
+import json
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Entity and term ids, and counts.
+INT = pa.int64()
+# Unix timestamps, in seconds.
+TIMESTAMP = pa.int64()
+TEXT = pa.string()
+IDS = pa.list_(pa.int64())
+TEXTS = pa.list_(pa.string())
+# Low-cardinality strings, dictionary encoded.
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+CATEGORIES = pa.list_(CATEGORY)
+# Unix timestamps converted to native timestamps.
+DATETIME = pa.timestamp("s")
+
+# The patterns keeping a part of a value, for derived columns.
+PARTS = {
+    # The text before the first "/", e.g. the region of a timezone.
+    "first": (r"/.*$", ""),
+    # The text after the last "/", e.g. the city of a timezone.
+    "last": (r"^.*/", ""),
+}
+
+
+def derived(name, source, part):
+    """
+    Declare a dictionary encoded column derived from a part of another one.
+    Args:
+        name (str): The name of the column.
+        source (str): The name of the column it is derived from.
+        part (str): The part kept, a key of `PARTS`.
+    Returns:
+        pyarrow.Field: The field, with its derivation in its metadata.
+    """
+    return pa.field(name, CATEGORY, metadata={"source": source, "part": part})
+
+
+def is_derived(field):
+    """
+    Check whether a field is derived from another column, rather than mapped.
+    """
+    return field.metadata is not None and b"source" in field.metadata
+
+SCHEMAS = {
+    "user": pa.schema([
+        ("id", INT),
+        ("title", TEXT),
+        ("fname", TEXT),
+        ("lname", TEXT),
+        ("created", DATETIME),
+        ("da_membership", TEXT),
+        ("slack", TEXT),
+        ("mentors", IDS),
+        ("countries", CATEGORY),
+        ("language", CATEGORY),
+        ("languages", CATEGORIES),
+        ("timezone", CATEGORY),
+        derived("region", "timezone", "first"),
+        derived("city", "timezone", "last"),
+        ("organizations", IDS),
+        ("industries", CATEGORIES),
+        ("contributions", TEXTS),
+        ("events", IDS),
+    ]),
+    "organization": pa.schema([
+        ("id", INT),
+        ("title", TEXT),
+        ("created", TIMESTAMP),
+        ("changed", TIMESTAMP),
+        ("author", INT),
+        ("url", TEXT),
+        ("budget", TEXT),
+        ("headquarters", TEXT),
+    ]),
+    "module": pa.schema([
+        ("id", INT),
+        ("title", TEXT),
+        ("created", TIMESTAMP),
+        ("changed", TIMESTAMP),
+        ("author", INT),
+        ("slug", TEXT),
+        ("stars", INT),
+        ("security_status", TEXT),
+        ("maintenance_status", INT),
+        ("development_status", INT),
+        ("categories", IDS),
+    ]),
+    "event": pa.schema([
+        ("id", INT),
+        ("title", TEXT),
+        ("from", TIMESTAMP),
+        ("to", TIMESTAMP),
+        ("duration", INT),
+        ("event_type", TEXT),
+        ("event_format", TEXT),
+        ("author", INT),
+        ("speakers", IDS),
+        ("sponsors", IDS),
+        ("volunteers", IDS),
+        ("organizers", IDS),
+        ("city", TEXT),
+        ("country", TEXT),
+    ]),
+    "module_terms": pa.schema([
+        ("id", INT),
+        ("name", TEXT),
+        ("vocabulary", INT),
+    ]),
+    "theme": pa.schema([
+        ("id", INT),
+        ("title", TEXT),
+        ("created", TIMESTAMP),
+        ("changed", TIMESTAMP),
+        ("author", INT),
+        ("slug", TEXT),
+        ("stars", INT),
+        ("maintenance_status", INT),
+        ("development_status", INT),
+    ]),
+    "comment": pa.schema([
+        ("id", INT),
+        ("author", INT),
+        ("node", INT),
+        ("created", TIMESTAMP),
+    ]),
+}
+
+
+def get_schema(name):
+    """
+    Get the Arrow schema of a dataset.
+    Args:
+        name (str): The name of the dataset.
+    Returns:
+        pyarrow.Schema: The schema.
+    Raises:
+        ValueError: If the dataset name is unknown.
+    """
+    schema = SCHEMAS.get(name)
+    if schema is None:
+        raise ValueError(f"Unknown dataset: {name}")
+    return schema
+
+
+def to_int(value):
+    """
+    Convert an API value to an integer, or None.
+    """
+    if value is None or value == "" or value == []:
+        return None
+    if isinstance(value, dict):
+        value = value.get("id")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return None
+
+
+def to_text(value):
+    """
+    Convert an API value to a string, or None.
+    Structured values are kept as JSON.
+    """
+    if value is None or value == []:
+        return None
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(',', ':'))
+    return str(value)
+
+
+def to_ids(value):
+    """
+    Convert an API value to a list of ids, from ids or references.
+    """
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        value = [value]
+    ids = (to_int(item) for item in value)
+    return [item for item in ids if item is not None]
+
+
+def to_texts(value):
+    """
+    Convert an API value to a list of strings.
+    """
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        value = [value]
+    texts = (to_text(item) for item in value)
+    return [item for item in texts if item is not None]
+
+
+CONVERTERS = {
+    INT: to_int, TEXT: to_text, IDS: to_ids, TEXTS: to_texts,
+    CATEGORY: to_text, CATEGORIES: to_texts, DATETIME: to_int,
+}
+
+
+def derive(column, part):
+    """
+    Derive a dictionary encoded column from a part of the values of another.
+    The part is computed on the distinct values of the column, not per record.
+    Args:
+        column (pyarrow.DictionaryArray): The source column.
+        part (str): The part kept, a key of `PARTS`.
+    Returns:
+        pyarrow.DictionaryArray: The derived column. Empty values are null.
+    """
+    pattern, replacement = PARTS[part]
+    values = pc.replace_substring_regex(column.dictionary, pattern, replacement)
+    values = pc.if_else(pc.equal(column.dictionary, ""), None, values)
+    # Several values may share a part, e.g. the region of two timezones.
+    encoded = pc.dictionary_encode(values)
+    indices = pc.take(encoded.indices, column.indices)
+    return pa.DictionaryArray.from_arrays(indices, encoded.dictionary)
+
+
+def derive_records(records, schema):
+    """
+    Add the derived fields of a schema to transformed records, for sinks which
+    write records rather than record batches. As in `derive`, each part is
+    computed once per distinct value of its source.
+    Args:
+        records (list): The transformed records.
+        schema (pyarrow.Schema): The schema of the dataset.
+    Returns:
+        list: Copies of the records with the derived fields, or the records
+        themselves when the schema has none.
+    """
+    fields = [(field.name, field.metadata[b"source"].decode(), PARTS[field.metadata[b"part"].decode()])
+              for field in schema if is_derived(field)]
+    if not fields:
+        return records
+    parts = {}
+    derived = []
+    for record in records:
+        record = dict(record)
+        for name, source, (pattern, replacement) in fields:
+            value = to_text(record.get(source))
+            if (name, value) not in parts:
+                parts[name, value] = re.sub(pattern, replacement, value) if value else None
+            record[name] = parts[name, value]
+        derived.append(record)
+    return derived
+
+
+def normalize(records, schema):
+    """
+    Normalize transformed records to a record batch of a schema.
+    Missing fields are null, values which cannot be converted are null.
+    Derived fields are computed from their source column, which must come first.
+    Args:
+        records (list): The transformed records.
+        schema (pyarrow.Schema): The schema of the dataset.
+    Returns:
+        pyarrow.RecordBatch: The records.
+    """
+    columns = {}
+    for field in schema:
+        name = field.name
+        if is_derived(field):
+            source = field.metadata[b"source"].decode()
+            columns[name] = derive(columns[source], field.metadata[b"part"].decode())
+            continue
+        convert = CONVERTERS[field.type]
+        columns[name] = pa.array([convert(record.get(name)) for record in records], field.type)
+    columns = list(columns.values())
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
@@ -0,0 +1,489 @@
+"""
+Output sinks
+============
+Where a full crawl writes its transformed pages.
+
+- `json`: one `page_N.json` file per page, the default.
+- `ndjson` / `ndjson.zst`: records appended to NDJSON part files, zstd
+  compressed with `ndjson.zst` (requires the `zstandard` package), with the
+  derived fields of the dataset schema (e.g. the `region` and `city` of users).
+- `parquet`: records normalized to the dataset schema (see `drucom.schema`)
+  and buffered into row groups of Parquet part files, ready for analysis.
+
+Records are encoded (`encode`) separately from the write, so the encoding can
+run in a transform pool (see `drucom.pool`) and only bytes reach the sink.
+
+Part files are written under a temporary name and renamed once complete. An
+index (`_index.json`) records the pages of every complete part, so a page is
+only considered saved once its part is complete, and resumed crawls fetch
+again the pages of a part lost in a crash, or of a complete part holding pages
+the manifest of the crawl did not record (see `PartSink.prune`). Files starting with `_` are ignored
+by pyarrow, so a part folder can be read as a dataset during a crawl.
+"""
+import os
+import glob
+from functools import partial
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from aiofiles import open as aio_open
+
+from drucom.codec import dumpb, loads
+from drucom.schema import SCHEMAS, derive_records, get_schema, normalize
+
+
+def encode_lines(records, schema=None):
+    """
+    Encode records to NDJSON, one record per line.
+    Args:
+        records (list): The transformed records.
+        schema (pyarrow.Schema): The schema of the dataset, whose derived
+            fields are added to the records (see `drucom.schema.derive_records`).
+    Returns:
+        bytes: The lines.
+    """
+    if not records:
+        return b""
+    if schema is not None:
+        records = derive_records(records, schema)
+    return b"\n".join([dumpb(record) for record in records]) + b"\n"
+
+
+def encode_batch(records, schema):
+    """
+    Normalize records to a schema and encode them to the Arrow IPC stream format.
+    Args:
+        records (list): The transformed records.
+        schema (pyarrow.Schema): The schema of the dataset.
+    Returns:
+        bytes: The record batch, read back without copy by `decode_batch`.
+    """
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(normalize(records, schema))
+    return sink.getvalue().to_pybytes()
+
+
+def decode_batch(data):
+    """
+    Decode a record batch encoded by `encode_batch`.
+    Args:
+        data (bytes): The Arrow IPC stream.
+    Returns:
+        pyarrow.RecordBatch: The records.
+    """
+    return pa.ipc.open_stream(data).read_next_batch()
+
+
+class JsonPageSink:
+    """
+    Write each page to its own `page_N.json` file.
+    """
+
+    def __init__(self, folder, serialize=dumpb):
+        """
+        Initialize the sink.
+        Args:
+            folder (str): The dataset output folder.
+            serialize (callable): Encodes a list of records to bytes.
+        """
+        self.folder = folder
+        self.serialize = serialize
+
+    # A picklable encoder, for transform pools.
+    encode = staticmethod(dumpb)
+
+    def path(self, page):
+        return os.path.join(self.folder, f"page_{page}.json")
+
+    def decode(self, data):
+        """
+        Decode the records encoded for a page.
+        """
+        return loads(data)
+
+    def reset(self):
+        """
+        Start a new crawl, removing every page file: numbered and keyset crawls
+        name their pages differently, so a page may not be overwritten.
+        """
+        for path in glob.glob(os.path.join(self.folder, "page_*.json")):
+            os.remove(path)
+
+    def prune(self, is_done):
+        """
+        Resume a crawl. Pages fetched again overwrite their file.
+        """
+
+    async def write(self, page, records):
+        """
+        Write the records of a page.
+        Args:
+            page (int): The page number.
+            records (list): The transformed records.
+        """
+        await self.write_encoded(page, self.serialize(records), len(records))
+
+    async def write_encoded(self, page, data, count):
+        """
+        Write the encoded records of a page.
+        Args:
+            page (int): The page number.
+            data (bytes): The records, as encoded by `encode`.
+            count (int): The number of records.
+        """
+        async with aio_open(self.path(page), 'wb') as f:
+            await f.write(data)
+
+    def exists(self, page):
+        """
+        Check whether a page is saved.
+        Args:
+            page (int): The page number.
+        Returns:
+            bool: True if the page is saved.
+        """
+        return os.path.exists(self.path(page))
+
+    def read(self, pages):
+        """
+        Read saved pages back.
+        Args:
+            pages (iterable): The page numbers.
+        Yields:
+            tuple: The page number and its records.
+        """
+        for page in pages:
+            with open(self.path(page), 'rb') as f:
+                yield page, self.decode(f.read())
+
+    def close(self):
+        """
+        Finish writing. Every page is already saved.
+        """
+
+
+class PartSink:
+    """
+    A base class for sinks appending pages to part files.
+
+    Pages are appended to the current part, which is rotated once it reaches
+    `rotate_size`: it is closed, renamed from `_part-N<ext>.tmp` to `part-N<ext>`
+    and its pages are added to the index. Subclasses implement `encode`,
+    `decode`, `_open`, `_append`, `_finish` and `_read_part`.
+    """
+
+    extension = ""
+    encode = None
+
+    def __init__(self, folder, rotate_size):
+        """
+        Initialize the sink, loading the index of the complete parts.
+        Parts missing from the index (e.g. left by a crash) are removed.
+        Args:
+            folder (str): The folder of the part files.
+            rotate_size (int): The size of a part before it is rotated.
+        """
+        self.folder = folder
+        self.rotate_size = rotate_size
+        self.index_path = os.path.join(folder, "_index.json")
+        os.makedirs(folder, exist_ok=True)
+        self.parts = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                self.parts = loads(f.read())
+        self.pages = {page: part for part, entries in self.parts.items() for page, _ in entries}
+        for path in glob.glob(os.path.join(folder, "*part-*")):
+            if os.path.basename(path) not in self.parts:
+                os.remove(path)
+        self._current = None
+        self._entries = []
+        self._size = 0
+
+    def reset(self):
+        """
+        Start a new crawl, removing every part.
+        """
+        self._discard()
+        for part in self.parts:
+            os.remove(os.path.join(self.folder, part))
+        self.parts = {}
+        self.pages = {}
+        self._write_index()
+
+    def prune(self, is_done):
+        """
+        Resume a crawl, removing the complete parts holding pages which are not
+        done in its manifest, e.g. when a crash came after a part was rotated but
+        before the manifest was saved. Their pages are fetched again, instead of
+        being appended to a new part next to their records.
+        Args:
+            is_done (callable): Checks whether a page is done in the manifest.
+        """
+        stale = [part for part, entries in self.parts.items()
+                 if not all(is_done(page) for page, _ in entries)]
+        for part in stale:
+            os.remove(os.path.join(self.folder, part))
+            for page, _ in self.parts.pop(part):
+                if self.pages.get(page) == part:
+                    del self.pages[page]
+        if stale:
+            self._write_index()
+
+    async def write(self, page, records):
+        """
+        Append the records of a page to the current part.
+        Args:
+            page (int): The page number.
+            records (list): The transformed records.
+        """
+        await self.write_encoded(page, self.encode(records), len(records))
+
+    async def write_encoded(self, page, data, count):
+        """
+        Append the encoded records of a page to the current part.
+        Args:
+            page (int): The page number.
+            data (bytes): The records, as encoded by `encode`.
+            count (int): The number of records.
+        """
+        if self._current is None:
+            number = max((int(part[5:10]) for part in self.parts), default=-1) + 1
+            self._current = f"part-{number:05d}{self.extension}"
+            self._open(self._tmp_path())
+        self._size += self._append(data)
+        self._entries.append([page, count])
+        if self._size >= self.rotate_size:
+            self.rotate()
+
+    def rotate(self):
+        """
+        Complete the current part and record its pages in the index.
+        """
+        if self._current is None:
+            return
+        self._finish()
+        os.replace(self._tmp_path(), os.path.join(self.folder, self._current))
+        self.parts[self._current] = self._entries
+        for page, _ in self._entries:
+            self.pages[page] = self._current
+        self._write_index()
+        self._current, self._entries, self._size = None, [], 0
+
+    def close(self):
+        """
+        Complete the current part.
+        """
+        self.rotate()
+
+    def exists(self, page):
+        """
+        Check whether a page is saved in a complete part.
+        Args:
+            page (int): The page number.
+        Returns:
+            bool: True if the page is saved.
+        """
+        return page in self.pages
+
+    def read(self, pages):
+        """
+        Read saved pages back, part by part.
+        Args:
+            pages (iterable): The page numbers.
+        Yields:
+            tuple: The page number and its records.
+        """
+        wanted = set(pages)
+        for part, entries in self.parts.items():
+            if not any(page in wanted and self.pages[page] == part for page, _ in entries):
+                continue
+            records = self._read_part(os.path.join(self.folder, part))
+            offset = 0
+            for page, count in entries:
+                if page in wanted and self.pages[page] == part:
+                    yield page, records[offset:offset + count]
+                offset += count
+
+    def paths(self):
+        """
+        List the complete part files.
+        Returns:
+            list: The paths, oldest first.
+        """
+        return [os.path.join(self.folder, part) for part in sorted(self.parts)]
+
+    def _discard(self):
+        if self._current is not None:
+            self._finish()
+            os.remove(self._tmp_path())
+            self._current, self._entries, self._size = None, [], 0
+
+    def _tmp_path(self):
+        return os.path.join(self.folder, f"_{self._current}.tmp")
+
+    def _write_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(dumpb(self.parts))
+        os.replace(tmp_path, self.index_path)
+
+    def _open(self, path):
+        raise NotImplementedError
+
+    def decode(self, data):
+        raise NotImplementedError
+
+    def _append(self, data):
+        raise NotImplementedError
+
+    def _finish(self):
+        raise NotImplementedError
+
+    def _read_part(self, path):
+        raise NotImplementedError
+
+
+class NdjsonSink(PartSink):
+    """
+    Append records to NDJSON part files, one record per line.
+    Each page is encoded and written at once, through a large buffer.
+    """
+
+    encode = staticmethod(encode_lines)
+
+    def __init__(self, folder, compress=False, level=3, rotate_size=256 * 2 ** 20, schema=None):
+        """
+        Initialize the sink.
+        Args:
+            folder (str): The folder of the part files.
+            compress (bool): Whether to compress the parts with zstd.
+            level (int): The zstd compression level.
+            rotate_size (int): The uncompressed size of a part, in bytes.
+            schema (pyarrow.Schema): The schema of the dataset, to add its
+                derived fields to the records.
+        Raises:
+            ImportError: If compression is requested without the `zstandard` package.
+        """
+        if schema is not None:
+            self.encode = partial(encode_lines, schema=schema)
+        self.compress = compress
+        self.level = level
+        if compress:
+            import zstandard  # noqa: F401
+            self.extension = ".ndjson.zst"
+        else:
+            self.extension = ".ndjson"
+        super().__init__(folder, rotate_size)
+
+    def _open(self, path):
+        self._file = open(path, 'wb', buffering=2 ** 20)
+        if self.compress:
+            import zstandard
+            self._file = zstandard.ZstdCompressor(level=self.level).stream_writer(self._file)
+
+    def decode(self, data):
+        """
+        Decode the records encoded for a page.
+        """
+        return [loads(line) for line in data.splitlines() if line]
+
+    def _append(self, data):
+        self._file.write(data)
+        return len(data)
+
+    def _finish(self):
+        self._file.close()
+
+    def _read_part(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if self.compress:
+            import zstandard
+            data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        return self.decode(data)
+
+
+class ParquetSink(PartSink):
+    """
+    Write records to Parquet part files, in row groups.
+    Records are normalized to the schema of the dataset and buffered until a
+    row group is full, so parts can be read as one dataset with pyarrow or pandas.
+    """
+
+    extension = ".parquet"
+
+    def __init__(self, folder, dataset_name, row_group_size=50_000, rotate_size=1_000_000):
+        """
+        Initialize the sink.
+        Args:
+            folder (str): The folder of the part files.
+            dataset_name (str): The name of the dataset.
+            row_group_size (int): The number of rows per row group.
+            rotate_size (int): The number of rows of a part.
+        Raises:
+            ValueError: If the dataset name is unknown.
+        """
+        self.schema = get_schema(dataset_name)
+        self.encode = partial(encode_batch, schema=self.schema)
+        self.row_group_size = row_group_size
+        super().__init__(folder, rotate_size)
+
+    def _open(self, path):
+        self._writer = pq.ParquetWriter(path, self.schema)
+        self._batches = []
+        self._buffered = 0
+
+    def decode(self, data):
+        """
+        Decode the records encoded for a page.
+        """
+        return decode_batch(data).to_pylist()
+
+    def _append(self, data):
+        batch = decode_batch(data)
+        self._batches.append(batch)
+        self._buffered += batch.num_rows
+        if self._buffered >= self.row_group_size:
+            self._write_row_group()
+        return batch.num_rows
+
+    def _write_row_group(self):
+        if self._buffered:
+            table = pa.Table.from_batches(self._batches, self.schema)
+            self._writer.write_table(table, row_group_size=table.num_rows)
+        self._batches, self._buffered = [], 0
+
+    def _finish(self):
+        self._write_row_group()
+        self._writer.close()
+
+    def _read_part(self, path):
+        return pq.read_table(path).to_pylist()
+
+
+SINKS = ("json", "ndjson", "ndjson.zst", "parquet")
+
+
+def make_sink(kind, output_folder, dataset_name, serialize=dumpb):
+    """
+    Make the sink of a crawl.
+    Args:
+        kind (str): The sink: `json`, `ndjson`, `ndjson.zst` or `parquet`.
+        output_folder (str): The dataset output folder. Part files are written
+            to a subfolder named after the sink (e.g. `parquet/part-00000.parquet`).
+        dataset_name (str): The name of the dataset.
+        serialize (callable): Encodes the records of a page, for the `json` sink.
+    Returns:
+        The sink.
+    Raises:
+        ValueError: If the sink is unknown.
+    """
+    if kind == "json":
+        return JsonPageSink(output_folder, serialize)
+    if kind in ("ndjson", "ndjson.zst"):
+        return NdjsonSink(os.path.join(output_folder, "ndjson"), compress=kind == "ndjson.zst",
+                          schema=SCHEMAS.get(dataset_name))
+    if kind == "parquet":
+        return ParquetSink(os.path.join(output_folder, "parquet"), dataset_name)
+    raise ValueError(f"Unknown sink: {kind}. Use one of {', '.join(SINKS)}")
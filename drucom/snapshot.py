@@ -0,0 +1,312 @@
+"""
+Snapshots
+=========
+A compact index of the content of the records of a dataset, so that a full
+crawl only writes what changed since the previous one (see `DrupalDataFetcher`).
+
+The index holds one row per id: the id and a 64-bit hash of the record as
+written to its page file, sorted by id and saved as `hashes.npz` next to the
+pages. A crawl compared to the index (see `SnapshotDiff`) keeps the records
+which are new or whose hash changed, and deletes the ids of the index it did
+not see. Both go to a delta file, with a tombstone for every deleted id (see
+`drucom.sync.tombstone`), so that the page files of the last full crawl and
+the deltas after them always hold the current dataset.
+
+Every snapshot is recorded in `snapshots.json`: its kind (`full`, `diff` or
+`incremental`), its delta file and the number of records added, changed,
+deleted and unchanged. Consumers apply the deltas of the snapshots after the
+last one they read, and start over after a `full` snapshot, whose pages
+replace every delta.
+
+Example:
+    snapshots = Snapshots("data/json/user")
+    snapshots.entries[-1]  # {"snapshot": 3, "kind": "diff", "delta": "delta_2.json", "added": 12, ...}
+"""
+import os
+import json
+import time
+from hashlib import blake2b
+
+import numpy as np
+
+from drucom.codec import dumpb
+from drucom.sync import tombstone
+
+
+def hash_records(records):
+    """
+    Hash records as they are written to page files.
+    Args:
+        records (list): The transformed records.
+    Returns:
+        tuple: The ids (-1 for invalid ids) and the hashes of the records.
+    """
+    ids = np.empty(len(records), np.int64)
+    digests = bytearray()
+    for index, record in enumerate(records):
+        try:
+            ids[index] = int(record.get("id"))
+        except (TypeError, ValueError):
+            ids[index] = -1
+        digests += blake2b(dumpb(record), digest_size=8).digest()
+    return ids, np.frombuffer(bytes(digests), np.uint64)
+
+
+class HashIndex:
+    """
+    The sorted ids of a dataset and the hashes of their records.
+    """
+
+    def __init__(self, ids=None, hashes=None):
+        """
+        Initialize the index.
+        Args:
+            ids (numpy.ndarray): The ids, sorted and unique.
+            hashes (numpy.ndarray): The hashes of their records.
+        """
+        self.ids = np.empty(0, np.int64) if ids is None else ids
+        self.hashes = np.empty(0, np.uint64) if hashes is None else hashes
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_pages(cls, pages):
+        """
+        Build the index of pages read back from a sink (see `drucom.sinks`).
+        Args:
+            pages (iterable): The page numbers and their records, in page
+                order: the record of the last page wins when an id appears
+                several times.
+        Returns:
+            HashIndex: The index.
+        """
+        ids, hashes = [np.empty(0, np.int64)], [np.empty(0, np.uint64)]
+        for _, records in pages:
+            page_ids, page_hashes = hash_records(records)
+            ids.append(page_ids)
+            hashes.append(page_hashes)
+        return cls().update(np.concatenate(ids), np.concatenate(hashes))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an index saved by `save`.
+        """
+        with np.load(path) as arrays:
+            return cls(arrays["ids"], arrays["hashes"])
+
+    def save(self, path):
+        """
+        Save the index, replacing the file atomically.
+        """
+        tmp_path = path[:-len(".npz")] + ".tmp.npz"
+        np.savez(tmp_path, ids=self.ids, hashes=self.hashes)
+        os.replace(tmp_path, path)
+
+    def lookup(self, ids):
+        """
+        Find the hashes of ids.
+        Args:
+            ids (numpy.ndarray): The ids.
+        Returns:
+            tuple: A mask of the ids found, and their hashes (0 when missing).
+        """
+        rows = np.searchsorted(self.ids, ids)
+        found = rows < len(self.ids)
+        found[found] = self.ids[rows[found]] == ids[found]
+        hashes = np.zeros(len(ids), np.uint64)
+        hashes[found] = self.hashes[rows[found]]
+        return found, hashes
+
+    def update(self, ids, hashes):
+        """
+        Set the hashes of ids, adding the ids missing from the index.
+        Args:
+            ids (numpy.ndarray): The ids, -1 for invalid ones. The last hash of
+                an id wins when it appears several times.
+            hashes (numpy.ndarray): Their hashes.
+        Returns:
+            HashIndex: The index.
+        """
+        unique, last = np.unique(ids[::-1], return_index=True)
+        hashes = hashes[::-1][last]
+        valid = unique >= 0
+        unique, hashes = unique[valid], hashes[valid]
+        kept = ~np.isin(self.ids, unique)
+        ids = np.concatenate([self.ids[kept], unique])
+        order = np.argsort(ids, kind="stable")
+        self.ids = ids[order]
+        self.hashes = np.concatenate([self.hashes[kept], hashes])[order]
+        return self
+
+    def remove(self, ids):
+        """
+        Remove ids from the index.
+        """
+        kept = ~np.isin(self.ids, ids)
+        self.ids, self.hashes = self.ids[kept], self.hashes[kept]
+        return self
+
+
+class SnapshotDiff:
+    """
+    Compare the records of a crawl to the index of the previous snapshot.
+
+    Only the records new or changed are kept in memory, with the ids and
+    hashes of every record seen: 16 bytes per record.
+    """
+
+    def __init__(self, index):
+        """
+        Initialize the comparison.
+        Args:
+            index (HashIndex): The index of the previous snapshot.
+        """
+        self.index = index
+        self.records = {}
+        self.ids = []
+        self.hashes = []
+
+    def add(self, records):
+        """
+        Compare records to the previous snapshot.
+        Args:
+            records (list): The transformed records of a page.
+        Returns:
+            int: The number of records new or changed.
+        """
+        ids, hashes = hash_records(records)
+        found, known = self.index.lookup(ids)
+        modified = np.flatnonzero((ids >= 0) & (~found | (known != hashes)))
+        for index in modified.tolist():
+            self.records[records[index]["id"]] = records[index]
+        self.ids.append(ids)
+        self.hashes.append(hashes)
+        return len(modified)
+
+    def seen(self):
+        """
+        Get the ids and hashes of the records compared so far.
+        """
+        return (np.concatenate([np.empty(0, np.int64)] + self.ids),
+                np.concatenate([np.empty(0, np.uint64)] + self.hashes))
+
+    def deleted(self):
+        """
+        Find the ids of the previous snapshot which were not seen.
+        Only meaningful once every page of a full crawl was compared.
+        Returns:
+            numpy.ndarray: The ids deleted, sorted.
+        """
+        return np.setdiff1d(self.index.ids, self.seen()[0])
+
+    def delta(self, deleted=None):
+        """
+        Get the records of the delta file of the snapshot.
+        Args:
+            deleted (numpy.ndarray): The ids deleted, if known.
+        Returns:
+            list: The records new or changed, then a tombstone for every id deleted.
+        """
+        tombstones = [tombstone(str(record_id)) for record_id in ([] if deleted is None else deleted.tolist())]
+        return list(self.records.values()) + tombstones
+
+    def summary(self, deleted=None):
+        """
+        Count the records added, changed and unchanged, and the ids deleted.
+        """
+        ids, _ = self.seen()
+        changed = np.array([int(record_id) for record_id in self.records], np.int64)
+        found, _ = self.index.lookup(changed)
+        return {
+            "added": int((~found).sum()),
+            "changed": int(found.sum()),
+            "deleted": 0 if deleted is None else len(deleted),
+            "unchanged": len(np.unique(ids[ids >= 0])) - len(changed),
+        }
+
+
+class Snapshots:
+    """
+    The content hash index of a dataset folder and the log of its snapshots.
+    """
+
+    def __init__(self, folder):
+        """
+        Load the index and the log of a dataset folder, if they were saved.
+        Args:
+            folder (str): The dataset output folder.
+        """
+        self.folder = folder
+        self.index_path = os.path.join(folder, "hashes.npz")
+        self.path = os.path.join(folder, "snapshots.json")
+        self.entries = []
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        self.index = HashIndex.load(self.index_path) if os.path.exists(self.index_path) else None
+
+    def diff(self):
+        """
+        Start comparing a crawl to the last snapshot.
+        Returns:
+            SnapshotDiff: The comparison.
+        Raises:
+            ValueError: If there is no snapshot yet.
+        """
+        if self.index is None:
+            raise ValueError(f"No snapshot to compare to in {self.folder}")
+        return SnapshotDiff(self.index)
+
+    def discard(self):
+        """
+        Forget the index, while a full crawl rewrites the page files.
+        """
+        self.index = None
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+
+    def rebuild(self, pages):
+        """
+        Index the page files of a full crawl and start a new log.
+        Args:
+            pages (iterable): The page numbers and their records, in page order.
+        """
+        self.index = HashIndex.from_pages(pages)
+        self.index.save(self.index_path)
+        self.record("full", keep=False)
+
+    def commit(self, diff, kind, delta_file=None, deleted=None):
+        """
+        Save the index updated with a comparison, and log the snapshot.
+        Args:
+            diff (SnapshotDiff): The comparison.
+            kind (str): `diff` for full crawls, `incremental` for incremental ones.
+            delta_file (str): The delta file written, if there were changes.
+            deleted (numpy.ndarray): The ids deleted, if every record was compared.
+        """
+        self.index = HashIndex(diff.index.ids, diff.index.hashes).update(*diff.seen())
+        if deleted is not None:
+            self.index.remove(deleted)
+        self.index.save(self.index_path)
+        self.record(kind, delta=delta_file and os.path.basename(delta_file),
+                    complete=deleted is not None, **diff.summary(deleted))
+
+    def record(self, kind, keep=True, **entry):
+        """
+        Append a snapshot to the log, saved atomically.
+        Args:
+            kind (str): The kind of snapshot.
+            keep (bool): Whether to keep the previous snapshots in the log.
+            **entry: The details of the snapshot.
+        """
+        number = self.entries[-1]["snapshot"] + 1 if self.entries else 1
+        entries = self.entries if keep else []
+        entries.append({"snapshot": number, "kind": kind, "time": time.time(),
+                        "records": len(self.index), **entry})
+        self.entries = entries
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
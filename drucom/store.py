@@ -0,0 +1,323 @@
+"""
+Dataset store
+=============
+The merged datasets (see `DrupalDataMerger`), or the Parquet parts of a full
+crawl (see `drucom.sinks.ParquetSink`), written as a store partitioned by
+year, and queried with column projection and row filters pushed down to the
+files:
+
+    data/store/user/year=2005/part-0.parquet
+    data/store/user/year=2006/part-0.parquet
+    ...
+
+Datasets are partitioned by the year of their time field (see `PARTITIONS`),
+so a filter on that field only opens the files of the years it covers.
+Within a year, rows are sorted by the field most analyses filter on (see
+`SORT_KEYS`), so that the min/max statistics of the row groups skip the
+others: e.g. the users of one region are in a few row groups of each year.
+
+Parquet statistics are not used for dictionary columns when filtering, so
+categorical columns are stored as plain strings (still dictionary encoded by
+Parquet on disk) and dictionary encoded again by `DatasetStore.query`.
+
+Example:
+    store = DatasetStore()
+    # Users registered since 2020 in Europe: only the files since 2020 are
+    # opened, and only their row groups with European users are read.
+    store.query("user", columns=["id", "title", "city"], since=2020, where={"region": "Europe"})
+"""
+import os
+import shutil
+import datetime
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Dataset -> the time field partitioning it by year. Other datasets are not partitioned.
+PARTITIONS = {
+    "user": "created",
+    "organization": "created",
+    "module": "created",
+    "theme": "created",
+    "event": "from",
+    "comment": "created",
+}
+
+# Dataset -> the columns sorting the rows of every partition. Defaults to the time field.
+SORT_KEYS = {
+    "user": ["region", "created"],
+    "event": ["country", "from"],
+    "comment": ["author", "created"],
+}
+
+PARTITIONING = ds.partitioning(pa.schema([("year", pa.int32())]), flavor="hive")
+
+# The schema metadata listing the columns to dictionary encode when read.
+CATEGORIES_KEY = b"drucom.categories"
+
+
+def storage_type(data_type):
+    """
+    Get the type a column is stored with: dictionaries are stored as their values.
+    """
+    if pa.types.is_dictionary(data_type):
+        return data_type.value_type
+    if pa.types.is_list(data_type) and pa.types.is_dictionary(data_type.value_type):
+        return pa.list_(data_type.value_type.value_type)
+    return data_type
+
+
+def to_datetime(value):
+    """
+    Convert a bound of a time filter to a datetime.
+    Args:
+        value (int|str|datetime.date): A year, an ISO date or a date.
+    Returns:
+        datetime.datetime: The datetime, in UTC.
+    """
+    if isinstance(value, int):
+        return datetime.datetime(value, 1, 1)
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime(value.year, value.month, value.day)
+
+
+def time_scalar(value, data_type):
+    """
+    Convert a datetime to a scalar comparable with a time field.
+    Args:
+        value (datetime.datetime): The datetime, in UTC.
+        data_type (pyarrow.DataType): The type of the field: a timestamp, or
+            an integer for Unix timestamps in seconds.
+    Returns:
+        pyarrow.Scalar: The scalar.
+    """
+    if pa.types.is_timestamp(data_type):
+        return pa.scalar(value, data_type)
+    return pa.scalar(int(value.replace(tzinfo=datetime.timezone.utc).timestamp()), data_type)
+
+
+def years_of(column):
+    """
+    Get the years of a time column.
+    Args:
+        column (pyarrow.ChunkedArray): Timestamps, or Unix timestamps in seconds.
+    Returns:
+        pyarrow.ChunkedArray: The years, null for missing times.
+    """
+    if not pa.types.is_timestamp(column.type):
+        column = column.cast(pa.int64()).cast(pa.timestamp("s"))
+    return pc.year(column).cast(pa.int32())
+
+
+def time_filter(field, data_type, since=None, until=None, partitioned=False):
+    """
+    Build the filter of a time range.
+    Args:
+        field (str): The time field.
+        data_type (pyarrow.DataType): The type of the field.
+        since: The start of the range, included (see `to_datetime`).
+        until: The end of the range, excluded.
+        partitioned (bool): Whether to filter the year partitions too, so
+            that the files of other years are not opened.
+    Returns:
+        pyarrow.compute.Expression: The filter, or None without bounds.
+    """
+    expression = None
+    for bound, compare, year_compare in ((since, pc.greater_equal, pc.greater_equal),
+                                         (until, pc.less, pc.less_equal)):
+        if bound is None:
+            continue
+        bound = to_datetime(bound)
+        condition = compare(pc.field(field), time_scalar(bound, data_type))
+        if partitioned:
+            condition &= year_compare(pc.field("year"), pa.scalar(bound.year, pa.int32()))
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def build_store(dataset_name, source=None, store=None, row_group_size=50_000):
+    """
+    Write a dataset to the store, partitioned by year and sorted within each year.
+    The partitions are read one at a time from the source, with the year
+    filter pushed down, and the dataset folder is replaced once written.
+    Args:
+        dataset_name (str): The name of the dataset.
+        source (str): A Parquet file or folder of parts. Defaults to the merged
+            file `../data/<dataset>.parquet`.
+        store (str): The store folder. Defaults to `../data/store`.
+        row_group_size (int): The number of rows per row group.
+    Returns:
+        dict: The number of rows written, by year (None for the rows without time).
+    Raises:
+        FileNotFoundError: If the source does not exist.
+    """
+    data_dir = os.path.join(os.path.dirname(__file__), "../data")
+    source = source or os.path.join(data_dir, f"{dataset_name}.parquet")
+    store = store or os.path.join(data_dir, "store")
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"No Parquet data for {dataset_name}: {source}")
+    dataset = ds.dataset(source, format="parquet")
+    field = PARTITIONS.get(dataset_name)
+    categories = [f.name for f in dataset.schema if storage_type(f.type) != f.type]
+    schema = pa.schema([f.with_type(storage_type(f.type)) for f in dataset.schema],
+                       metadata={CATEGORIES_KEY: ",".join(categories)})
+    sort_keys = [key for key in SORT_KEYS.get(dataset_name, [field]) if key in schema.names]
+
+    tmp_folder = os.path.join(store, f".{dataset_name}.tmp")
+    shutil.rmtree(tmp_folder, ignore_errors=True)
+    if field is None:
+        partitions = {None: None}
+    else:
+        years = pc.unique(years_of(dataset.to_table(columns=[field]).column(field))).to_pylist()
+        partitions = {year: time_filter(field, dataset.schema.field(field).type, year, year + 1)
+                      if year is not None else pc.is_null(pc.field(field))
+                      for year in sorted(years, key=lambda year: (year is None, year))}
+
+    rows = {}
+    for year, expression in partitions.items():
+        table = dataset.to_table(filter=expression).cast(schema)
+        if sort_keys:
+            table = table.take(pc.sort_indices(table.select(sort_keys), [(key, "ascending") for key in sort_keys]))
+        if field is None:
+            folder = tmp_folder
+        else:
+            folder = os.path.join(tmp_folder, f"year={'__HIVE_DEFAULT_PARTITION__' if year is None else year}")
+        os.makedirs(folder, exist_ok=True)
+        pq.write_table(table, os.path.join(folder, "part-0.parquet"), row_group_size=row_group_size)
+        rows[year] = table.num_rows
+
+    output = os.path.join(store, dataset_name)
+    old_folder = os.path.join(store, f".{dataset_name}.old")
+    if os.path.exists(output):
+        os.replace(output, old_folder)
+    os.replace(tmp_folder, output)
+    shutil.rmtree(old_folder, ignore_errors=True)
+    return rows
+
+
+class DatasetStore:
+    """
+    Query the datasets of the store written by `build_store`.
+    """
+
+    def __init__(self, folder=None):
+        """
+        Open the store.
+        Args:
+            folder (str): The store folder. Defaults to `../data/store`.
+        """
+        self.folder = folder or os.path.join(os.path.dirname(__file__), "../data/store")
+
+    def dataset(self, dataset_name):
+        """
+        Open a dataset of the store.
+        Args:
+            dataset_name (str): The name of the dataset.
+        Returns:
+            pyarrow.dataset.Dataset: The dataset, with its `year` partition column.
+        Raises:
+            FileNotFoundError: If the dataset is not in the store.
+        """
+        path = os.path.join(self.folder, dataset_name)
+        if not os.path.isdir(path):
+            raise FileNotFoundError(f"{dataset_name} is not in the store, run `drucom store {dataset_name}` first")
+        partitioning = PARTITIONING if dataset_name in PARTITIONS else None
+        return ds.dataset(path, format="parquet", partitioning=partitioning)
+
+    def filter(self, dataset, dataset_name, where=None, since=None, until=None):
+        """
+        Build the row filter of a query.
+        Args:
+            dataset (pyarrow.dataset.Dataset): The dataset.
+            dataset_name (str): The name of the dataset.
+            where (dict|pyarrow.compute.Expression): The values of columns, a
+                list of values matching any of them, or an expression.
+            since: The start of the time range of the dataset (see `PARTITIONS`),
+                included: a year, an ISO date or a date.
+            until: The end of the time range, excluded.
+        Returns:
+            pyarrow.compute.Expression: The filter, or None.
+        Raises:
+            ValueError: If the dataset has no time field and a time range is given.
+        """
+        expression = where
+        if isinstance(where, dict):
+            expression = None
+            for name, value in where.items():
+                if isinstance(value, (list, tuple, set)):
+                    condition = pc.field(name).isin(list(value))
+                elif value is None:
+                    condition = pc.field(name).is_null()
+                else:
+                    condition = pc.field(name) == value
+                expression = condition if expression is None else expression & condition
+        if since is not None or until is not None:
+            field = PARTITIONS.get(dataset_name)
+            if field is None:
+                raise ValueError(f"Dataset {dataset_name} has no time field to filter on")
+            condition = time_filter(field, dataset.schema.field(field).type, since, until, partitioned=True)
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def query(self, dataset_name, columns=None, where=None, since=None, until=None):
+        """
+        Read the rows of a dataset matching a filter, with only some columns.
+        Only the files of the years of the time range are opened, and only the
+        row groups whose statistics may match the filter are read.
+        Args:
+            dataset_name (str): The name of the dataset.
+            columns (list): The columns to read. Defaults to all the columns.
+            where (dict|pyarrow.compute.Expression): The filter, see `filter`.
+            since: The start of the time range, see `filter`.
+            until: The end of the time range, see `filter`.
+        Returns:
+            pyarrow.Table: The rows, with categorical columns dictionary encoded.
+        """
+        dataset = self.dataset(dataset_name)
+        table = dataset.to_table(columns=columns,
+                                 filter=self.filter(dataset, dataset_name, where, since, until))
+        metadata = dataset.schema.metadata or {}
+        categories = [name for name in metadata.get(CATEGORIES_KEY, b"").decode().split(",") if name]
+        for name in categories:
+            if name in table.column_names:
+                column = table.column(name)
+                if pa.types.is_list(column.type):
+                    data_type = pa.list_(pa.dictionary(pa.int32(), column.type.value_type))
+                else:
+                    data_type = pa.dictionary(pa.int32(), column.type)
+                table = table.set_column(table.column_names.index(name), name, column.cast(data_type))
+        return table
+
+    def to_pandas(self, dataset_name, columns=None, where=None, since=None, until=None):
+        """
+        Read the rows of a dataset matching a filter as a dataframe, see `query`.
+        """
+        return self.query(dataset_name, columns, where, since, until).to_pandas()
+
+    def explain(self, dataset_name, where=None, since=None, until=None):
+        """
+        Count the files and row groups a query reads.
+        Args:
+            dataset_name (str): The name of the dataset.
+            where (dict|pyarrow.compute.Expression): The filter, see `filter`.
+            since: The start of the time range, see `filter`.
+            until: The end of the time range, see `filter`.
+        Returns:
+            dict: The number of files and row groups read, and in the dataset.
+        """
+        dataset = self.dataset(dataset_name)
+        expression = self.filter(dataset, dataset_name, where, since, until)
+        fragments = list(dataset.get_fragments())
+        selected = list(dataset.get_fragments(filter=expression)) if expression is not None else fragments
+        return {
+            "files": len(selected),
+            "row_groups": sum(len(fragment.split_by_row_group(expression, schema=dataset.schema)) if expression is not None
+                              else fragment.num_row_groups for fragment in selected),
+            "total_files": len(fragments),
+            "total_row_groups": sum(fragment.num_row_groups for fragment in fragments),
+        }
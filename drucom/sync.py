@@ -0,0 +1,216 @@
+import os
+import re
+import json
+import glob
+
+# The key marking the records of delta files whose id was deleted (see `tombstone`).
+DELETED = "_deleted"
+
+
+class SyncState:
+    """
+    A class to keep track of the high-water mark of a dataset between runs.
+
+    The mark is the highest value of the sync field (`changed` for nodes,
+    `created` for users) seen in the raw items of the last successful crawl.
+    Incremental runs only keep items at or above the mark, and write them to
+    `delta_N.json` files next to the `page_N.json` files of the full crawl.
+    Use `iter_records` to read a dataset folder with deltas merged by id.
+    Full crawls compared to a snapshot (see `drucom.snapshot`) write their
+    changes to delta files too, numbered after the deltas of incremental runs.
+    """
+
+    # Dataset name -> raw property used as the high-water mark.
+    # Drupal 7 users have no `changed` property, so only new accounts are synced.
+    FIELDS = {
+        "user": "created",
+        "organization": "changed",
+        "module": "changed",
+        "event": "changed",
+        "theme": "changed",
+    }
+
+    def __init__(self, folder, dataset_name):
+        """
+        Initialize the state from the `sync.json` file of a dataset folder.
+        Args:
+            folder (str): The dataset output folder.
+            dataset_name (str): The name of the dataset.
+        Raises:
+            ValueError: If the dataset cannot be synced incrementally.
+        """
+        self.field = self.FIELDS.get(dataset_name)
+        if self.field is None:
+            raise ValueError(f"Dataset {dataset_name} cannot be synced incrementally")
+        self.folder = folder
+        self.path = os.path.join(folder, "sync.json")
+        self.mark = None
+        self.deltas = 0
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                state = json.load(f)
+            self.mark = state.get("mark")
+            self.deltas = state.get("deltas", 0)
+        self.seen = self.mark
+
+    def is_new(self, item):
+        """
+        Check whether a raw item is at or above the high-water mark.
+        Items exactly at the mark are kept since they may have changed again
+        within the same second, duplicates are merged by id anyway.
+        Args:
+            item (dict): A raw item from the API.
+        Returns:
+            bool: True if the item must be synced.
+        """
+        return self.mark is None or self.value(item) >= self.mark
+
+    def value(self, item):
+        """
+        Get the sync field value of a raw item.
+        Args:
+            item (dict): A raw item from the API.
+        Returns:
+            int: The timestamp, or 0 if missing.
+        """
+        return sync_value(item, self.field)
+
+    def observe(self, items):
+        """
+        Record the raw items of a page to move the next high-water mark.
+        Args:
+            items (list): Raw items from the API.
+        """
+        for item in items:
+            self.advance(self.value(item))
+
+    def advance(self, value):
+        """
+        Record a sync field value, e.g. the highest one of a page observed in a
+        transform pool, to move the next high-water mark.
+        Args:
+            value (int): The value, or None.
+        """
+        if value is not None and (self.seen is None or value > self.seen):
+            self.seen = value
+
+    def next_delta_file(self):
+        """
+        Reserve the path of the next delta file.
+        Returns:
+            str: The path of the delta file.
+        """
+        path = next_delta_file(self.folder, self.deltas)
+        self.deltas = _number(path)
+        return path
+
+    def commit(self, full=False):
+        """
+        Save the new high-water mark.
+        Call it only when every page of the crawl succeeded, otherwise the
+        items of the failed pages would be skipped by the next run.
+        Args:
+            full (bool): Whether the crawl was a full one. Older deltas are
+                then superseded by the pages and removed.
+        """
+        if full:
+            remove_deltas(self.folder)
+            self.deltas = 0
+        self.mark = self.seen
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"field": self.field, "mark": self.mark, "deltas": self.deltas}, f)
+        os.replace(tmp_path, self.path)
+
+
+def sync_value(item, field):
+    """
+    Get the sync field value of a raw item, see `SyncState.FIELDS`.
+    Args:
+        item (dict): A raw item from the API.
+        field (str): The sync field.
+    Returns:
+        int: The timestamp, or 0 if missing.
+    """
+    return int(item.get(field) or 0)
+
+
+def _number(path):
+    return int(re.search(r"_(\d+)\.json$", path).group(1))
+
+
+def next_delta_file(folder, last=0):
+    """
+    Reserve the path of the next delta file of a dataset folder.
+    Args:
+        folder (str): The dataset output folder.
+        last (int): The number of the last delta file reserved, which may not
+            be written yet.
+    Returns:
+        str: The path of the delta file, numbered after every existing one.
+    """
+    numbers = [_number(path) for path in glob.glob(os.path.join(folder, "delta_*.json"))]
+    return os.path.join(folder, f"delta_{max([last] + numbers) + 1}.json")
+
+
+def remove_deltas(folder):
+    """
+    Remove the delta files of a dataset folder, once a full crawl superseded them.
+    Args:
+        folder (str): The dataset output folder.
+    """
+    for path in glob.glob(os.path.join(folder, "delta_*.json")):
+        os.remove(path)
+
+
+def tombstone(record_id):
+    """
+    Make the record of a delta file deleting an id.
+    Args:
+        record_id (str): The id of the deleted record.
+    Returns:
+        dict: The tombstone.
+    """
+    return {"id": record_id, DELETED: True}
+
+
+def is_deleted(record):
+    """
+    Check whether a record is a tombstone (see `tombstone`).
+    """
+    return record.get(DELETED) is True
+
+
+def list_files(folder):
+    """
+    List the page and delta files of a dataset folder, oldest data first.
+    Args:
+        folder (str): The dataset output folder.
+    Returns:
+        list: The file paths, pages by page number then deltas by run.
+    """
+    pages = sorted(glob.glob(os.path.join(folder, "page_*.json")), key=_number)
+    deltas = sorted(glob.glob(os.path.join(folder, "delta_*.json")), key=_number)
+    return pages + deltas
+
+
+def iter_records(folder):
+    """
+    Read the records of a dataset folder, merged by id.
+    When an id appears several times (overlapping pages, incremental deltas),
+    the record of the most recent file wins. Ids deleted by a tombstone are
+    dropped, unless a more recent file adds them back.
+    Args:
+        folder (str): The dataset output folder.
+    Yields:
+        dict: The records, in first-seen order.
+    """
+    records = {}
+    for path in list_files(folder):
+        with open(path) as f:
+            for record in json.load(f):
+                if is_deleted(record):
+                    records.pop(record["id"], None)
+                else:
+                    records[record["id"]] = record
+    yield from records.values()
@@ -0,0 +1,379 @@
+"""
+Taxonomy terms
+==============
+Resolve the taxonomy term ids of modules and themes to term names.
+
+Projects reference terms of three vocabularies (see `VOCABULARIES`): their
+categories, and their maintenance and development status. The `module_terms`
+dataset holds those terms. `TermIndex` keeps them as sorted arrays (ids,
+vocabularies and names) so that resolving a column of ids is one binary search
+and one take, and is cached on disk as an Arrow IPC file, memory-mapped when
+loaded.
+
+`TermResolver` adds the name columns of `TERM_COLUMNS` to the batches of a
+dataset while they are merged (see `DrupalDataMerger`). Term ids missing from
+`module_terms` (e.g. terms created since it was fetched) are fetched lazily, in
+batches of ids, and added to the cache: analyses read the names from the
+merged dataset, without joining the term table.
+"""
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from drucom.schema import CATEGORIES, CATEGORY, INT, TEXT, get_schema, normalize
+
+# Vocabulary id -> the property of projects referencing its terms.
+VOCABULARIES = {3: "categories", 44: "maintenance_status", 46: "development_status"}
+
+# Dataset -> {term id column: term name column}.
+TERM_COLUMNS = {
+    "module": {
+        "maintenance_status": "maintenance_status_name",
+        "development_status": "development_status_name",
+        "categories": "category_names",
+    },
+    "theme": {
+        "maintenance_status": "maintenance_status_name",
+        "development_status": "development_status_name",
+    },
+}
+
+TERMS_SCHEMA = pa.schema([("id", INT), ("vocabulary", INT), ("name", TEXT)])
+
+
+class TermIndex:
+    """
+    An id -> (name, vocabulary) map of taxonomy terms, backed by sorted arrays.
+    """
+
+    def __init__(self, ids, vocabularies, names):
+        """
+        Initialize the index.
+        Args:
+            ids (numpy.ndarray): The sorted unique term ids.
+            vocabularies (numpy.ndarray): The vocabulary id of every term, 0 if unknown.
+            names (pyarrow.StringArray): The name of every term.
+        """
+        self.ids = ids
+        self.vocabularies = vocabularies
+        self.names = names
+
+    @classmethod
+    def from_table(cls, table):
+        """
+        Build an index from a table of terms.
+        Args:
+            table (pyarrow.Table): The `id`, `name` and `vocabulary` of the terms.
+                The last row of an id wins.
+        Returns:
+            TermIndex: The index.
+        """
+        table = table.filter(pc.is_valid(table.column("id")))
+        ids = table.column("id").to_numpy()
+        # The last occurrence of every id, in id order.
+        _, last = np.unique(ids[::-1], return_index=True)
+        rows = len(ids) - 1 - last
+        vocabularies = table.column("vocabulary").fill_null(0).to_numpy()
+        names = table.column("name").combine_chunks() if table.num_rows else pa.array([], TEXT)
+        return cls(ids[rows], vocabularies[rows].astype(np.int64), names.take(pa.array(rows)))
+
+    @classmethod
+    def empty(cls):
+        """
+        Build an index without terms.
+        """
+        return cls.from_table(TERMS_SCHEMA.empty_table())
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an index saved by `save`, memory-mapped.
+        Args:
+            path (str): The Arrow IPC file.
+        Returns:
+            TermIndex: The index.
+        """
+        with pa.ipc.open_file(pa.memory_map(path)) as reader:
+            table = reader.read_all()
+        if table.num_rows == 0:
+            return cls.empty()
+        return cls(table.column("id").chunk(0).to_numpy(),
+                   table.column("vocabulary").chunk(0).to_numpy(),
+                   table.column("name").chunk(0))
+
+    def save(self, path):
+        """
+        Save the index to an Arrow IPC file, replaced atomically.
+        Args:
+            path (str): The Arrow IPC file.
+        """
+        tmp_path = path + ".tmp"
+        with pa.ipc.new_file(tmp_path, TERMS_SCHEMA) as writer:
+            writer.write_table(self.to_table())
+        os.replace(tmp_path, path)
+
+    def to_table(self):
+        """
+        Get the terms as a table, sorted by id.
+        """
+        return pa.table([pa.array(self.ids, INT), pa.array(self.vocabularies, INT), self.names],
+                        schema=TERMS_SCHEMA)
+
+    def update(self, table):
+        """
+        Add terms to the index.
+        Args:
+            table (pyarrow.Table): The `id`, `name` and `vocabulary` of the terms.
+                Known ids are replaced.
+        Returns:
+            TermIndex: A new index.
+        """
+        table = table.select(TERMS_SCHEMA.names).cast(TERMS_SCHEMA)
+        return TermIndex.from_table(pa.concat_tables([self.to_table(), table]))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def positions(self, ids):
+        """
+        Find the positions of term ids in the index.
+        Args:
+            ids (numpy.ndarray): The term ids.
+        Returns:
+            numpy.ndarray: The position of every id, -1 for unknown ids.
+        """
+        ids = np.asarray(ids, np.int64)
+        positions = np.searchsorted(self.ids, ids)
+        positions[positions == len(self.ids)] = 0
+        if len(self.ids):
+            found = self.ids[positions] == ids
+        else:
+            found = np.zeros(len(ids), bool)
+        return np.where(found, positions, -1)
+
+    def missing(self, ids):
+        """
+        Find the term ids unknown to the index.
+        Args:
+            ids (numpy.ndarray): The term ids.
+        Returns:
+            numpy.ndarray: The sorted unique unknown ids.
+        """
+        ids = np.unique(np.asarray(ids, np.int64))
+        return ids[self.positions(ids) < 0]
+
+    def lookup(self, ids):
+        """
+        Get the names of term ids.
+        Args:
+            ids (pyarrow.Array): The term ids, possibly null.
+        Returns:
+            pyarrow.DictionaryArray: The names, null for null and unknown ids.
+        """
+        positions = self.positions(ids.fill_null(-1).to_numpy(zero_copy_only=False))
+        positions = pa.array(positions, mask=positions < 0)
+        return pc.dictionary_encode(self.names.take(positions))
+
+    def name(self, term_id):
+        """
+        Get the name of a term.
+        Args:
+            term_id (int): The term id.
+        Returns:
+            str: The name, or None if the term is unknown.
+        """
+        position = self.positions([term_id])[0]
+        return self.names[position].as_py() if position >= 0 else None
+
+    def vocabulary(self, term_id):
+        """
+        Get the vocabulary of a term.
+        Args:
+            term_id (int): The term id.
+        Returns:
+            int: The vocabulary id, or None if the term is unknown.
+        """
+        position = self.positions([term_id])[0]
+        if position < 0:
+            return None
+        return int(self.vocabularies[position]) or None
+
+
+def read_terms(path):
+    """
+    Read the terms of the merged `module_terms` dataset.
+    Args:
+        path (str): The Parquet file.
+    Returns:
+        TermIndex: The index.
+    """
+    table = pq.read_table(path)
+    for field in TERMS_SCHEMA:
+        if field.name not in table.column_names:
+            table = table.append_column(field, pa.nulls(table.num_rows, field.type))
+    return TermIndex.from_table(table.select(TERMS_SCHEMA.names))
+
+
+def fetch_terms(ids, batch_size=50, cache=None, metrics=None, base_url=None):
+    """
+    Fetch terms from the API by id.
+    Args:
+        ids (list): The term ids.
+        batch_size (int): The number of ids per request.
+        cache (ResponseCache): The optional response cache.
+        metrics (Metrics): The optional metrics registry.
+        base_url (str): The base URL of the API. Defaults to `DrupalDataFetcher.BASE_URL`.
+    Returns:
+        pyarrow.Table: The terms found, normalized to the `module_terms` schema.
+    Raises:
+        FetchError: If a request failed.
+    """
+    from drucom.DrupalDataFetcher import DrupalDataFetcher
+    from drucom.client import get_json_blocking
+    from drucom.transform import MappingTransformer
+
+    endpoint, params = DrupalDataFetcher.get_endpoint("module_terms")
+    url = f"{base_url or DrupalDataFetcher.BASE_URL}/{endpoint}"
+    transformer = MappingTransformer(DrupalDataFetcher.get_mapping("module_terms"))
+    ids = [int(term_id) for term_id in ids]
+    records = []
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        data = get_json_blocking(url, {**params, 'tid[]': [str(term_id) for term_id in batch],
+                                       'limit': batch_size},
+                                 DrupalDataFetcher.HEADERS, cache, metrics=metrics)
+        records += transformer.transform(data.get('list', []))
+    return pa.Table.from_batches([normalize(records, get_schema("module_terms"))])
+
+
+class TermResolver:
+    """
+    Resolve term ids to names, from the cached index of `module_terms` and the API.
+
+    Example:
+        resolver = TermResolver()
+        resolver.index.name(13028)  # "Actively maintained"
+        batch = resolver.resolve(batch, "module")  # adds `TERM_COLUMNS["module"]`
+    """
+
+    def __init__(self, data_dir=None, cache_file=None, fetch=fetch_terms, batch_size=50):
+        """
+        Initialize the resolver. The index is loaded on first use.
+        Args:
+            data_dir (str): The folder of `module_terms.parquet`. Defaults to `../data`.
+            cache_file (str): The index cache. Defaults to `<data_dir>/terms.arrow`.
+            fetch (callable): Fetches terms by id, see `fetch_terms`. None
+                never fetches: unknown ids resolve to null.
+            batch_size (int): The number of ids per request.
+        """
+        data_dir = data_dir or os.path.join(os.path.dirname(__file__), "../data")
+        self.source = os.path.join(data_dir, "module_terms.parquet")
+        self.cache_file = cache_file or os.path.join(data_dir, "terms.arrow")
+        self.fetch = fetch
+        self.batch_size = batch_size
+        # Ids fetched but not found, not requested again.
+        self.unknown = set()
+        self._index = None
+
+    @property
+    def index(self):
+        """
+        The term index: the cache, rebuilt when `module_terms` was merged since.
+        """
+        if self._index is None:
+            self._index = self.load()
+        return self._index
+
+    def load(self):
+        """
+        Load the index from its cache, or build it from `module_terms`.
+        Returns:
+            TermIndex: The index.
+        """
+        source_time = os.path.getmtime(self.source) if os.path.exists(self.source) else None
+        if os.path.exists(self.cache_file) and (
+                source_time is None or os.path.getmtime(self.cache_file) >= source_time):
+            return TermIndex.load(self.cache_file)
+        if source_time is None:
+            return TermIndex.empty()
+        index = read_terms(self.source)
+        self.save(index)
+        return index
+
+    def save(self, index):
+        """
+        Save the index to the cache.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+        index.save(self.cache_file)
+
+    def prefetch(self, ids):
+        """
+        Fetch the unknown terms among ids, and add them to the index and its cache.
+        Args:
+            ids (numpy.ndarray): The term ids.
+        Returns:
+            int: The number of terms added.
+        """
+        if self.fetch is None:
+            return 0
+        missing = [term_id for term_id in self.index.missing(ids).tolist() if term_id not in self.unknown]
+        if not missing:
+            return 0
+        try:
+            terms = self.fetch(missing, batch_size=self.batch_size)
+        except Exception as e:
+            print(f"Error fetching {len(missing)} terms: {e}")
+            return 0
+        self.unknown.update(set(missing) - set(terms.column("id").to_pylist()))
+        if terms.num_rows:
+            self._index = self.index.update(terms)
+            self.save(self._index)
+        return terms.num_rows
+
+    def resolve(self, batch, dataset_name):
+        """
+        Add the term name columns of a dataset to a batch.
+        Args:
+            batch (pyarrow.RecordBatch): The records, normalized to the dataset schema.
+            dataset_name (str): The name of the dataset.
+        Returns:
+            pyarrow.RecordBatch: The records with the columns of `resolved_schema`.
+        """
+        columns = TERM_COLUMNS.get(dataset_name, {})
+        values = {}
+        for id_column in columns:
+            column = batch.column(id_column)
+            values[id_column] = pc.list_flatten(column) if pa.types.is_list(column.type) else column
+        if values:
+            ids = pa.concat_arrays([value.cast(INT) for value in values.values()]).drop_null()
+            self.prefetch(ids.to_numpy())
+
+        arrays = list(batch.columns)
+        for id_column in columns:
+            names = self.index.lookup(values[id_column])
+            column = batch.column(id_column)
+            if pa.types.is_list(column.type):
+                lengths = pc.list_value_length(column).fill_null(0).to_numpy()
+                offsets = pa.array(np.concatenate([[0], np.cumsum(lengths)]), pa.int32())
+                names = pa.ListArray.from_arrays(offsets, names, type=CATEGORIES)
+            arrays.append(names)
+        return pa.RecordBatch.from_arrays(arrays, schema=resolved_schema(batch.schema, dataset_name))
+
+
+def resolved_schema(schema, dataset_name):
+    """
+    Get the schema of a dataset with its term name columns.
+    Args:
+        schema (pyarrow.Schema): The schema of the dataset.
+        dataset_name (str): The name of the dataset.
+    Returns:
+        pyarrow.Schema: The schema, with the columns of `TERM_COLUMNS` appended.
+    """
+    for id_column, name_column in TERM_COLUMNS.get(dataset_name, {}).items():
+        is_list = pa.types.is_list(schema.field(id_column).type)
+        schema = schema.append(pa.field(name_column, CATEGORIES if is_list else CATEGORY))
+    return schema
@@ -0,0 +1,142 @@
+import json
+import os
+import tempfile
+import unittest
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from drucom.DrupalDataMerger import DrupalDataMerger
+from drucom.aggregates import MISSING_FIELDS, Aggregates, read_view
+from drucom.sync import iter_records, list_files, tombstone
+from drucom.tests.test_merger import write_pages
+
+
+def write_totals(path, totals):
+    with open(path, "w") as f:
+        json.dump({str(uid): {"total": total} for uid, total in totals.items()}, f)
+
+
+def expected_views(folder, totals, top):
+    """
+    Compute the views from scratch with pandas, as the notebooks do.
+    """
+    from drucom.schema import SCHEMAS, normalize
+    users = pa.Table.from_batches([normalize(list(iter_records(folder)), SCHEMAS["user"])]).to_pandas()
+    users["comments"] = users["id"].map(totals).fillna(0)
+    commenters = users[(users["comments"] > 0) & (users["id"] != 180064)]
+    ranked = [(uid, count) for uid, count in totals.items() if count > 0 and uid != 180064]
+    ranked.sort(key=lambda item: (-item[1], item[0]))
+    anonymous = users["fname"].isnull() & users["lname"].isnull()
+    return {
+        "registrations_per_year": {str(year): count for year, count in
+                                   users["created"].dt.year.value_counts().sort_index().items()},
+        "anonymous": {"users": len(users), "anonymous": int(anonymous.sum()), "share": anonymous.mean()},
+        "missing_values": {field: int(users[field].isnull().sum()) for field in MISSING_FIELDS},
+        "commenters_per_region": {str(region): count for region, count in
+                                  commenters.groupby("region", observed=True)["id"].count().items()},
+        "top_commenters": [{"uid": uid, "comments": count} for uid, count in ranked[:top]],
+    }
+
+
+class TestAggregates(unittest.TestCase):
+    def assertViews(self, aggregates, folder, totals):
+        expected = expected_views(folder, totals, aggregates.top)
+        views = aggregates.views()
+        self.assertEqual(views["registrations_per_year"], expected["registrations_per_year"])
+        self.assertEqual(views["anonymous"]["users"], expected["anonymous"]["users"])
+        self.assertEqual(views["anonymous"]["anonymous"], expected["anonymous"]["anonymous"])
+        self.assertAlmostEqual(views["anonymous"]["share"], expected["anonymous"]["share"])
+        self.assertEqual(views["missing_values"]["counts"], expected["missing_values"])
+        self.assertEqual(views["commenters_per_region"], expected["commenters_per_region"])
+        self.assertEqual(views["top_commenters"], expected["top_commenters"])
+
+    def test_incremental_updates_match_a_full_recompute(self):
+        with tempfile.TemporaryDirectory() as folder:
+            pages = os.path.join(folder, "user")
+            os.makedirs(pages)
+            records = write_pages(pages, "user", 3)
+            totals = {int(record["id"]): int(record["id"]) % 7 for record in records[::3]}
+            totals[180064] = 10_000
+            write_totals(os.path.join(folder, "counts.json"), totals)
+
+            state = os.path.join(folder, "aggregates")
+            aggregates = Aggregates(state, top=10)
+            self.assertEqual(aggregates.add_files("user", list_files(pages)), 3)
+            aggregates.add_files("comment_totals", [os.path.join(folder, "counts.json")])
+            aggregates.save()
+            self.assertViews(aggregates, pages, totals)
+
+            # A delta: new users and an updated one, and new comment totals,
+            # one of them lower than before.
+            with open(os.path.join(pages, "delta_1.json"), "w") as f:
+                json.dump([{**records[0], "fname": None, "lname": None, "timezone": "Asia/Tokyo"},
+                           {"id": "900001", "created": "1700000000", "fname": "New"}], f)
+            # The first of the top commenters.
+            lowered = max((uid for uid in totals if uid != 180064), key=lambda uid: (totals[uid], -uid))
+            totals.update({int(records[0]["id"]): 50, 900001: 3, lowered: 0})
+            write_totals(os.path.join(folder, "counts_2.json"), {
+                int(records[0]["id"]): 50, 900001: 3, lowered: 0})
+
+            aggregates = Aggregates(state, top=10)
+            self.assertEqual(aggregates.add_files("user", list_files(pages)), 1)
+            aggregates.add_files("comment_totals", [os.path.join(folder, "counts.json"),
+                                                    os.path.join(folder, "counts_2.json")])
+            aggregates.save()
+            self.assertViews(aggregates, pages, totals)
+            self.assertEqual(read_view("top_commenters", state)[0],
+                             {"uid": int(records[0]["id"]), "comments": 50})
+            with self.assertRaises(ValueError):
+                read_view("everything", state)
+
+    def test_deleted_users(self):
+        with tempfile.TemporaryDirectory() as folder:
+            records = write_pages(folder, "user", 1)
+            totals = {int(record["id"]): 1 for record in records}
+            write_totals(os.path.join(folder, "counts.json"), totals)
+            aggregates = Aggregates(os.path.join(folder, "aggregates"))
+            aggregates.add_files("user", list_files(folder))
+            aggregates.add_files("comment_totals", [os.path.join(folder, "counts.json")])
+
+            with open(os.path.join(folder, "delta_1.json"), "w") as f:
+                json.dump([tombstone(record["id"]) for record in records[:10]] + [tombstone("900001")], f)
+            self.assertEqual(aggregates.add_files("user", list_files(folder)), 1)
+            self.assertViews(aggregates, folder, totals)
+            self.assertEqual(aggregates.views()["anonymous"]["users"], len(records) - 10)
+
+    def test_rewritten_files(self):
+        with tempfile.TemporaryDirectory() as folder:
+            records = write_pages(folder, "user", 3)
+            totals = {int(record["id"]): 2 for record in records}
+            write_totals(os.path.join(folder, "counts.json"), totals)
+            with open(os.path.join(folder, "delta_1.json"), "w") as f:
+                json.dump([{"id": "900001", "created": "1700000000"}], f)
+            aggregates = Aggregates(os.path.join(folder, "aggregates"))
+            aggregates.add_files("user", list_files(folder))
+            aggregates.add_files("comment_totals", [os.path.join(folder, "counts.json")])
+
+            # A rewrite with fewer users supersedes the pages and the delta.
+            os.remove(os.path.join(folder, "page_2.json"))
+            os.remove(os.path.join(folder, "delta_1.json"))
+            with open(os.path.join(folder, "page_1.json"), "w") as f:
+                json.dump(records[50:60], f)
+            totals = {int(record["id"]): 1 for record in records[:60]}
+            write_totals(os.path.join(folder, "counts.json"), totals)
+            self.assertEqual(aggregates.add_files("user", list_files(folder)), 2)
+            aggregates.add_files("comment_totals", [os.path.join(folder, "counts.json")])
+            self.assertViews(aggregates, folder, totals)
+            self.assertEqual(aggregates.views()["anonymous"]["users"], 60)
+
+    def test_merged_parquet(self):
+        with tempfile.TemporaryDirectory() as folder:
+            write_pages(folder, "user", 2)
+            output = os.path.join(folder, "user.parquet")
+            DrupalDataMerger("user", folder, output, workers=1).run()
+            aggregates = Aggregates(os.path.join(folder, "aggregates"))
+            aggregates.add_parquet(output, batch_size=150)
+            self.assertViews(aggregates, folder, {})
+            self.assertEqual(aggregates.views()["anonymous"]["users"], pq.read_metadata(output).num_rows)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import asyncio
+import tempfile
+import unittest
+
+import aiohttp
+from aiohttp import web
+
+from drucom.cache import ResponseCache
+from drucom.client import DrupalClient, FetchError, get_json_blocking
+
+
+class EtagServer:
+    """
+    A local server answering 304 when the `If-None-Match` header matches.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.not_modified = 0
+
+    async def handle(self, request):
+        self.requests += 1
+        if request.headers.get("If-None-Match") == '"v1"':
+            self.not_modified += 1
+            return web.Response(status=304)
+        return web.json_response({"page": request.query["page"]}, headers={"ETag": '"v1"'})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/node.json", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/node.json"
+        return self
+
+    async def __aexit__(self, *args):
+        await self.runner.cleanup()
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_key_ignores_parameter_order(self):
+        self.assertEqual(ResponseCache.key("u", {"a": 1, "b": [2, 3]}),
+                         ResponseCache.key("u", {"b": [2, 3], "a": 1}))
+        self.assertNotEqual(ResponseCache.key("u", {"page": 1}), ResponseCache.key("u", {"page": 2}))
+
+    def test_lru_eviction(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cache = ResponseCache(folder, max_size=250)
+            for page in range(2):
+                cache.put("u", {"page": page}, b"x" * 100, {})
+                entry = cache.get("u", {"page": page})
+                os.utime(cache._path(entry["key"], "meta"), (page, page))
+            # Page 0 is used again, page 1 becomes the least recently used.
+            cache.touch(cache.get("u", {"page": 0}))
+            cache.put("u", {"page": 2}, b"x" * 100, {})
+            self.assertIsNotNone(cache.get("u", {"page": 0}))
+            self.assertIsNone(cache.get("u", {"page": 1}))
+            self.assertLessEqual(ResponseCache(folder, max_size=250).size, 250)
+
+    def test_revalidation_and_offline_replay(self):
+        async def crawl(cache, url):
+            async with aiohttp.ClientSession() as session:
+                client = DrupalClient(session, cache=cache)
+                return [await client.get_json(url, {"page": page}) for page in range(3)]
+
+        async def run(folder):
+            async with EtagServer() as server:
+                cache = ResponseCache(folder, ttl=0)
+                first = await crawl(cache, server.url)
+                second = await crawl(cache, server.url)
+                self.assertEqual(first, second)
+                self.assertEqual(server.not_modified, 3)
+                requests = server.requests
+                offline = ResponseCache(folder, offline=True)
+                self.assertEqual(await crawl(offline, server.url), first)
+                self.assertEqual(server.requests, requests)
+                self.assertEqual(get_json_blocking(server.url, {"page": 2}, cache=offline), {"page": "2"})
+                with self.assertRaises(FetchError):
+                    get_json_blocking(server.url, {"page": 9}, cache=offline)
+
+        with tempfile.TemporaryDirectory() as folder:
+            asyncio.run(run(folder))
+
+
+if __name__ == "__main__":
+    unittest.main()
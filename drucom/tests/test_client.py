@@ -0,0 +1,96 @@
+import asyncio
+import unittest
+
+import aiohttp
+from aiohttp import web
+
+from drucom.client import AdaptiveLimiter, DrupalClient, FetchError, parse_retry_after
+
+
+class ThrottlingServer:
+    """
+    A local stand-in for api-d7 which answers 429 above `capacity` concurrent requests.
+    """
+
+    def __init__(self, capacity=8, latency=0.01, retry_after="0.05", always_fail=False):
+        self.capacity = capacity
+        self.latency = latency
+        self.retry_after = retry_after
+        self.always_fail = always_fail
+        self.in_flight = 0
+        self.throttled = 0
+
+    async def handle(self, request):
+        if self.always_fail:
+            return web.json_response({}, status=503)
+        if self.in_flight >= self.capacity:
+            self.throttled += 1
+            return web.json_response({}, status=429, headers={"Retry-After": self.retry_after})
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.latency)
+            return web.json_response({"list": [{"nid": request.query["nid"]}]})
+        finally:
+            self.in_flight -= 1
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/node.json", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/node.json"
+        return self
+
+    async def __aexit__(self, *args):
+        await self.runner.cleanup()
+
+
+class TestDrupalClient(unittest.TestCase):
+    def test_settles_near_server_limit_without_losing_data(self):
+        asyncio.run(self._settles_near_server_limit())
+
+    def test_gives_up_after_time_budget(self):
+        asyncio.run(self._gives_up_after_time_budget())
+
+    async def _settles_near_server_limit(self):
+        async with ThrottlingServer(capacity=8) as server:
+            async with aiohttp.ClientSession() as session:
+                limiter = AdaptiveLimiter(initial=32, maximum=64)
+                client = DrupalClient(session, limiter, base_delay=0.01)
+                samples = []
+
+                async def sample():
+                    while True:
+                        samples.append(limiter.limit)
+                        await asyncio.sleep(0.01)
+
+                sampler = asyncio.create_task(sample())
+                results = await asyncio.gather(*[
+                    client.get_json(server.url, {"nid": nid}) for nid in range(600)])
+                sampler.cancel()
+
+        self.assertEqual([int(page["list"][0]["nid"]) for page in results], list(range(600)))
+        self.assertGreater(server.throttled, 0)
+        settled = samples[len(samples) // 2:]
+        self.assertTrue(4 <= sum(settled) / len(settled) <= 16, settled)
+
+    async def _gives_up_after_time_budget(self):
+        async with ThrottlingServer(always_fail=True) as server:
+            async with aiohttp.ClientSession() as session:
+                client = DrupalClient(session, time_budget=0.3, base_delay=0.01)
+                with self.assertRaises(FetchError):
+                    await client.get_json(server.url, {"nid": 1})
+                self.assertEqual(client.limiter.in_flight, 0)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("120"), 120)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
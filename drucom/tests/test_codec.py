@@ -0,0 +1,102 @@
+import json
+import tempfile
+import unittest
+
+from drucom.DrupalDataFetcher import DrupalDataFetcher
+from drucom.benchmarks.mock_server import MockApi, ThreadedMockServer
+from drucom.benchmarks.synthetic import make_page
+from drucom.codec import ListStreamParser, PageStream, dumps, loads
+from drucom.sync import iter_records
+
+
+def feed(parser, body, size):
+    items = []
+    for start in range(0, len(body), size):
+        items += parser.feed(body[start:start + size])
+    return items
+
+
+class TestListStreamParser(unittest.TestCase):
+    def test_items_and_envelope_in_any_chunking(self):
+        page = make_page("event", 2, limit=40, total=200)
+        # Brackets, quotes and backslashes in strings must not end an item.
+        page["list"][3]["title"] = 'x]}"\\'
+        page["list"][4]["title"] = '\\\\"{['
+        page["extra"] = {"nested": [1, {"a": "]"}], "n": -1.5e3}
+        for indent in (None, 2):
+            body = json.dumps(page, indent=indent).encode()
+            for size in (64, 512, len(body)):
+                with self.subTest(indent=indent, size=size):
+                    parser = ListStreamParser()
+                    self.assertEqual(feed(parser, body, size), page["list"])
+                    self.assertEqual(parser.close(), {k: v for k, v in page.items() if k != "list"})
+
+    def test_scalar_items(self):
+        parser = ListStreamParser()
+        self.assertEqual(feed(parser, b'{"list": [1, "a", {}], "last": "x?page=2"}', 1), [1, "a", {}])
+        self.assertEqual(parser.close(), {"last": "x?page=2"})
+
+    def test_scalar_items_after_containers(self):
+        body = b'{"list": [null, 1.5, {}, [{},null], 60348, true], "next": null}'
+        for size in (1, 7, len(body)):
+            with self.subTest(size=size):
+                parser = ListStreamParser()
+                self.assertEqual(feed(parser, body, size), json.loads(body)["list"])
+                self.assertEqual(parser.close(), {"next": None})
+
+    def test_buffer_holds_one_item(self):
+        body = json.dumps(make_page("user", 0, limit=100)).encode()
+        parser = ListStreamParser()
+        largest = 0
+        for start in range(0, len(body), 4096):
+            parser.feed(body[start:start + 4096])
+            largest = max(largest, len(parser._buffer))
+        self.assertLess(largest, 4 * 4096)
+
+    def test_incomplete_document(self):
+        parser = ListStreamParser()
+        parser.feed(b'{"list": [{"a": 1}')
+        with self.assertRaises(ValueError):
+            parser.close()
+        with self.assertRaises(ValueError):
+            ListStreamParser().feed(b'[1, 2]')
+
+
+class TestPageStream(unittest.TestCase):
+    def test_transforms_in_batches(self):
+        batches = []
+
+        def transform(items):
+            batches.append(len(items))
+            return [item["nid"] for item in items]
+
+        page = make_page("module", 0, limit=100)
+        stream = PageStream(transform, batch_size=30)
+        body = dumps(page).encode()
+        for start in range(0, len(body), 2048):
+            stream.feed(body[start:start + 2048])
+        data = stream.close()
+        self.assertEqual(data["records"], [item["nid"] for item in page["list"]])
+        self.assertEqual(data["last"], page["last"])
+        self.assertTrue(all(size < 30 + 2048 // 500 for size in batches[:-1]))
+        self.assertEqual(sum(batches), 100)
+
+    def test_codec_round_trip(self):
+        records = [{"id": "1", "title": "Café", "tags": [1, None]}]
+        self.assertEqual(loads(dumps(records)), records)
+
+
+class TestStreamingCrawl(unittest.TestCase):
+    def test_streamed_pages_match_the_api(self):
+        api = MockApi(totals={"user": 250}, latency=0.001)
+        with ThreadedMockServer(api) as server, tempfile.TemporaryDirectory() as folder:
+            fetcher = DrupalDataFetcher("user", output_folder=folder)
+            fetcher.BASE_URL = server.base_url
+            fetcher.run()
+            records = sorted(iter_records(folder), key=lambda record: int(record["id"]))
+            self.assertEqual(fetcher.sync_state.mark, int(records[-1]["created"]))
+        self.assertEqual([int(record["id"]) for record in records], list(range(1, 251)))
+        self.assertEqual(set(records[0]), set(fetcher.mapping))
+
+if __name__ == "__main__":
+    unittest.main()
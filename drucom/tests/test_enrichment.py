@@ -0,0 +1,91 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from drucom.benchmarks.mock_server import MockApi, ThreadedMockServer
+from drucom.enrichment import EntityEnricher, load_ids, pack_json_ids
+
+
+class TestEntityEnricher(unittest.TestCase):
+    def test_pack_ids(self):
+        with tempfile.TemporaryDirectory() as folder:
+            with open(os.path.join(folder, "uids.json"), "w") as f:
+                json.dump(["3", 1, "20"], f)
+            self.assertEqual(pack_json_ids(os.path.join(folder, "uids.json"), os.path.join(folder, "uids.npy")), 3)
+            ids = load_ids(os.path.join(folder, "uids.npy"))
+            self.assertIsInstance(ids, np.memmap)
+            self.assertEqual(ids.tolist(), [3, 1, 20])
+
+    def test_slow_lookup_does_not_stall_the_window(self):
+        saved = []
+
+        async def lookup(client, entity_id):
+            if entity_id == 0:
+                # Only returns once every other block is saved, which a
+                # barrier per block would never allow.
+                for _ in range(500):
+                    if len(saved) == 9:
+                        break
+                    await asyncio.sleep(0.01)
+            else:
+                await asyncio.sleep(0.001)
+            return entity_id * 2
+
+        with tempfile.TemporaryDirectory() as folder:
+            enricher = EntityEnricher("double", lookup, folder, block_size=10, window=10)
+            save = enricher.save
+
+            async def recorded_save(block, results):
+                saved.append(block)
+                await save(block, results)
+
+            enricher.save = recorded_save
+            gaps = asyncio.run(enricher.run(np.arange(100), client=object()))
+            self.assertEqual(gaps, [])
+            self.assertEqual(len(saved), 10)
+            self.assertEqual(saved[-1], 1)
+            with open(enricher.path(10)) as f:
+                self.assertEqual(json.load(f), {str(i): i * 2 for i in range(90, 100)})
+
+    def test_failed_blocks_are_resumed(self):
+        looked_up = []
+
+        async def flaky(client, entity_id):
+            looked_up.append(entity_id)
+            return None if entity_id == 13 else {"total": entity_id}
+
+        with tempfile.TemporaryDirectory() as folder:
+            ids = np.arange(1, 26)
+            enricher = EntityEnricher("flaky", flaky, folder, block_size=10, window=4)
+            self.assertEqual(asyncio.run(enricher.run(ids, client=object())), [2])
+            self.assertEqual(enricher.manifest.summary()["records"], 15)
+
+            looked_up.clear()
+            enricher = EntityEnricher("flaky", lambda client, entity_id: flaky(client, 0), folder, block_size=10)
+            self.assertEqual(asyncio.run(enricher.run(ids, client=object())), [])
+            self.assertEqual(len(looked_up), 10)
+
+    def test_comment_totals(self):
+        api = MockApi(totals={"comment": 100}, latency=0.001)
+
+        async def comments(client, uid):
+            data = await client.get_json(f"{server.base_url}/comment.json", {'author': uid, 'limit': 1, 'full': 0})
+            return {"total": int(data["last"].split("page=")[1]) + 1 if data["list"] else 0}
+
+        with ThreadedMockServer(api) as server, tempfile.TemporaryDirectory() as folder:
+            enricher = EntityEnricher("comment_totals", comments, folder, block_size=7, window=5)
+            self.assertEqual(asyncio.run(enricher.run(np.arange(1, 31))), [])
+            totals = {}
+            for block in enricher.blocks(np.arange(1, 31)):
+                with open(enricher.path(block)) as f:
+                    totals.update(json.load(f))
+            self.assertEqual(totals, {str(uid): {"total": api.comments_of(uid)} for uid in range(1, 31)})
+            self.assertTrue(os.path.exists(os.path.join(folder, "metrics.prom")))
+
+
+if __name__ == "__main__":
+    unittest.main()
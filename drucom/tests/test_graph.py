@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from drucom.graph import Adjacency, EntityGraph, build_graph
+from drucom.schema import SCHEMAS, normalize
+
+
+def write_dataset(folder, name, records):
+    batch = normalize(records, SCHEMAS[name])
+    pq.write_table(pa.Table.from_batches([batch]), os.path.join(folder, f"{name}.parquet"))
+
+
+class TestAdjacency(unittest.TestCase):
+    def test_from_edges(self):
+        adjacency = Adjacency.from_edges(
+            np.array([5, 1, 5, 5]), np.array([30, 10, 20, 30]), ids=np.array([1, 3, 5]))
+        self.assertEqual(adjacency.ids.tolist(), [1, 3, 5])
+        self.assertEqual(adjacency.neighbors(5).tolist(), [20, 30])
+        self.assertEqual(adjacency.degrees().tolist(), [1, 0, 2])
+        self.assertEqual(adjacency.degree(4), 0)
+        self.assertEqual(adjacency.neighbors(4).tolist(), [])
+        reverse = adjacency.reverse(np.array([10, 20, 30, 40]))
+        self.assertEqual(reverse.neighbors(30).tolist(), [5])
+        self.assertEqual(reverse.degree(40), 0)
+
+
+class TestEntityGraph(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        data = self.folder.name
+        write_dataset(data, "user", [
+            {"id": "1", "organizations": ["900"], "mentors": ["2"]},
+            {"id": "2", "organizations": ["100"]},
+            {"id": "3", "organizations": ["100", "101"]},
+        ])
+        write_dataset(data, "organization", [{"id": "100"}, {"id": "101"}])
+        write_dataset(data, "event", [
+            {"id": "50", "sponsors": ["100"], "speakers": ["2", "3"]},
+            {"id": "51", "sponsors": ["101", "102"], "speakers": ["2"]},
+            {"id": "52", "speakers": [{"id": "3"}]},
+        ])
+        self.report = build_graph(data)
+        self.graph = EntityGraph(os.path.join(data, "graph"))
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_report(self):
+        self.assertNotIn("module.categories", self.report)
+        self.assertEqual(self.report["user.organizations"]["edges"], 4)
+        self.assertEqual(self.report["user.organizations"]["dangling_ids"], 1)
+        self.assertEqual(self.report["user.organizations"]["dangling_sample"], [900])
+        self.assertEqual(self.report["event.sponsors"]["dangling_edges"], 1)
+        self.assertEqual(self.report["event.speakers"]["dangling_edges"], 0)
+        self.assertEqual(self.graph.dangling()["user.organizations"], 0.25)
+
+    def test_queries(self):
+        graph = self.graph
+        self.assertEqual(graph.neighbors("user.organizations", 3).tolist(), [100, 101])
+        self.assertEqual(graph.neighbors("~event.speakers", 3).tolist(), [50, 52])
+        self.assertEqual(graph.degree("~user.organizations", 100), 2)
+        self.assertEqual(graph.degree("~user.organizations", 999), 0)
+        # Events sponsored by the organizations of user 3, where user 3 speaks.
+        sponsored = graph.two_hop(3, "user.organizations", "~event.sponsors")
+        self.assertEqual(sponsored.tolist(), [50, 51])
+        self.assertEqual(np.intersect1d(sponsored, graph.neighbors("~event.speakers", 3)).tolist(), [50])
+        self.assertEqual(graph.two_hop(9, "user.organizations", "~event.sponsors").tolist(), [])
+        with self.assertRaises(ValueError):
+            graph.relation("module.categories")
+
+    def test_memory_mapped(self):
+        self.assertIsInstance(self.graph.relation("event.sponsors").indices, np.memmap)
+        graph = EntityGraph(self.graph.folder, mmap=False)
+        self.assertNotIsInstance(graph.relation("event.sponsors").indices, np.memmap)
+
+
+if __name__ == "__main__":
+    unittest.main()
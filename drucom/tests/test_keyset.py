@@ -0,0 +1,104 @@
+import tempfile
+import unittest
+
+from drucom.DrupalDataFetcher import DrupalDataFetcher
+from drucom.benchmarks.mock_server import MockApi, ThreadedMockServer
+from drucom.keyset import check_cursor, resume_cursor, split_ids
+from drucom.manifest import CrawlManifest
+from drucom.orchestrator import CrawlOrchestrator
+from drucom.sync import iter_records
+
+
+class GrowingFetcher(DrupalDataFetcher):
+    """
+    A fetcher whose dataset grows by `added` records after the first page saved.
+    """
+
+    def __init__(self, mock, added, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.api = mock
+        self.added = added
+
+    async def save_page(self, page, data):
+        if self.added:
+            self.api.totals[self.dataset_name] += self.added
+            self.added = 0
+        return await super().save_page(page, data)
+
+
+class TestKeyset(unittest.TestCase):
+    def test_split_ids(self):
+        self.assertEqual(split_ids(10, 3), [[0, 4], [4, 8], [8, None]])
+        self.assertEqual(split_ids(2, 8), [[0, 1], [1, None]])
+        self.assertEqual(split_ids(0, 8), [[0, None]])
+
+    def test_resume_cursor(self):
+        with tempfile.TemporaryDirectory() as folder:
+            manifest = CrawlManifest(f"{folder}/manifest.json")
+            manifest.done(0, 10, next=10)
+            manifest.done(10, 10, next=20)
+            manifest.fail(20, "fetch failed")
+            self.assertEqual(resume_cursor(manifest, lambda page: True, 0), 20)
+            self.assertEqual(resume_cursor(manifest, lambda page: page != 10, 0), 10)
+            manifest.done(20, 5, next=None)
+            self.assertIsNone(resume_cursor(manifest, lambda page: True, 0))
+
+    def test_check_cursor(self):
+        check_cursor([11, 12], 10)
+        with self.assertRaises(ValueError):
+            check_cursor([1, 2], 10)
+
+    def crawl(self, api, folder, resume=False, fetcher_class=DrupalDataFetcher, **options):
+        with ThreadedMockServer(api) as server:
+            fetcher = fetcher_class(dataset_name="module", output_folder=folder, partitions=4, **options)
+            fetcher.BASE_URL = server.base_url
+            fetcher.run(resume=resume)
+        return fetcher
+
+    def test_resumed_crawl_fetches_every_record(self):
+        api = MockApi(totals={"module": 1234}, latency=0.001, limit=50, error_rate=0.1)
+        with tempfile.TemporaryDirectory() as folder:
+            fetcher = self.crawl(api, folder)
+            api.error_rate = 0.0
+            while fetcher.verify():
+                fetcher = self.crawl(api, folder, resume=True)
+            ids = [int(record["id"]) for record in iter_records(folder)]
+            self.assertEqual(sorted(ids), list(range(1, 1235)))
+            self.assertEqual(len(fetcher.manifest.meta["ranges"]), 4)
+
+    def test_records_created_during_the_crawl(self):
+        api = MockApi(totals={"module": 400}, latency=0.001, limit=50)
+        with tempfile.TemporaryDirectory() as folder:
+            fetcher = self.crawl(api, folder, fetcher_class=GrowingFetcher, mock=api, added=75)
+            ids = [int(record["id"]) for record in iter_records(folder)]
+            self.assertEqual(fetcher.verify(), [])
+        self.assertEqual(sorted(ids), list(range(1, 476)))
+
+    def test_keyset_crawl_replaces_numbered_pages(self):
+        api = MockApi(totals={"module": 300}, latency=0.001, limit=50)
+        with ThreadedMockServer(api) as server, tempfile.TemporaryDirectory() as folder:
+            for partitions, total in ((None, 300), (2, 200)):
+                api.totals["module"] = total
+                fetcher = DrupalDataFetcher("module", output_folder=folder, partitions=partitions)
+                fetcher.BASE_URL = server.base_url
+                fetcher.run()
+                ids = [int(record["id"]) for record in iter_records(folder)]
+                self.assertEqual(sorted(ids), list(range(1, total + 1)))
+
+    def test_orchestrator(self):
+        api = MockApi(totals={"module": 300, "theme": 120}, latency=0.001, limit=50)
+        with ThreadedMockServer(api) as server, tempfile.TemporaryDirectory() as folder:
+            orchestrator = CrawlOrchestrator([], metrics_folder=folder)
+            orchestrator.fetchers = [
+                DrupalDataFetcher(name, output_folder=f"{folder}/{name}",
+                                  metrics=orchestrator.metrics, partitions=3)
+                for name in ("module", "theme")]
+            for fetcher in orchestrator.fetchers:
+                fetcher.BASE_URL = server.base_url
+            orchestrator.run()
+            for fetcher, total in zip(orchestrator.fetchers, (300, 120)):
+                self.assertEqual(fetcher.manifest.summary()["records"], total)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,26 @@
 import unittest
-from drucom.main import main
+from drucom.main import cli, get_parser, main
+from drucom.orchestrator import round_robin
 
 class TestMain(unittest.TestCase):
     def test_main(self):
         # Example test for the main function
         self.assertIsNone(main())
 
+    def test_fetch_arguments(self):
+        args = get_parser().parse_args(["fetch", "user", "module", "--concurrency", "8", "--resume"])
+        self.assertEqual(args.datasets, ["user", "module"])
+        self.assertEqual(args.concurrency, 8)
+        self.assertTrue(args.resume)
+        self.assertFalse(args.incremental)
+
+    def test_unknown_dataset(self):
+        with self.assertRaises(SystemExit) as e:
+            cli(["fetch", "nope"])
+        self.assertEqual(e.exception.code, 1)
+
+    def test_round_robin(self):
+        self.assertEqual(list(round_robin([1, 2, 3], [], ["a"], "xy")), [1, "a", "x", 2, "y", 3])
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+
+from drucom.DrupalDataFetcher import DrupalDataFetcher
+from drucom.benchmarks.synthetic import make_page
+from drucom.manifest import CrawlManifest
+
+
+class FlakyFetcher(DrupalDataFetcher):
+    """
+    A fetcher serving synthetic pages, failing the pages listed in `failing`.
+    """
+
+    def __init__(self, output_folder, failing=()):
+        super().__init__("theme", output_folder=output_folder)
+        self.failing = set(failing)
+        self.requested = []
+
+    def get_total_pages(self, url, params):
+        return 100
+
+    async def fetch_page(self, client, url, params, page, decoder=None):
+        self.requested.append(page)
+        if page in self.failing:
+            self.failed_pages += 1
+            return None
+        return make_page("theme", page, limit=5)
+
+
+class TestCrawlManifest(unittest.TestCase):
+    def test_resume_only_fetches_missing_pages(self):
+        with tempfile.TemporaryDirectory() as folder:
+            fetcher = FlakyFetcher(folder, failing=range(90, 100))
+            fetcher.process("url", {})
+            self.assertEqual(fetcher.verify(), list(range(90, 100)))
+            self.assertEqual(fetcher.manifest.summary()["failed"], 10)
+
+            # A new process resumes from the manifest on disk.
+            fetcher = FlakyFetcher(folder)
+            fetcher.process("url", {}, resume=True)
+            self.assertEqual(sorted(fetcher.requested), list(range(90, 100)))
+            self.assertEqual(fetcher.verify(), [])
+            self.assertEqual(fetcher.manifest.summary()["records"], 500)
+
+            # Pages removed from disk are reported as gaps.
+            os.remove(os.path.join(folder, "page_3.json"))
+            self.assertEqual(fetcher.verify(), [3])
+
+    def test_unflushed_units_are_fetched_again(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "manifest.json")
+            manifest = CrawlManifest(path, flush_every=4)
+            manifest.reset(url="url")
+            for unit in range(3):
+                manifest.start(unit)
+                manifest.done(unit, 10)
+            # Crash: the last update was never flushed.
+            manifest = CrawlManifest(path)
+            self.assertEqual(list(manifest.todo(range(4))), [2, 3])
+            self.assertEqual(manifest.meta["url"], "url")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import datetime
+import json
+import os
+import tempfile
+import unittest
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from drucom.DrupalDataFetcher import DrupalDataFetcher
+from drucom.DrupalDataMerger import DrupalDataMerger
+from drucom.benchmarks.synthetic import make_page
+from drucom.schema import SCHEMAS, is_derived, normalize
+from drucom.transform import MappingTransformer
+
+
+def write_pages(folder, dataset, pages, limit=50):
+    transformer = MappingTransformer(DrupalDataFetcher.get_mapping(dataset))
+    records = []
+    for page in range(pages):
+        page_records = transformer.transform(make_page(dataset, page, limit=limit)["list"])
+        with open(os.path.join(folder, f"page_{page}.json"), "w") as f:
+            json.dump(page_records, f)
+        records += page_records
+    return records
+
+
+class TestSchema(unittest.TestCase):
+    def test_schemas_match_mappings(self):
+        for name, schema in SCHEMAS.items():
+            mapped = [field.name for field in schema if not is_derived(field)]
+            self.assertEqual(mapped, list(DrupalDataFetcher.get_mapping(name)), name)
+
+    def test_normalize(self):
+        batch = normalize([
+            {"id": "12", "created": "1500000000", "mentors": ["3", "x"], "events": [{"id": "7"}],
+             "languages": ["French"], "countries": None},
+            {"id": "13", "title": 5, "industries": {"a": 1}},
+        ], SCHEMAS["user"])
+        rows = batch.to_pylist()
+        self.assertEqual(rows[0]["id"], 12)
+        self.assertEqual(rows[0]["created"], datetime.datetime(2017, 7, 14, 2, 40))
+        self.assertEqual(rows[0]["mentors"], [3])
+        self.assertEqual(rows[0]["events"], [7])
+        self.assertIsNone(rows[0]["countries"])
+        self.assertEqual(rows[1]["title"], "5")
+        self.assertEqual(rows[1]["industries"], ['{"a":1}'])
+        self.assertEqual(rows[1]["mentors"], [])
+
+    def test_derived_columns(self):
+        timezones = ["Europe/Paris", None, "America/Argentina/Buenos_Aires", "", "UTC", "Europe/Berlin"]
+        batch = normalize([{"id": "1", "timezone": timezone} for timezone in timezones], SCHEMAS["user"])
+        self.assertEqual(batch.column("region").to_pylist(),
+                         ["Europe", None, "America", None, "UTC", "Europe"])
+        self.assertEqual(batch.column("city").to_pylist(),
+                         ["Paris", None, "Buenos_Aires", None, "UTC", "Berlin"])
+        self.assertEqual(batch.column("region").dictionary.to_pylist(), ["Europe", "America", "UTC"])
+        users = pa.Table.from_batches([batch]).to_pandas()
+        self.assertEqual(users["region"].dtype, "category")
+        self.assertEqual(users["timezone"].dtype, "category")
+        self.assertEqual(users["created"].dtype.kind, "M")
+
+
+class TestDrupalDataMerger(unittest.TestCase):
+    def test_merge_dedupes_latest_wins(self):
+        for workers in (1, 2):
+            with self.subTest(workers=workers), tempfile.TemporaryDirectory() as folder:
+                records = write_pages(folder, "module", 7)
+                # An overlapping page and a delta updating two records.
+                with open(os.path.join(folder, "page_7.json"), "w") as f:
+                    json.dump(records[340:], f)
+                with open(os.path.join(folder, "delta_0.json"), "w") as f:
+                    json.dump([{**records[0], "title": "New"}, {**records[200], "stars": 999}], f)
+
+                output = os.path.join(folder, "module.parquet")
+                merger = DrupalDataMerger("module", folder, output, workers=workers, row_group_size=100)
+                self.assertEqual(merger.merge_data(), 350)
+
+                parquet = pq.ParquetFile(output)
+                self.assertEqual(parquet.schema_arrow, SCHEMAS["module"])
+                self.assertEqual(parquet.metadata.num_row_groups, 3)
+                table = parquet.read()
+                rows = {row["id"]: row for row in table.to_pylist()}
+                self.assertEqual(sorted(rows), list(range(1, 351)))
+                self.assertEqual(rows[1]["title"], "New")
+                self.assertEqual(rows[201]["stars"], 999)
+                self.assertEqual(rows[2]["title"], records[1]["title"])
+
+    def test_missing_pages(self):
+        with tempfile.TemporaryDirectory() as folder:
+            with self.assertRaises(FileNotFoundError):
+                DrupalDataMerger("theme", folder, os.path.join(folder, "theme.parquet")).merge_data()
+
+
+if __name__ == "__main__":
+    unittest.main()
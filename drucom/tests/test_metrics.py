@@ -0,0 +1,76 @@
+import json
+import os
+import tempfile
+import unittest
+
+from drucom.DrupalDataFetcher import DrupalDataFetcher
+from drucom.benchmarks.mock_server import MockApi, ThreadedMockServer
+from drucom.metrics import Histogram, Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_quantiles(self):
+        histogram = Histogram(buckets=(1, 2, 3, 4))
+        for value in (0.5, 1.5, 1.5, 2.5, 3.5, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [1, 2, 1, 1, 1])
+        self.assertEqual(histogram.quantile(0.5), 2.0)
+        self.assertEqual(histogram.quantile(1.0), 10)
+        self.assertIsNone(Histogram().quantile(0.5))
+
+    def test_prometheus_textfile(self):
+        metrics = Metrics(dataset="user")
+        metrics.inc("requests_total", status=200)
+        metrics.inc("requests_total", 2, status=200)
+        metrics.set("concurrency_limit", 16)
+        metrics.observe("request_seconds", 0.2)
+        text = metrics.prometheus()
+        self.assertIn("# TYPE drucom_requests_total counter", text)
+        self.assertIn('drucom_requests_total{dataset="user",status="200"} 3', text)
+        self.assertIn('drucom_concurrency_limit{dataset="user"} 16', text)
+        self.assertIn('drucom_request_seconds_bucket{dataset="user",le="0.25"} 1', text)
+        self.assertIn('drucom_request_seconds_bucket{dataset="user",le="+Inf"} 1', text)
+        self.assertIn('drucom_request_seconds_count{dataset="user"} 1', text)
+
+    def test_mixed_label_types(self):
+        metrics = Metrics()
+        metrics.inc("requests_total", status=200)
+        metrics.inc("requests_total", status="ClientConnectorError")
+        self.assertIn('drucom_requests_total{status="ClientConnectorError"} 1', metrics.prometheus())
+        self.assertEqual(metrics.summary()["counters"]['requests_total{status="200"}'], 1)
+        self.assertEqual(metrics.value("requests_total", status=200), 1)
+        with tempfile.TemporaryDirectory() as folder:
+            metrics.write(folder)
+
+    def test_profiled_phase(self):
+        with tempfile.TemporaryDirectory() as folder:
+            metrics = Metrics(profile_folder=folder)
+            with metrics.phase("transform"):
+                sum(range(1000))
+            self.assertTrue(os.path.exists(os.path.join(folder, "transform.prof")))
+            self.assertGreater(metrics.value("phase_peak_bytes", phase="transform"), 0)
+            self.assertGreater(metrics.value("phase_seconds", phase="transform"), 0)
+
+    def test_crawl_records_metrics(self):
+        api = MockApi(totals={"theme": 450}, latency=0.001, error_rate=0.2, seed=1)
+        with ThreadedMockServer(api) as server, tempfile.TemporaryDirectory() as folder:
+            fetcher = DrupalDataFetcher("theme", output_folder=folder)
+            fetcher.BASE_URL = server.base_url
+            fetcher.run()
+            with open(os.path.join(folder, "metrics.json")) as f:
+                summary = json.load(f)
+            self.assertTrue(os.path.exists(os.path.join(folder, "metrics.prom")))
+
+        counters = summary["counters"]
+        self.assertEqual(counters['records_total{dataset="theme"}'], 450)
+        self.assertEqual(counters['pages_total{dataset="theme",status="saved"}'], 5)
+        self.assertEqual(sum(v for k, v in counters.items() if k.startswith("requests_total")),
+                         api.requests)
+        self.assertEqual(sum(v for k, v in counters.items() if k.startswith("retries_total")),
+                         counters.get('requests_total{status="500"}', 0))
+        self.assertEqual(summary["histograms"]['transform_seconds{dataset="theme"}']["count"], 5)
+        self.assertIn('queue_depth{queue="pending"}', summary["histograms"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import json
+import os
+import tempfile
+import unittest
+
+from drucom.DrupalDataFetcher import DrupalDataFetcher
+from drucom.benchmarks.mock_server import MockApi, ThreadedMockServer
+from drucom.sync import iter_records
+
+
+class TestMockServerCrawl(unittest.TestCase):
+    def crawl(self, dataset, api, folder):
+        with ThreadedMockServer(api) as server:
+            fetcher = DrupalDataFetcher(dataset, output_folder=folder)
+            fetcher.BASE_URL = server.base_url
+            fetcher.run()
+        return fetcher
+
+    def test_crawl_fetches_every_record(self):
+        api = MockApi(totals={"module": 1234}, latency=0.001, error_rate=0.05)
+        with tempfile.TemporaryDirectory() as folder:
+            fetcher = self.crawl("module", api, folder)
+            ids = sorted(int(record["id"]) for record in iter_records(folder))
+            self.assertEqual(ids, list(range(1, 1235)))
+            self.assertEqual(fetcher.verify(), [])
+
+    def test_comment_crawl_counts_every_comment(self):
+        api = MockApi(totals={"comment": 250}, latency=0.001)
+        with tempfile.TemporaryDirectory() as folder:
+            self.crawl("comment", api, folder)
+            with open(os.path.join(folder, "counts.json")) as f:
+                counts = json.load(f)
+        self.assertEqual(sum(row["total"] for row in counts.values()), 250)
+
+
+if __name__ == "__main__":
+    unittest.main()
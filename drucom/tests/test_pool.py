@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+import unittest
+
+import pyarrow.parquet as pq
+
+from drucom.DrupalDataFetcher import DrupalDataFetcher
+from drucom.benchmarks.mock_server import MockApi, ThreadedMockServer
+from drucom.benchmarks.synthetic import make_page
+from drucom.codec import dumpb, loads
+from drucom.pool import PageJob, TransformPool, process_page
+from drucom.sync import iter_records
+from drucom.transform import MappingTransformer
+
+
+class TestProcessPage(unittest.TestCase):
+    def test_matches_the_event_loop_transform(self):
+        page = make_page("user", 3, limit=40)
+        mapping = DrupalDataFetcher.get_mapping("user")
+        for backend in MappingTransformer.BACKENDS:
+            job = PageJob("user", mapping, backend, dumpb, "created")
+            result = process_page(job, dumpb(page))
+            self.assertEqual(result.count, 40)
+            self.assertEqual(result.seen, max(int(item["created"]) for item in page["list"]))
+            self.assertEqual(loads(result.data),
+                             MappingTransformer(mapping, backend).transform(page["list"]))
+
+
+class TestPoolCrawl(unittest.TestCase):
+    def crawl(self, dataset, api, folder, pool, sink="json"):
+        with ThreadedMockServer(api) as server:
+            fetcher = DrupalDataFetcher(dataset, output_folder=folder, sink=sink, pool=pool)
+            fetcher.BASE_URL = server.base_url
+            fetcher.run()
+        return fetcher
+
+    def test_thread_and_process_pools(self):
+        api = MockApi(totals={"module": 530}, latency=0.001, limit=50)
+        for mode in TransformPool.MODES:
+            with self.subTest(mode=mode), tempfile.TemporaryDirectory() as folder, \
+                    TransformPool(mode, workers=2) as pool:
+                fetcher = self.crawl("module", api, folder, pool)
+                ids = sorted(int(record["id"]) for record in iter_records(folder))
+                self.assertEqual(ids, list(range(1, 531)))
+                self.assertEqual(fetcher.verify(), [])
+                # The high-water mark is observed in the workers.
+                self.assertIsNotNone(fetcher.sync_state.mark)
+
+    def test_process_pool_to_parquet_with_reducer(self):
+        api = MockApi(totals={"comment": 320}, latency=0.001, limit=50)
+        with tempfile.TemporaryDirectory() as folder, TransformPool("process", workers=2) as pool:
+            self.crawl("comment", api, folder, pool, sink="parquet")
+            self.assertEqual(pq.read_table(os.path.join(folder, "parquet")).num_rows, 320)
+            with open(os.path.join(folder, "counts.json")) as f:
+                counts = json.load(f)
+        self.assertEqual(sum(row["total"] for row in counts.values()), 320)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            TransformPool("fork")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import json
+import os
+import tempfile
+import unittest
+
+from drucom.DrupalDataFetcher import DrupalDataFetcher
+from drucom.benchmarks.synthetic import make_page
+
+
+class CommentFetcher(DrupalDataFetcher):
+    """
+    A fetcher serving synthetic comment pages, failing the pages listed in `failing`.
+    """
+
+    def __init__(self, output_folder, failing=()):
+        super().__init__("comment", output_folder=output_folder)
+        self.failing = set(failing)
+
+    def get_total_pages(self, url, params):
+        return 30
+
+    async def fetch_page(self, client, url, params, page, decoder=None):
+        if page in self.failing:
+            self.failed_pages += 1
+            return None
+        return make_page("comment", page, limit=50)
+
+
+class TestCommentCounter(unittest.TestCase):
+    def test_counts_are_exact_across_resumed_crawls(self):
+        expected = {}
+        for page in range(30):
+            for item in make_page("comment", page, limit=50)["list"]:
+                total, first, last = expected.get(item["author"]["id"], (0, None, None))
+                created = int(item["created"])
+                expected[item["author"]["id"]] = (
+                    total + 1, min(first or created, created), max(last or created, created))
+
+        with tempfile.TemporaryDirectory() as folder:
+            fetcher = CommentFetcher(folder, failing=range(20, 30))
+            fetcher.process("url", {})
+            fetcher = CommentFetcher(folder)
+            fetcher.process("url", {}, resume=True)
+            fetcher.finish()
+            with open(os.path.join(folder, "counts.json")) as f:
+                counts = json.load(f)
+
+        self.assertEqual(
+            {uid: (row["total"], row["first"], row["last"]) for uid, row in counts.items()},
+            expected)
+        self.assertEqual(sum(row["total"] for row in counts.values()), 1500)
+
+
+if __name__ == "__main__":
+    unittest.main()
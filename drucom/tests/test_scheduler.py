@@ -0,0 +1,50 @@
+import asyncio
+import unittest
+
+from drucom.scheduler import PagePipeline
+
+
+class TestPagePipeline(unittest.TestCase):
+    def test_all_units_processed_with_bounded_in_flight(self):
+        alive = set()
+        peak = 0
+        saved = []
+
+        async def fetch(unit):
+            nonlocal peak
+            alive.add(unit)
+            peak = max(peak, len(alive))
+            await asyncio.sleep(0)
+            if unit % 10 == 0:
+                alive.discard(unit)
+                return None
+            return {"page": unit}
+
+        async def process(unit, result):
+            # A slow writer must not let fetched pages pile up.
+            await asyncio.sleep(0.001)
+            saved.append(result["page"])
+            alive.discard(unit)
+
+        async def run():
+            pipeline = PagePipeline(fetch, process, fetch_workers=4, max_pending=2)
+            return await pipeline.run(iter(range(200)))
+
+        processed = asyncio.run(run())
+        self.assertEqual(processed, 180)
+        self.assertEqual(sorted(saved), [unit for unit in range(200) if unit % 10])
+        self.assertLessEqual(peak, 4 + 2 + 1)
+
+    def test_process_error_stops_pipeline(self):
+        async def fetch(unit):
+            return unit + 1
+
+        async def process(unit, result):
+            raise RuntimeError("disk full")
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(PagePipeline(fetch, process, fetch_workers=3).run(range(100)))
+
+
+if __name__ == "__main__":
+    unittest.main()
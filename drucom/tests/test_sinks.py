@@ -0,0 +1,182 @@
+import asyncio
+import json
+import os
+import pickle
+import tempfile
+import unittest
+
+import pyarrow.parquet as pq
+
+from drucom.DrupalDataFetcher import DrupalDataFetcher
+from drucom.benchmarks.synthetic import make_page
+from drucom.schema import SCHEMAS, normalize
+from drucom.sinks import JsonPageSink, NdjsonSink, ParquetSink, make_sink
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def make_records(page, count=10):
+    return [{"id": str(page * 100 + index), "author": str(index % 3), "node": "1",
+             "created": str(1500000000 + index)} for index in range(count)]
+
+
+def write_pages(sink, pages):
+    async def write():
+        for page in pages:
+            await sink.write(page, make_records(page))
+    asyncio.run(write())
+
+
+class SinkFetcher(DrupalDataFetcher):
+    """
+    A fetcher serving synthetic pages, failing the pages listed in `failing`.
+    """
+
+    def __init__(self, dataset_name, output_folder, sink, failing=()):
+        super().__init__(dataset_name, output_folder=output_folder, sink=sink)
+        self.failing = set(failing)
+
+    def get_total_pages(self, url, params):
+        return 12
+
+    async def fetch_page(self, client, url, params, page, decoder=None):
+        if page in self.failing:
+            self.failed_pages += 1
+            return None
+        return make_page(self.dataset_name, page, limit=20)
+
+
+class TestPartSinks(unittest.TestCase):
+    def check_round_trip(self, sink, folder):
+        write_pages(sink, range(5))
+        sink.close()
+        self.assertTrue(all(sink.exists(page) for page in range(5)))
+        pages = dict(sink.read([1, 3]))
+        self.assertEqual(sorted(pages), [1, 3])
+        self.assertEqual([int(record["id"]) for record in pages[3]], list(range(300, 310)))
+        # A new sink on the same folder finds the complete parts.
+        self.assertTrue(type(sink)(**self.options(sink, folder)).exists(4))
+
+    def options(self, sink, folder):
+        if isinstance(sink, ParquetSink):
+            return {"folder": folder, "dataset_name": "comment", "rotate_size": sink.rotate_size}
+        return {"folder": folder, "compress": sink.compress, "rotate_size": sink.rotate_size}
+
+    def test_ndjson_rotates_parts(self):
+        with tempfile.TemporaryDirectory() as folder:
+            sink = NdjsonSink(folder, rotate_size=1000)
+            self.check_round_trip(sink, folder)
+            self.assertGreater(len(sink.paths()), 1)
+            with open(sink.paths()[0], "rb") as f:
+                self.assertEqual(json.loads(f.readline())["id"], "0")
+
+    @unittest.skipUnless(zstandard, "zstandard is not installed")
+    def test_ndjson_compressed(self):
+        with tempfile.TemporaryDirectory() as folder:
+            sink = NdjsonSink(folder, compress=True, rotate_size=1000)
+            self.check_round_trip(sink, folder)
+            self.assertTrue(sink.paths()[0].endswith(".ndjson.zst"))
+
+    def test_ndjson_derived_fields(self):
+        records = [{"id": "1", "timezone": "Europe/Paris"}, {"id": "2", "timezone": "America/Argentina/Salta"},
+                   {"id": "3", "timezone": ""}, {"id": "4"}, {"id": "5", "timezone": "UTC"}]
+        with tempfile.TemporaryDirectory() as folder:
+            sink = make_sink("ndjson", folder, "user")
+            # The encoder goes to process pools.
+            encode = pickle.loads(pickle.dumps(sink.encode))
+            lines = [json.loads(line) for line in encode(records).splitlines()]
+            expected = normalize(records, SCHEMAS["user"]).to_pydict()
+            self.assertEqual([line["region"] for line in lines], expected["region"])
+            self.assertEqual([line["city"] for line in lines], expected["city"])
+            self.assertNotIn("region", records[0])
+
+    def test_parquet_row_groups(self):
+        with tempfile.TemporaryDirectory() as folder:
+            sink = ParquetSink(folder, "comment", row_group_size=20, rotate_size=30)
+            self.check_round_trip(sink, folder)
+            self.assertEqual([pq.ParquetFile(path).metadata.num_rows for path in sink.paths()],
+                             [30, 20])
+            self.assertEqual(pq.ParquetFile(sink.paths()[0]).metadata.num_row_groups, 2)
+            table = pq.read_table(folder)
+            self.assertEqual(table.num_rows, 50)
+            self.assertEqual(str(table.schema.field("created").type), "int64")
+
+    def test_incomplete_part_is_discarded(self):
+        with tempfile.TemporaryDirectory() as folder:
+            sink = NdjsonSink(folder, rotate_size=1000)
+            write_pages(sink, range(9))
+            # The process dies before the last part is complete.
+            complete = [page for page in range(9) if sink.exists(page)]
+            self.assertLess(len(complete), 9)
+            sink = NdjsonSink(folder, rotate_size=1000)
+            self.assertEqual([page for page in range(9) if sink.exists(page)], complete)
+            self.assertFalse([name for name in os.listdir(folder) if name.endswith(".tmp")])
+            sink.reset()
+            self.assertFalse(sink.exists(0))
+            self.assertEqual(os.listdir(folder), ["_index.json"])
+
+    def test_unknown_sink(self):
+        with tempfile.TemporaryDirectory() as folder:
+            self.assertIsInstance(make_sink("json", folder, "user"), JsonPageSink)
+            with self.assertRaises(ValueError):
+                make_sink("csv", folder, "user")
+
+
+class TestFetcherSinks(unittest.TestCase):
+    def test_parquet_crawl_is_analysis_ready(self):
+        with tempfile.TemporaryDirectory() as folder:
+            fetcher = SinkFetcher("module", folder, "parquet")
+            fetcher.process("url", {})
+            self.assertEqual(fetcher.verify(), [])
+            self.assertFalse([name for name in os.listdir(folder) if name.startswith("page_")])
+            table = pq.read_table(os.path.join(folder, "parquet"))
+            self.assertEqual(table.num_rows, 240)
+            self.assertEqual(table.schema.names, list(fetcher.mapping))
+
+    def test_resume_after_unsaved_manifest(self):
+        with tempfile.TemporaryDirectory() as folder:
+            fetcher = SinkFetcher("module", folder, "ndjson")
+            fetcher.process("url", {})
+            # The crawl dies after the part is rotated, before the manifest is saved.
+            for page in (10, 11):
+                del fetcher.manifest.units[str(page)]
+            fetcher.manifest.flush()
+
+            fetcher = SinkFetcher("module", folder, "ndjson")
+            fetcher.process("url", {}, resume=True)
+            self.assertEqual(fetcher.verify(), [])
+            ids = []
+            for path in fetcher.sink.paths():
+                with open(path) as f:
+                    ids += [json.loads(line)["id"] for line in f]
+            self.assertEqual(len(ids), 240)
+            self.assertEqual(len(set(ids)), 240)
+
+    def test_resumed_counts_from_ndjson(self):
+        with tempfile.TemporaryDirectory() as folder:
+            json_folder = os.path.join(folder, "json")
+            fetcher = SinkFetcher("comment", json_folder, "json")
+            fetcher.process("url", {})
+            fetcher.finish()
+
+            ndjson_folder = os.path.join(folder, "ndjson")
+            fetcher = SinkFetcher("comment", ndjson_folder, "ndjson", failing=range(8, 12))
+            fetcher.process("url", {})
+            self.assertEqual(fetcher.verify(), [8, 9, 10, 11])
+            fetcher = SinkFetcher("comment", ndjson_folder, "ndjson")
+            fetcher.process("url", {}, resume=True)
+            fetcher.finish()
+
+            counts = []
+            for output in (json_folder, ndjson_folder):
+                with open(os.path.join(output, "counts.json")) as f:
+                    counts.append(json.load(f))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(sum(row["total"] for row in counts[1].values()), 240)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,160 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pyarrow.parquet as pq
+
+from drucom.DrupalDataFetcher import DrupalDataFetcher
+from drucom.DrupalDataMerger import DrupalDataMerger
+from drucom.snapshot import HashIndex, Snapshots, hash_records
+from drucom.sync import SyncState, iter_records, list_files
+
+
+class ListFetcher(DrupalDataFetcher):
+    """
+    A fetcher serving raw modules from memory, 10 per page.
+    """
+
+    def __init__(self, items, output_folder, failing=(), **options):
+        super().__init__("module", output_folder=output_folder, **options)
+        self.items = items
+        self.failing = set(failing)
+
+    def get_total_pages(self, url, params):
+        return (len(self.items) + 9) // 10
+
+    async def fetch_page(self, client, url, params, page, decoder=None):
+        if page in self.failing:
+            self.failed_pages += 1
+            return None
+        return {"list": self.items[page * 10:(page + 1) * 10]}
+
+
+def _item(nid, title=None):
+    return {"nid": str(nid), "title": title or f"Module {nid}", "changed": str(1000 + nid)}
+
+
+class TestHashIndex(unittest.TestCase):
+    def test_update_and_lookup(self):
+        ids, hashes = hash_records([{"id": "3", "a": 1}, {"id": "1", "a": 1}, {"id": None}, {"id": "3", "a": 2}])
+        self.assertEqual(ids.tolist(), [3, 1, -1, 3])
+        self.assertEqual(hashes[1], hash_records([{"id": "1", "a": 1}])[1][0])
+
+        index = HashIndex().update(ids, hashes)
+        self.assertEqual(index.ids.tolist(), [1, 3])
+        found, known = index.lookup(np.array([3, 2, 1]))
+        self.assertEqual(found.tolist(), [True, False, True])
+        # The last record of an id wins.
+        self.assertEqual(known[0], hashes[3])
+        self.assertEqual(known[1], 0)
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "hashes.npz")
+            index.remove([1]).save(path)
+            self.assertEqual(HashIndex.load(path).ids.tolist(), [3])
+            self.assertEqual(os.listdir(folder), ["hashes.npz"])
+
+
+class TestSnapshots(unittest.TestCase):
+    def test_full_crawls_write_deltas_of_the_changes(self):
+        with tempfile.TemporaryDirectory() as folder:
+            items = [_item(nid) for nid in range(1, 51)]
+            ListFetcher(items, folder).run()
+            snapshots = Snapshots(folder)
+            self.assertEqual(len(snapshots.index), 50)
+            self.assertEqual([entry["kind"] for entry in snapshots.entries], ["full"])
+            pages = {path: os.stat(path).st_mtime_ns for path in list_files(folder)}
+
+            # One module renamed, one deleted, one added.
+            items[4] = _item(5, "Renamed")
+            del items[9]
+            items.append(_item(51))
+            ListFetcher(items, folder).run()
+            self.assertEqual({path: os.stat(path).st_mtime_ns for path in list_files(folder)
+                              if path in pages}, pages)
+            with open(os.path.join(folder, "delta_1.json")) as f:
+                self.assertEqual(json.load(f), [
+                    {"id": "5", "title": "Renamed", "created": None, "changed": "1005", "author": None, "slug": None,
+                     "stars": 0, "security_status": None, "maintenance_status": None,
+                     "development_status": None, "categories": []},
+                    {"id": "51", "title": "Module 51", "created": None, "changed": "1051", "author": None,
+                     "slug": None, "stars": 0, "security_status": None, "maintenance_status": None,
+                     "development_status": None, "categories": []},
+                    {"id": "10", "_deleted": True},
+                ])
+            entry = Snapshots(folder).entries[-1]
+            self.assertEqual({key: entry[key] for key in ("kind", "delta", "added", "changed", "deleted", "unchanged")},
+                             {"kind": "diff", "delta": "delta_1.json", "added": 1, "changed": 1, "deleted": 1,
+                              "unchanged": 48})
+            self.assertEqual(SyncState(folder, "module").mark, 1051)
+
+            records = {record["id"]: record["title"] for record in iter_records(folder)}
+            self.assertEqual(records, {item["nid"]: item["title"] for item in items})
+            output = os.path.join(folder, "module.parquet")
+            DrupalDataMerger("module", folder, output, workers=1).run()
+            self.assertEqual(sorted(pq.read_table(output, columns=["id"]).column("id").to_pylist()),
+                             sorted(int(item["nid"]) for item in items))
+
+            # Nothing changed: no delta file.
+            ListFetcher(items, folder).run()
+            entry = Snapshots(folder).entries[-1]
+            self.assertEqual((entry["delta"], entry["added"], entry["changed"], entry["deleted"]), (None, 0, 0, 0))
+            self.assertFalse(os.path.exists(os.path.join(folder, "delta_2.json")))
+
+            # Rewriting the pages supersedes the deltas.
+            ListFetcher(items, folder, rewrite=True).run()
+            self.assertFalse([path for path in list_files(folder) if "delta_" in path])
+            self.assertEqual([entry["kind"] for entry in Snapshots(folder).entries], ["full"])
+            self.assertEqual(Snapshots(folder).entries[0]["snapshot"], 4)
+
+    def test_failed_pages_do_not_delete(self):
+        with tempfile.TemporaryDirectory() as folder:
+            items = [_item(nid) for nid in range(1, 31)]
+            ListFetcher(items, folder).run()
+            items[0] = _item(1, "Renamed")
+            ListFetcher(items, folder, failing=[2]).run()
+            # The modules of the failed page are kept.
+            self.assertEqual(len(list(iter_records(folder))), 30)
+            entry = Snapshots(folder).entries[-1]
+            self.assertEqual((entry["changed"], entry["deleted"], entry["complete"]), (1, 0, False))
+            # The high-water mark is not moved after a failure.
+            self.assertEqual(SyncState(folder, "module").mark, 1030)
+
+    def test_resuming_a_comparison_keeps_the_deltas(self):
+        with tempfile.TemporaryDirectory() as folder:
+            items = [_item(nid) for nid in range(1, 51)]
+            ListFetcher(items, folder).run()
+            items[4] = _item(5, "Renamed")
+            ListFetcher(items, folder, failing=[3]).run()
+            self.assertTrue(os.path.exists(os.path.join(folder, "delta_1.json")))
+
+            # The manifest of the full crawl is complete: the pages are compared again.
+            del items[0]
+            ListFetcher(items, folder).run(resume=True)
+            self.assertEqual([os.path.basename(path) for path in list_files(folder) if "delta_" in path],
+                             ["delta_1.json", "delta_2.json"])
+            records = {record["id"]: record["title"] for record in iter_records(folder)}
+            self.assertEqual(records, {item["nid"]: item["title"] for item in items})
+            self.assertEqual([entry["kind"] for entry in Snapshots(folder).entries], ["full", "diff", "diff"])
+            self.assertEqual(Snapshots(folder).entries[-1]["deleted"], 1)
+
+    def test_incremental_sync_skips_unchanged_records(self):
+        with tempfile.TemporaryDirectory() as folder:
+            items = [_item(nid) for nid in range(1, 21)]
+            ListFetcher(items, folder).run()
+            fetcher = ListFetcher(items, folder)
+
+            async def fetch_page(client, url, params, page, decoder=None):
+                # The records at the high-water mark are fetched again.
+                return {"list": [items[-1]]} if page == 0 else {"list": []}
+
+            fetcher.fetch_page = fetch_page
+            fetcher.run(incremental=True)
+            self.assertFalse(os.path.exists(os.path.join(folder, "delta_1.json")))
+            self.assertEqual(Snapshots(folder).entries[-1]["kind"], "incremental")
+
+
+if __name__ == "__main__":
+    unittest.main()
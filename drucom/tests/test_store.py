@@ -0,0 +1,66 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from drucom.DrupalDataMerger import DrupalDataMerger
+from drucom.store import DatasetStore, build_store
+from drucom.tests.test_merger import write_pages
+
+
+class TestDatasetStore(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        data = self.folder.name
+        write_pages(data, "user", 4)
+        self.merged = os.path.join(data, "user.parquet")
+        DrupalDataMerger("user", data, self.merged, workers=1).run()
+        self.store = os.path.join(data, "store")
+        self.rows = build_store("user", self.merged, self.store, row_group_size=10)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_partitions(self):
+        users = pq.read_table(self.merged)
+        self.assertEqual(sum(self.rows.values()), users.num_rows)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.store, "user"))),
+                         [f"year={year}" for year in sorted(self.rows)])
+        # Building again replaces the dataset.
+        self.assertEqual(build_store("user", self.merged, self.store), self.rows)
+
+    def test_query(self):
+        store = DatasetStore(self.store)
+        users = pq.read_table(self.merged).to_pandas()
+        since = datetime.datetime(2001, 9, 9, 2, 0)
+        expected = users[(users["created"] >= since) & (users["region"] == "Europe")]
+
+        table = store.query("user", columns=["id", "region", "languages"],
+                            since="2001-09-09T02:00:00", where={"region": "Europe"})
+        self.assertEqual(sorted(table.column("id").to_pylist()), sorted(expected["id"]))
+        self.assertEqual(table.column_names, ["id", "region", "languages"])
+        self.assertTrue(pa.types.is_dictionary(table.schema.field("region").type))
+        self.assertEqual(table.schema.field("languages").type, pa.list_(pa.dictionary(pa.int32(), pa.string())))
+
+        frame = store.to_pandas("user", columns=["id"], where={"region": ["Asia", "America"]}, until=2001)
+        self.assertEqual(len(frame), 0)
+        with self.assertRaises(FileNotFoundError):
+            store.query("event")
+
+    def test_pushdown(self):
+        store = DatasetStore(self.store)
+        everything = store.explain("user")
+        europe = store.explain("user", where={"region": "Europe"})
+        self.assertEqual(europe["files"], everything["files"])
+        self.assertLess(europe["row_groups"], everything["row_groups"] / 2)
+        since = store.explain("user", since=2001, where={"region": "Europe"})
+        self.assertEqual(since["row_groups"], europe["row_groups"])
+        none = store.explain("user", since=2030)
+        self.assertEqual((none["files"], none["row_groups"]), (0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
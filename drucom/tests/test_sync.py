@@ -0,0 +1,91 @@
+import os
+import json
+import asyncio
+import tempfile
+import unittest
+
+from drucom.DrupalDataFetcher import DrupalDataFetcher
+from drucom.cache import ResponseCache
+from drucom.sync import SyncState, iter_records
+
+
+class FakeFetcher(DrupalDataFetcher):
+    """
+    A fetcher serving raw items from memory instead of the API.
+    """
+
+    def __init__(self, items, output_folder, limit=10):
+        super().__init__("module", output_folder=output_folder)
+        self.items = items
+        self.limit = limit
+        self.requested = []
+
+    async def fetch_page(self, client, url, params, page, decoder=None):
+        self.requested.append(page)
+        reverse = params['direction'] == 'DESC'
+        items = sorted(self.items, key=lambda item: int(item[params['sort']]), reverse=reverse)
+        data = {"list": items[page * self.limit:(page + 1) * self.limit]}
+        if (page + 1) * self.limit < len(items):
+            data["next"] = f"page={page + 1}"
+        return data
+
+
+def _item(nid, changed):
+    return {"nid": str(nid), "title": f"Module {nid}", "changed": str(changed)}
+
+
+class TestIncrementalSync(unittest.TestCase):
+    def test_only_changed_records_are_fetched_and_merged(self):
+        with tempfile.TemporaryDirectory() as folder:
+            with open(f"{folder}/page_0.json", "w") as f:
+                json.dump([{"id": str(nid), "title": f"Module {nid}"} for nid in range(100)], f)
+            state = SyncState(folder, "module")
+            state.observe([_item(nid, 1000 + nid) for nid in range(100)])
+            state.commit(full=True)
+
+            items = [_item(nid, 1000 + nid) for nid in range(100)]
+            items[5] = {**_item(5, 5000), "title": "Renamed"}
+            items.append(_item(100, 6000))
+            fetcher = FakeFetcher(items, folder)
+            self.assertEqual(asyncio.run(fetcher.fetch_changed_pages("", {"sort": "nid"})), 3)
+            fetcher.sync_state.commit()
+
+            # Only the first pages are requested, not the whole dataset.
+            self.assertLess(max(fetcher.requested), 5)
+            self.assertEqual(SyncState(folder, "module").mark, 6000)
+            records = {record["id"]: record for record in iter_records(folder)}
+            self.assertEqual(len(records), 101)
+            self.assertEqual(records["5"]["title"], "Renamed")
+
+    def test_full_commit_removes_deltas(self):
+        with tempfile.TemporaryDirectory() as folder:
+            state = SyncState(folder, "user")
+            with open(state.next_delta_file(), "w") as f:
+                json.dump([], f)
+            state.commit(full=True)
+            self.assertEqual(list(iter_records(folder)), [])
+            self.assertEqual(state.deltas, 0)
+
+    def test_failed_discovery_keeps_deltas(self):
+        with tempfile.TemporaryDirectory() as folder:
+            state = SyncState(folder, "user")
+            state.observe([{"created": "1000"}])
+            with open(state.next_delta_file(), "w") as f:
+                json.dump([{"id": "1"}], f)
+            state.commit()
+
+            # Every request misses the offline cache.
+            cache = ResponseCache(os.path.join(folder, "cache"), offline=True)
+            fetcher = DrupalDataFetcher("user", output_folder=folder, cache=cache)
+            fetcher.run()
+            self.assertEqual(fetcher.failed_pages, 1)
+            self.assertTrue(os.path.exists(os.path.join(folder, "delta_1.json")))
+            self.assertEqual(SyncState(folder, "user").deltas, 1)
+
+    def test_unsupported_dataset(self):
+        with self.assertRaises(ValueError):
+            SyncState(tempfile.gettempdir(), "module_terms")
+
+
+if __name__ == "__main__":
+    unittest.main()
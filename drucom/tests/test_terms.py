@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from drucom.DrupalDataMerger import DrupalDataMerger
+from drucom.benchmarks.mock_server import MockApi, ThreadedMockServer
+from drucom.schema import SCHEMAS, normalize
+from drucom.terms import TERMS_SCHEMA, TermIndex, TermResolver, fetch_terms
+from drucom.tests.test_merger import write_pages
+
+
+def terms_table(rows):
+    return pa.Table.from_pylist([dict(zip(("id", "vocabulary", "name"), row)) for row in rows],
+                                schema=TERMS_SCHEMA)
+
+
+class FakeFetch:
+    """
+    Fetch terms from a dict, recording the ids requested.
+    """
+
+    def __init__(self, terms):
+        self.terms = terms
+        self.requests = []
+
+    def __call__(self, ids, batch_size):
+        self.requests.append(list(ids))
+        return terms_table([(term_id, 3, self.terms[term_id]) for term_id in ids if term_id in self.terms])
+
+
+class TestTermIndex(unittest.TestCase):
+    def test_lookup(self):
+        index = TermIndex.from_table(terms_table([(13028, 44, "Old"), (53, 3, "Admin"), (13028, 44, "Actively maintained")]))
+        self.assertEqual(index.ids.tolist(), [53, 13028])
+        self.assertEqual(index.name(13028), "Actively maintained")
+        self.assertEqual(index.vocabulary(53), 3)
+        self.assertIsNone(index.name(1))
+        self.assertEqual(index.missing([1, 53, 1, 2]).tolist(), [1, 2])
+        names = index.lookup(pa.array([53, None, 7, 53]))
+        self.assertEqual(names.to_pylist(), ["Admin", None, None, "Admin"])
+        self.assertEqual(names.dictionary.to_pylist(), ["Admin"])
+
+    def test_save_and_load(self):
+        index = TermIndex.from_table(terms_table([(53, 3, "Admin"), (54, 3, "Media")]))
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "terms.arrow")
+            index.save(path)
+            loaded = TermIndex.load(path)
+            self.assertEqual(loaded.ids.tolist(), [53, 54])
+            self.assertEqual(loaded.name(54), "Media")
+            TermIndex.empty().save(path)
+            self.assertEqual(len(TermIndex.load(path)), 0)
+
+
+class TestTermResolver(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.data = self.folder.name
+        pq.write_table(pa.Table.from_batches([normalize([
+            {"id": "53", "name": "Admin", "vocabulary": "3"},
+            {"id": "13028", "name": "Actively maintained", "vocabulary": "44"},
+        ], SCHEMAS["module_terms"])]), os.path.join(self.data, "module_terms.parquet"))
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_resolve_fetches_unknown_ids_once(self):
+        fetch = FakeFetch({60: "Media", 9988: "Under active development"})
+        resolver = TermResolver(self.data, fetch=fetch)
+        batch = normalize([
+            {"id": "1", "maintenance_status": "13028", "development_status": "9988", "categories": ["53", "60"]},
+            {"id": "2", "development_status": "404", "categories": []},
+            {"id": "3", "maintenance_status": "13028", "categories": ["404", "53"]},
+        ], SCHEMAS["module"])
+        rows = resolver.resolve(batch, "module").to_pylist()
+        self.assertEqual(fetch.requests, [[60, 404, 9988]])
+        self.assertEqual([row["maintenance_status_name"] for row in rows], ["Actively maintained", None, "Actively maintained"])
+        self.assertEqual([row["development_status_name"] for row in rows], ["Under active development", None, None])
+        self.assertEqual([row["category_names"] for row in rows], [["Admin", "Media"], [], [None, "Admin"]])
+
+        # Terms fetched are cached, unknown ids are not requested again.
+        resolver.resolve(batch, "module")
+        self.assertEqual(fetch.requests, [[60, 404, 9988]])
+        self.assertEqual(TermResolver(self.data, fetch=None).index.name(60), "Media")
+
+    def test_merge_resolves_terms(self):
+        write_pages(self.data, "theme", 2)
+        output = os.path.join(self.data, "theme.parquet")
+        DrupalDataMerger("theme", self.data, output, workers=1, terms=TermResolver(self.data, fetch=None)).run()
+        table = pq.read_table(output)
+        self.assertEqual(table.schema.field("maintenance_status_name").type, pa.dictionary(pa.int32(), pa.string()))
+        statuses = dict(zip(table.column("maintenance_status").to_pylist(),
+                            table.column("maintenance_status_name").to_pylist()))
+        self.assertEqual(statuses[13028], "Actively maintained")
+        self.assertIsNone(statuses[9990])
+
+    def test_fetch_terms(self):
+        with ThreadedMockServer(MockApi(totals={"module_terms": 100}, latency=0.0)) as server:
+            table = fetch_terms([5, 99, 3, 1000], batch_size=2, base_url=server.base_url)
+        self.assertEqual(TermIndex.from_table(table).ids.tolist(), [3, 5, 99])
+        self.assertEqual(TermIndex.from_table(table).name(99), "Term 99")
+
+
+if __name__ == "__main__":
+    unittest.main()
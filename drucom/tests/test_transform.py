@@ -0,0 +1,54 @@
+import random
+import unittest
+
+from drucom.DrupalDataFetcher import DrupalDataFetcher
+from drucom.benchmarks.synthetic import DATASETS, make_page
+from drucom.transform import MappingTransformer, compile_expression
+
+
+def _run(transformer, items):
+    try:
+        return transformer.transform(items)
+    except ValueError:
+        return ValueError
+
+
+class TestMappingTransformer(unittest.TestCase):
+    def test_backends_are_equivalent_on_synthetic_pages(self):
+        for dataset in DATASETS:
+            mapping = DrupalDataFetcher.get_mapping(dataset)
+            jq_backend = MappingTransformer(mapping, "jq")
+            python_backend = MappingTransformer(mapping, "python")
+            for page in range(5):
+                items = make_page(dataset, page, limit=50)["list"]
+                with self.subTest(dataset=dataset, page=page):
+                    self.assertEqual(jq_backend.transform(items), python_backend.transform(items))
+
+    def test_backends_are_equivalent_on_edge_cases(self):
+        values = [None, False, True, 0, 7, -2.5, "", "Europe/Paris", "UTC", "a/b/c",
+                  [], ["x", 1, None, True], [{"id": "12"}, {"id": 3}, {}], {}, {"id": "9"},
+                  {"url": "https://x", "value": "1", "locality": "Paris"}, [{"id": None}], "x"]
+        rng = random.Random(42)
+        for dataset in DATASETS:
+            mapping = DrupalDataFetcher.get_mapping(dataset)
+            jq_backend = MappingTransformer(mapping, "jq")
+            python_backend = MappingTransformer(mapping, "python")
+            for item in make_page(dataset, 0, limit=200)["list"]:
+                key = rng.choice(list(item))
+                item[key] = rng.choice(values)
+                with self.subTest(dataset=dataset, key=key, value=item[key]):
+                    self.assertEqual(_run(jq_backend, [item]), _run(python_backend, [item]))
+
+    def test_empty_page(self):
+        mapping = DrupalDataFetcher.get_mapping("user")
+        self.assertEqual(MappingTransformer(mapping, "python").transform([]), [])
+
+    def test_unknown_backend_and_expression(self):
+        with self.assertRaises(ValueError):
+            MappingTransformer({}, "rust")
+        with self.assertRaises(ValueError):
+            compile_expression(".a | ascii_downcase")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,204 @@
+import re
+import json
+
+
+class MappingTransformer:
+    """
+    A class to transform raw Drupal API items with a dataset mapping.
+
+    The mapping is compiled once when the transformer is created and whole
+    pages of items are transformed in a single call.
+
+    Two backends are available:
+    - `jq` runs the mapping as one `map({...})` jq program per page.
+    - `python` compiles each jq expression to a plain Python accessor.
+      It only understands the jq idioms used in `DrupalDataFetcher.get_mapping`
+      and produces the same output (and the same errors) as jq does.
+    """
+
+    BACKENDS = ("jq", "python")
+
+    def __init__(self, mapping, backend="jq"):
+        """
+        Initialize the transformer and compile the mapping.
+        Args:
+            mapping (dict): The dataset mapping (output key -> jq filter).
+            backend (str): The backend to use, either `jq` or `python`.
+        Raises:
+            ValueError: If the backend is unknown or the mapping cannot be compiled.
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown transform backend: {backend}")
+        self.mapping = mapping
+        self.backend = backend
+        if backend == "jq":
+            import jq
+            self._program = jq.compile(f"map({build_filter(mapping)})")
+        else:
+            self._accessors = [
+                (key, compile_expression(value)) for key, value in mapping.items()
+            ]
+
+    def transform(self, items):
+        """
+        Transform a list of raw items.
+        Args:
+            items (list): Raw items, usually the `list` of an API page.
+        Returns:
+            list: The transformed items.
+        """
+        if not items:
+            return []
+        if self.backend == "jq":
+            return self._program.input_value(items).first()
+        accessors = self._accessors
+        return [{key: accessor(item) for key, accessor in accessors} for item in items]
+
+
+def build_filter(mapping):
+    """
+    Build the jq object filter for a mapping, e.g. `{"id": .uid, ...}`.
+    Args:
+        mapping (dict): The dataset mapping.
+    Returns:
+        str: The jq filter string.
+    """
+    return '{' + ', '.join(
+        [f'"{key}": {value}' for key, value in mapping.items()]) + '}'
+
+
+# Python equivalents of the jq builtins used by the mappings.
+# Errors are raised as ValueError, like the jq bindings do.
+
+def _type(value):
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, list):
+        return "array"
+    return "object"
+
+
+def _index(value, key):
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return value.get(key)
+    raise ValueError(f'Cannot index {_type(value)} with string ("{key}")')
+
+
+def _path(value, keys):
+    for key in keys:
+        value = _index(value, key)
+    return value
+
+
+def _length(value):
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        raise ValueError(f"boolean ({json.dumps(value)}) has no length")
+    if isinstance(value, (int, float)):
+        return abs(value)
+    return len(value)
+
+
+def _tostring(value):
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+def _iterate(value):
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict):
+        return list(value.values())
+    raise ValueError(f"Cannot iterate over {_type(value)}")
+
+
+def _join(value, separator):
+    parts = []
+    for item in _iterate(value):
+        if item is None:
+            parts.append("")
+        elif isinstance(item, bool):
+            parts.append("true" if item else "false")
+        elif isinstance(item, (int, float, str)):
+            parts.append(_tostring(item))
+        else:
+            raise ValueError(f"Cannot join with {_type(item)}")
+    return separator.join(parts)
+
+
+def _truthy(value):
+    return value is not None and value is not False
+
+
+_PATH = r"((?:\.\w+)+)"
+_FIELD = r"\.(\w+)"
+
+# Each pattern matches one jq idiom and returns an accessor factory.
+_PATTERNS = [
+    # .uid, .field_a.value
+    (re.compile(rf"^{_PATH}$"),
+     lambda path: lambda item: _path(item, path)),
+    # (.field // null), (.field // [])
+    (re.compile(rf"^\({_PATH} // (null|\[\])\)$"),
+     lambda path, default: lambda item: (
+         value if _truthy(value := _path(item, path))
+         else (None if default == "null" else []))),
+    # (.field // [] | length // 0)
+    (re.compile(rf"^\({_PATH} // \[\] \| length // 0\)$"),
+     lambda path: lambda item: _length(
+         value if _truthy(value := _path(item, path)) else [])),
+    # (.field // [] | join(""))
+    (re.compile(rf'^\({_PATH} // \[\] \| join\("([^"]*)"\)\)$'),
+     lambda path, sep: lambda item: _join(
+         value if _truthy(value := _path(item, path)) else [], sep)),
+    # (if (.field | type == "array") then .field | map(.id | tostring) else [] end)
+    (re.compile(rf'^\(if \({_FIELD} \| type == "array"\) then \.\1 '
+                rf'\| map\({_FIELD} \| tostring\) else \[\] end\)$'),
+     lambda field, key: lambda item: (
+         [_tostring(_index(value, key)) for value in _index(item, field)]
+         if isinstance(_index(item, field), list) else [])),
+    # (if (.field | type == "object") then .field.key else null end)
+    (re.compile(rf'^\(if \({_FIELD} \| type == "object"\) then \.\1{_FIELD} '
+                rf'else null end\)$'),
+     lambda field, key: lambda item: (
+         _index(_index(item, field), key)
+         if isinstance(_index(item, field), dict) else None)),
+    # (if .field | length > 0 then (.field | tostring | split("/") | first) else null end)
+    (re.compile(rf'^\(if {_FIELD} \| length > 0 then \(\.\1 \| tostring '
+                rf'\| split\("([^"]+)"\) \| (first|last)\) else null end\)$'),
+     lambda field, sep, position: lambda item: (
+         _tostring(value).split(sep)[0 if position == "first" else -1]
+         if _length(value := _index(item, field)) > 0 else None)),
+]
+
+
+def compile_expression(expression):
+    """
+    Compile a mapping jq expression to a Python accessor.
+    Args:
+        expression (str): The jq expression, as found in a mapping.
+    Returns:
+        callable: A function taking a raw item and returning the value.
+    Raises:
+        ValueError: If the expression is not a supported idiom.
+    """
+    expression = expression.strip()
+    for pattern, factory in _PATTERNS:
+        match = pattern.match(expression)
+        if match is None:
+            continue
+        groups = list(match.groups())
+        if groups and groups[0].startswith("."):
+            groups[0] = groups[0][1:].split(".")
+        return factory(*groups)
+    raise ValueError(f"No python accessor for jq expression: {expression}")
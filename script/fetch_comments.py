@@ -1,25 +1,18 @@
 import re
-import sys
-import json
-import pandas as pd
 import asyncio
-import aiohttp
-import aiofiles
-from itertools import islice
 import os
 import time
 
+from drucom.client import FetchError
+from drucom.enrichment import EntityEnricher, load_ids, pack_json_ids
+
 BASE_URL = "https://www.drupal.org/api-d7"
-HEADERS = {
-    'Accept': 'application/json',
-    'Content-Type': 'application/json',
-    'User-Agent': 'Drucom 0.1.0'
-}
 
 
-async def check_comment_total_async(session, uid):
+async def check_comment_total_async(client, uid):
     """
     Asynchronously check the total number of comments for a user ID.
+    The total is None when the request failed after all retries.
     """
     params = {
         'full': 0,
@@ -32,86 +25,72 @@ async def check_comment_total_async(session, uid):
     total = 0
 
     try:
-        async with session.get(f"{BASE_URL}/comment.json", headers=HEADERS, params=params) as response:
-            response.raise_for_status()
-            data = await response.json()
-            last_page_url = data.get('last', '')
-            if last_page_url:
-                match = re.search(r'page=(\d+)', last_page_url)
-                if match:
-                    total = int(match.group(1))
-    except Exception as e:
-        pass
+        data = await client.get_json(f"{BASE_URL}/comment.json", params)
+    except FetchError as e:
+        print(f"Error fetching comments of user {uid}: {e}")
+        return uid, None
+
+    last_page_url = data.get('last', '')
+    if last_page_url:
+        match = re.search(r'page=(\d+)', last_page_url)
+        if match:
+            total = int(match.group(1))
 
     return uid, total
 
 
-def chunked_iterable(iterable, size):
+async def comment_total(client, uid):
     """
-    Yield successive chunks of a given size from an iterable.
+    Look up the comment total of a user, as saved in the block files.
+    The result is None when the request failed after all retries.
     """
-    it = iter(iterable)
-    while chunk := list(islice(it, size)):
-        yield chunk
+    _, total = await check_comment_total_async(client, uid)
+    return None if total is None else {"total": total}
 
 
-async def transform_and_save_results(results, output_folder, page, file_semaphore):
+def pack_uids(json_path, ids_path):
     """
-    Transform results into the desired format and save them to a JSON file.
-    """
-    transformed_data = {
-        str(item[0]): {"total": item[1]} for item in results if item is not None
-    }
-
-    os.makedirs(output_folder, exist_ok=True)
-    output_file = os.path.join(output_folder, f"page_{page}.json")
-    async with file_semaphore:  # Limit concurrent file writes
-        async with aiofiles.open(output_file, 'w') as f:
-            await f.write(json.dumps(transformed_data, separators=(',', ':')))
-
-
-async def process_chunk_async(session, chunk):
-    """ 
-    Asynchronously process a chunk of UIDs and return results.
+    Pack the user ids of uids.json into a numpy array, unless it is up to date.
+    Returns True when the ids were packed, e.g. after uids.json was refreshed.
     """
-    tasks = [check_comment_total_async(session, uid) for uid in chunk]
-    return await asyncio.gather(*tasks, return_exceptions=False)
+    if os.path.exists(ids_path) and os.path.getmtime(ids_path) >= os.path.getmtime(json_path):
+        return False
+    pack_json_ids(json_path, ids_path)
+    return True
 
 
-async def process_all_chunks_sequentially(uids, chunk_size, output_folder, start_page=1):
+async def enrich_comment_totals(uids, output_folder, block_size=1000, window=1000, reset=False):
     """
-    Process all UIDs in chunks sequentially with controlled concurrency.
+    Look up the comment total of every user with a sliding window of requests.
+    Progress is saved in a manifest: blocks already done by a previous run
+    are skipped, failed and missing blocks are fetched again.
+    Blocks are positions in the ids, so reset the manifest when the ids change.
+    Request metrics are written to metrics.json and metrics.prom in the output folder.
     """
-    connector = aiohttp.TCPConnector(limit=1000)  # Increase connection pool size
-    file_semaphore = asyncio.Semaphore(50)  # Limit concurrent file writes to 50
-    async with aiohttp.ClientSession(connector=connector) as session:
-        chunks_total = sum(1 for _ in chunked_iterable(uids, chunk_size))
-        for page, chunk in enumerate(chunked_iterable(uids, chunk_size), start=1):
-            if page < start_page:
-                continue  # Skip already processed pages
-            start_time = time.time()
-            results = await process_chunk_async(session, chunk)
-            await transform_and_save_results(results, output_folder, page, file_semaphore)
-            end_time = time.time()
-            print(f"Processed chunk {page} / {chunks_total} in {end_time - start_time:.2f} seconds")
+    enricher = EntityEnricher("comment_totals", comment_total, output_folder, block_size, window)
+    if reset:
+        enricher.manifest.reset(ids=len(uids))
+    gaps = await enricher.run(uids)
+    print(enricher.metrics.report())
+    return gaps
 
 
 # Main processing.
-uids = json.load(open('data/json/uids.json', 'r'))
-output_folder = 'output'
-os.makedirs(output_folder, exist_ok=True)
-
-chunk_size = 1000
-start_page = int(sys.argv[1])  # Restart from page N
-
-# Feature flag for testing.
-TEST_MODE = False
-if TEST_MODE:
-    i_start = 0
-    i_stop = 20000
-    uids = uids[i_start:i_stop]
-
-start_time = time.time()
-asyncio.run(process_all_chunks_sequentially(uids, chunk_size, output_folder, start_page=start_page))
-end_time = time.time()
-print(f"Processed all chunks in {end_time - start_time:.2f} seconds")
+if __name__ == "__main__":
+    # Ids are streamed from a packed array, converted again whenever uids.json changes.
+    ids_file = 'data/json/uids.npy'
+    repacked = pack_uids('data/json/uids.json', ids_file)
+    uids = load_ids(ids_file)
+    output_folder = 'output'
+
+    # Feature flag for testing.
+    TEST_MODE = False
+    if TEST_MODE:
+        i_start = 0
+        i_stop = 20000
+        uids = uids[i_start:i_stop]
+
+    start_time = time.time()
+    asyncio.run(enrich_comment_totals(uids, output_folder, reset=repacked))
+    end_time = time.time()
+    print(f"Processed all users in {end_time - start_time:.2f} seconds")